@@ -0,0 +1,176 @@
+"""
+Times the import and the DagBag parse of every DAG file under dags/.
+
+Every file is measured in a fresh interpreter, like the scheduler's DAG
+file processors do: the plain import (with `-X importtime`, to report the
+slowest modules and the import chain leading to them) and, when Airflow is
+installed, a `DagBag` parse of that file alone.
+
+    python benchmarks/dag_parse.py --runs 3 --max-seconds 2 \
+        --baseline previous.json --max-regression 0.25 --output current.json
+
+Exits with status 1 when a file parses slower than `--max-seconds`, or
+more than `--max-regression` slower than in the baseline results.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAGS = os.path.join(ROOT, 'dags')
+PLUGINS = os.path.join(ROOT, 'plugins')
+
+IMPORT_CODE = '''
+import importlib.util, sys, time
+sys.path[:0] = [{dags!r}, {plugins!r}]
+started_at = time.perf_counter()
+spec = importlib.util.spec_from_file_location('dag_under_test', {path!r})
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+print(time.perf_counter() - started_at)
+'''
+
+DAGBAG_CODE = '''
+import sys, time
+sys.path[:0] = [{dags!r}, {plugins!r}]
+from airflow.models import DagBag
+started_at = time.perf_counter()
+dagbag = DagBag(dag_folder={path!r}, include_examples=False)
+print(time.perf_counter() - started_at)
+print(len(dagbag.dags), len(dagbag.import_errors))
+'''
+
+
+def dag_files():
+    for root, _, files in os.walk(DAGS):
+        for name in sorted(files):
+            if name.endswith('.py') and name != '__init__.py':
+                yield os.path.join(root, name)
+
+
+def run_python(code, *flags):
+    return subprocess.run([sys.executable] + list(flags) + ['-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def parse_importtime(stderr):
+    """returns the (module, self us, cumulative us, depth) of every import
+    reported by `-X importtime`, in report order (children first)"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        depth = (len(module) - len(module.lstrip())) // 2
+        imports.append((module.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def import_chain(imports, index):
+    """returns the chain of modules that led to the import at `index`"""
+    chain = [imports[index][0]]
+    depth = imports[index][3]
+    # parents are reported after their children, with a smaller depth
+    for module, _, _, module_depth in imports[index + 1:]:
+        if module_depth < depth:
+            chain.append(module)
+            depth = module_depth
+    return ' <- '.join(chain)
+
+
+def measure(path, runs, top):
+    formatted = dict(dags=DAGS, plugins=PLUGINS, path=path)
+    result = {'file': os.path.relpath(path, ROOT)}
+
+    import_samples = []
+    for _ in range(runs):
+        process = run_python(IMPORT_CODE.format(**formatted), '-X', 'importtime')
+        if process.returncode:
+            result['error'] = process.stderr.strip().splitlines()[-1]
+            return result
+        import_samples.append(float(process.stdout.split()[-1]))
+    result['import_seconds'] = statistics.median(import_samples)
+
+    imports = parse_importtime(process.stderr)
+    slowest = sorted(range(len(imports)), key=lambda i: imports[i][1], reverse=True)
+    result['slowest_imports'] = [
+        {'module': imports[i][0], 'self_us': imports[i][1],
+         'cumulative_us': imports[i][2], 'chain': import_chain(imports, i)}
+        for i in slowest[:top]
+    ]
+
+    parse_samples = []
+    for _ in range(runs):
+        process = run_python(DAGBAG_CODE.format(**formatted))
+        if process.returncode:
+            break
+        seconds, counts = process.stdout.strip().splitlines()[-2:]
+        parse_samples.append(float(seconds))
+        result['dags'], result['import_errors'] = map(int, counts.split())
+    if parse_samples:
+        result['parse_seconds'] = statistics.median(parse_samples)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=5,
+                        help='number of slowest imports reported per file')
+    parser.add_argument('--max-seconds', type=float,
+                        help='fail when a file takes longer to parse')
+    parser.add_argument('--baseline', help='results of a previous run')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = [measure(path, args.runs, args.top) for path in dag_files()]
+    results.sort(key=lambda r: r.get('parse_seconds', r.get('import_seconds', 0)),
+                 reverse=True)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = {r['file']: r for r in json.load(baseline_file)['results']}
+
+    failures = []
+    for result in results:
+        if 'error' in result:
+            print('{file}: {error}'.format(**result))
+            failures.append(result['file'])
+            continue
+
+        seconds = result.get('parse_seconds', result['import_seconds'])
+        print('{file}: import {imp:.3f}s, parse {parse}'.format(
+            file=result['file'], imp=result['import_seconds'],
+            parse='{:.3f}s'.format(result['parse_seconds'])
+            if 'parse_seconds' in result else 'n/a (airflow not installed)'))
+        for slow in result['slowest_imports']:
+            print('    {self_us:>8} us  {chain}'.format(**slow))
+
+        if args.max_seconds is not None and seconds > args.max_seconds:
+            failures.append(result['file'])
+            print('    FAIL: slower than {:.3f}s'.format(args.max_seconds))
+
+        previous = baseline.get(result['file'])
+        if previous:
+            previous_seconds = previous.get('parse_seconds', previous.get('import_seconds'))
+            if previous_seconds and seconds > previous_seconds * (1 + args.max_regression):
+                failures.append(result['file'])
+                print('    FAIL: {:.3f}s in the baseline'.format(previous_seconds))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'python': sys.version, 'results': results}, output_file, indent=2)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
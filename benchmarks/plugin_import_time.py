@@ -0,0 +1,109 @@
+"""
+Measures what importing the ddi plugin costs a fresh Airflow process.
+
+Every sample runs in a new interpreter, like a LocalExecutor task does,
+and lets `airflow.plugins_manager` load the plugins folder, as Airflow
+does: `baseline` points AIRFLOW__CORE__PLUGINS_FOLDER at an empty folder,
+`lazy` at plugins/ with the lazy registry, and `eager` at plugins/ while
+resolving every registered class, as the plugin did before. Run it inside
+the Airflow image:
+
+    python benchmarks/plugin_import_time.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGINS = os.path.join(ROOT, 'plugins')
+
+HEAVY_MODULES = ('boto3', 'botocore', 'paramiko', 'pysftp', 'oauthlib',
+                 'requests_oauthlib')
+
+LOAD_PLUGINS = 'import airflow.plugins_manager'
+RESOLVE_PLUGINS = ('; [registered.resolve() for plugin in airflow.plugins_manager.plugins '
+                   'for registered in plugin.operators + plugin.hooks + plugin.sensors '
+                   'if hasattr(registered, "resolve")]')
+
+# scenario: (plugins folder, code), None stands for an empty folder
+SCENARIOS = {
+    'baseline': (None, LOAD_PLUGINS),
+    'lazy': (PLUGINS, LOAD_PLUGINS),
+    'eager': (PLUGINS, LOAD_PLUGINS + RESOLVE_PLUGINS),
+}
+
+REPORT = ('import sys, time; started_at = time.perf_counter(); {code}; '
+          'print(time.perf_counter() - started_at); '
+          'print(",".join(m for m in {heavy!r} if m in sys.modules))')
+
+
+def scenario_env(plugins_folder):
+    """returns the environment of a process loading `plugins_folder`"""
+    return dict(os.environ, AIRFLOW__CORE__PLUGINS_FOLDER=plugins_folder)
+
+
+def run_scenario(plugins_folder, code):
+    """returns the import seconds and the heavy modules loaded by `code`"""
+    env = scenario_env(plugins_folder)
+    output = subprocess.check_output(
+        [sys.executable, '-c', REPORT.format(code=code, heavy=HEAVY_MODULES)],
+        env=env, universal_newlines=True)
+    seconds, heavy = output.strip().splitlines()[-2:]
+    return float(seconds), heavy
+
+
+def slowest_imports(plugins_folder, code, top):
+    """returns the `top` modules with the largest cumulative import time"""
+    env = scenario_env(plugins_folder)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            env=env, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), module.rstrip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of slowest imports listed per scenario')
+    args = parser.parse_args()
+
+    empty_folder = tempfile.mkdtemp(prefix='empty-plugins-')
+    scenarios = {name: (folder or empty_folder, code)
+                 for name, (folder, code) in SCENARIOS.items()}
+
+    medians = {}
+    for name, (folder, code) in scenarios.items():
+        samples = []
+        for _ in range(args.runs):
+            seconds, heavy = run_scenario(folder, code)
+            samples.append(seconds)
+        medians[name] = statistics.median(samples)
+        print('{name:>8}: median {ms:7.1f} ms over {runs} runs, heavy modules: {heavy}'
+              .format(name=name, ms=medians[name] * 1000, runs=args.runs,
+                      heavy=heavy or '-'))
+
+    print('plugin cost, lazy: {lazy:.1f} ms, eager: {eager:.1f} ms'.format(
+        lazy=(medians['lazy'] - medians['baseline']) * 1000,
+        eager=(medians['eager'] - medians['baseline']) * 1000))
+
+    for name in ('lazy', 'eager'):
+        print('\nslowest imports ({name}), cumulative us:'.format(name=name))
+        for cumulative, module in slowest_imports(*scenarios[name], args.top):
+            print('{cumulative:>10}  {module}'.format(cumulative=cumulative,
+                                                      module=module))
+    os.rmdir(empty_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Runs the DDI operators end to end against the local stand-ins of
+benchmarks/standins.py, without network access, and reports throughput,
+request counts and peak memory.
+
+Every case runs in a fresh interpreter, so the peak RSS of one does not
+hide the others. The scenarios are parametrised by file count, file
+size, page count and job duration; `--quick` runs a small matrix.
+
+    python benchmarks/suite.py --quick --output results.json
+    python benchmarks/suite.py --scenario s3_to_sftp --baseline results.json
+
+Needs Airflow with the S3, SFTP and HTTP hooks installed, like the
+workers. S3 is replaced by a stand-in keeping the objects in a temporary
+directory, the SFTP, HTTP and Livy servers run in the benchmark process.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGINS = os.path.join(ROOT, 'plugins')
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+MB = 1024 * 1024
+
+# scenario -> list of parameters, (full matrix, quick matrix)
+MATRIX = {
+    's3_to_sftp': (
+        [dict(files=files, file_size=size, streaming=streaming, max_concurrency=concurrency)
+         for files, size in ((100, 64 * 1024), (10, 16 * MB), (2, 128 * MB))
+         for streaming, concurrency in ((False, 1), (True, 1), (True, 4))],
+        [dict(files=20, file_size=MB, streaming=streaming, max_concurrency=concurrency)
+         for streaming, concurrency in ((False, 1), (True, 4))]
+    ),
+    'sftp_to_s3': (
+        [dict(files=files, file_size=size, streaming=streaming)
+         for files, size in ((100, 64 * 1024), (10, 16 * MB), (2, 128 * MB))
+         for streaming in (False, True)],
+        [dict(files=20, file_size=MB, streaming=streaming) for streaming in (False, True)]
+    ),
+    'https_to_s3': (
+        [dict(payload_size=size, streaming=streaming)
+         for size in (MB, 64 * MB, 256 * MB) for streaming in (False, True)],
+        [dict(payload_size=8 * MB, streaming=streaming) for streaming in (False, True)]
+    ),
+    'https_to_s3_pages': (
+        [dict(pages=pages, page_workers=workers)
+         for pages in (10, 100, 500) for workers in (1, 8)],
+        [dict(pages=20, page_workers=workers) for workers in (1, 4)]
+    ),
+    'livy_batch': (
+        [dict(duration=duration, lines_per_second=lines)
+         for duration in (10, 60, 300) for lines in (10, 1000)],
+        [dict(duration=5, lines_per_second=100)]
+    ),
+}
+
+
+def seed_s3(client, workdir, bucket, prefix, files, file_size):
+    seed_directory(os.path.join(workdir, 'seed'), 1, file_size)
+    seed_file = os.path.join(workdir, 'seed', 'part-00000.csv')
+    for index in range(files):
+        client.upload_file(seed_file, bucket, '{}/part-{:05d}.csv'.format(prefix, index))
+    client.requests.clear()
+    client.bytes_in = 0
+
+
+def seed_directory(path, files, file_size):
+    os.makedirs(path, exist_ok=True)
+    block = os.urandom(min(file_size, MB))
+    for index in range(files):
+        with open(os.path.join(path, 'part-{:05d}.csv'.format(index)), 'wb') as local_file:
+            remaining = file_size
+            while remaining:
+                local_file.write(block[:remaining])
+                remaining -= min(remaining, len(block))
+
+
+def patch_s3(workdir):
+    """makes the operators use a local S3, returns its client"""
+    import airflow.hooks.S3_hook
+    from standins import LocalS3Client, LocalS3Hook
+
+    LocalS3Hook.client = LocalS3Client(os.path.join(workdir, 's3'))
+    airflow.hooks.S3_hook.S3Hook = LocalS3Hook
+    return LocalS3Hook.client
+
+
+def start_sftp(root):
+    from standins import LocalSFTPServer
+
+    server = LocalSFTPServer(root).start()
+    os.environ['AIRFLOW_CONN_BENCH_SFTP'] = server.connection_uri()
+    return server
+
+
+def start_http(**kwargs):
+    from standins import LocalHTTPServer
+
+    server = LocalHTTPServer(**kwargs).start()
+    os.environ['AIRFLOW_CONN_BENCH_HTTP'] = 'http://127.0.0.1:{}'.format(server.port)
+    return server
+
+
+def run_s3_to_sftp(workdir, files, file_size, streaming, max_concurrency):
+    from s3_to_sftp_operator import S3ToSFTPOperator
+
+    s3_client = patch_s3(workdir)
+    seed_s3(s3_client, workdir, 'bench', 'in', files, file_size)
+    os.makedirs(os.path.join(workdir, 'sftp', 'out'))
+    sftp_server = start_sftp(os.path.join(workdir, 'sftp'))
+
+    operator = S3ToSFTPOperator(
+        task_id='bench', s3_bucket='bench', s3_prefix='in', sftp_filename_prefix='',
+        sftp_path='/out', sftp_conn_id='bench_sftp', s3_conn_id='bench_s3',
+        streaming=streaming, max_concurrency=max_concurrency)
+    started_at = perf_counter()
+    operator.execute({})
+    seconds = perf_counter() - started_at
+    sftp_server.stop()
+
+    return dict(seconds=seconds, files=files, bytes=files * file_size,
+                requests={'s3': dict(s3_client.requests),
+                          'sftp': dict(sftp_server.requests)})
+
+
+def run_sftp_to_s3(workdir, files, file_size, streaming):
+    from sftp_to_s3_operator import SFTPToS3Operator
+
+    s3_client = patch_s3(workdir)
+    seed_directory(os.path.join(workdir, 'sftp', 'in'), files, file_size)
+    sftp_server = start_sftp(os.path.join(workdir, 'sftp'))
+
+    operator = SFTPToS3Operator(
+        task_id='bench', s3_bucket='bench', s3_prefix='out', sftp_path='/in',
+        sftp_conn_id='bench_sftp', s3_conn_id='bench_s3', streaming=streaming)
+    started_at = perf_counter()
+    operator.execute({})
+    seconds = perf_counter() - started_at
+    sftp_server.stop()
+
+    return dict(seconds=seconds, files=files, bytes=files * file_size,
+                requests={'s3': dict(s3_client.requests),
+                          'sftp': dict(sftp_server.requests)})
+
+
+def run_https_to_s3(workdir, payload_size, streaming):
+    from https_to_s3_operator import HTTPSToS3Operator
+
+    s3_client = patch_s3(workdir)
+    http_server = start_http()
+
+    operator = HTTPSToS3Operator(
+        task_id='bench', api_endpoint='data?size={}'.format(payload_size),
+        s3_bucket='bench', s3_prefix='out', s3_conn_id='bench_s3',
+        http_conn_id='bench_http', timeout=60, streaming=streaming)
+    started_at = perf_counter()
+    operator.execute({})
+    seconds = perf_counter() - started_at
+    http_server.stop()
+
+    return dict(seconds=seconds, files=1, bytes=s3_client.bytes_in,
+                requests={'s3': dict(s3_client.requests),
+                          'http': dict(http_server.requests)})
+
+
+def run_https_to_s3_pages(workdir, pages, page_workers):
+    from https_to_s3_operator import HTTPSToS3Operator, PagePagination
+
+    s3_client = patch_s3(workdir)
+    http_server = start_http(pages=pages)
+
+    operator = HTTPSToS3Operator(
+        task_id='bench', api_endpoint='items', s3_bucket='bench', s3_prefix='out',
+        s3_conn_id='bench_s3', http_conn_id='bench_http', timeout=60,
+        pagination=PagePagination(items_field='items', total_pages_field='total_pages'),
+        page_workers=page_workers)
+    started_at = perf_counter()
+    operator.execute({})
+    seconds = perf_counter() - started_at
+    http_server.stop()
+
+    return dict(seconds=seconds, files=pages, bytes=s3_client.bytes_in,
+                requests={'s3': dict(s3_client.requests),
+                          'http': dict(http_server.requests)})
+
+
+def run_livy_batch(workdir, duration, lines_per_second):
+    from contextlib import redirect_stdout
+    from livy_operator import LivyOperator
+    from standins import FakeLivyServer
+
+    livy_server = FakeLivyServer(duration=duration,
+                                 lines_per_second=lines_per_second).start()
+
+    operator = LivyOperator(
+        task_id='bench', host='127.0.0.1', port=livy_server.port,
+        entry_point='s3://bench/main.py', record_history=False)
+    started_at = perf_counter()
+    # the client prints the driver log, keep it out of the results
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        operator.execute({})
+    seconds = perf_counter() - started_at
+    livy_server.stop()
+
+    return dict(seconds=seconds, overhead_seconds=seconds - duration,
+                log_lines=int(duration * lines_per_second),
+                requests={'livy': dict(livy_server.requests)})
+
+
+def run_case(scenario, params):
+    """runs one case in this interpreter, returns its measurements"""
+    sys.path[:0] = [PLUGINS, BENCHMARKS]
+    workdir = tempfile.mkdtemp(prefix='ddi-bench-')
+    try:
+        result = globals()['run_' + scenario](workdir, **params)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    seconds = max(result['seconds'], 1e-9)
+    if 'bytes' in result:
+        result['mb_per_second'] = result['bytes'] / MB / seconds
+        result['files_per_second'] = result['files'] / seconds
+    result['request_count'] = sum(count for requests in result['requests'].values()
+                                  for count in requests.values())
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_isolated(scenario, params):
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', scenario, json.dumps(params)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        return {'error': process.stderr.strip().splitlines()[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def case_name(scenario, params):
+    return '{}({})'.format(scenario, ', '.join(
+        '{}={}'.format(key, value) for key, value in sorted(params.items())))
+
+
+def report(name, result, previous):
+    if 'error' in result:
+        print('{}: {}'.format(name, result['error']))
+        return
+    line = '{}: {:.2f}s'.format(name, result['seconds'])
+    if 'mb_per_second' in result:
+        line += ', {:.1f} MB/s, {:.1f} files/s'.format(result['mb_per_second'],
+                                                       result['files_per_second'])
+    line += ', {} requests, peak RSS {:.0f} MB'.format(result['request_count'],
+                                                       result['peak_rss_mb'])
+    if previous and 'seconds' in previous:
+        line += ' (baseline {:.2f}s)'.format(previous['seconds'])
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=sorted(MATRIX),
+                        help='run only these scenarios')
+    parser.add_argument('--quick', action='store_true', help='run the small matrix')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--child', nargs=2, metavar=('SCENARIO', 'PARAMS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scenario, params = args.child
+        print(json.dumps(run_case(scenario, json.loads(params))))
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = {r['case']: r for r in json.load(baseline_file)['results']}
+
+    results = []
+    for scenario in args.scenario or sorted(MATRIX):
+        for params in MATRIX[scenario][1 if args.quick else 0]:
+            name = case_name(scenario, params)
+            result = dict(run_isolated(scenario, params), case=name,
+                          scenario=scenario, params=params)
+            report(name, result, baseline.get(name))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'python': sys.version, 'results': results}, output_file, indent=2)
+
+    if any('error' in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Content-addressed staging of the Spark job packages.
+
+The release tooling stages the egg and `libs.zip` of every version with
+
+    python dags/artifacts.py s3://binaries my_package 1.2.0 \
+        dist/my_package-1.2.0-py3.7.egg dist/libs.zip
+
+Each file is stored once under `<binary_repository>/cas/<sha256>/<file name>`:
+a file already in the repository (eg. the `libs.zip` of the previous
+version) is not uploaded again, and keeps its path, so YARN keeps it in its
+localization cache. The staged paths are recorded in a local index, shipped
+with the DAGs, which maps the legacy path
+`<binary_repository>/<package>/<version>/<file name>` to the hashed one.
+
+At DAG-parse time `resolve` is a lookup in that index, without any hashing
+or network access. Paths missing from the index resolve to themselves.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional, Tuple
+
+CAS_DIR = 'cas'
+INDEX_VERSION = 1
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    'DDI_ARTIFACT_INDEX',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifact_index.json'))
+
+# ((index path, mtime_ns, size), artifacts) of the last index read
+_loaded_index = (None, {})  # type: Tuple[Optional[Tuple], Dict[str, Dict]]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as artifact_file:
+        for chunk in iter(lambda: artifact_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def legacy_path(binary_repository: str, package: str, version: str, name: str) -> str:
+    """returns the path the artifact had before content addressing"""
+    return os.path.join(binary_repository, package, version, name)
+
+
+def cas_path(binary_repository: str, sha256: str, name: str) -> str:
+    return os.path.join(binary_repository, CAS_DIR, sha256, name)
+
+
+def index_fingerprint(index_path: str = DEFAULT_INDEX_PATH) -> Optional[Tuple[int, int]]:
+    """returns the (mtime_ns, size) of the index, None when there is none"""
+    try:
+        stat = os.stat(index_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_index(index_path: str = DEFAULT_INDEX_PATH) -> Dict[str, Dict]:
+    """returns the artifacts of the index by legacy path, read again only
+    when the index file changed"""
+    global _loaded_index
+    fingerprint = index_fingerprint(index_path)
+    if fingerprint is None:
+        return {}
+    key = (index_path,) + fingerprint
+    if _loaded_index[0] != key:
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        artifacts = index['artifacts'] if index.get('version') == INDEX_VERSION else {}
+        _loaded_index = (key, artifacts)
+    return _loaded_index[1]
+
+
+def resolve(path: str, index_path: str = DEFAULT_INDEX_PATH) -> str:
+    """returns the content-addressed path of a staged artifact, `path`
+    itself when it was not staged"""
+    artifact = read_index(index_path).get(path)
+    return artifact['path'] if artifact else path
+
+
+def write_index(artifacts: Dict[str, Dict], index_path: str = DEFAULT_INDEX_PATH):
+    """replaces the index through a rename, so a parsing scheduler never
+    reads a partial one"""
+    directory = os.path.dirname(index_path) or '.'
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as index_file:
+        json.dump({'version': INDEX_VERSION, 'artifacts': artifacts}, index_file,
+                  indent=2, sort_keys=True)
+    os.replace(temporary_path, index_path)
+
+
+class LocalRepository:
+    """binary repository on a (mounted) file system"""
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def upload(self, local_path: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + '.tmp'
+        shutil.copyfile(local_path, temporary_path)
+        os.replace(temporary_path, path)
+
+
+class S3Repository:
+    """
+    binary repository in S3, addressed with s3:// paths
+
+    :param s3_client: boto3 S3 client
+    """
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    @staticmethod
+    def _split(path: str) -> Tuple[str, str]:
+        bucket, _, key = path[len('s3://'):].partition('/')
+        return bucket, key
+
+    def exists(self, path: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        bucket, key = self._split(path)
+        try:
+            self.s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def upload(self, local_path: str, path: str):
+        bucket, key = self._split(path)
+        self.s3_client.upload_file(local_path, bucket, key)
+
+
+def stage(local_path: str, binary_repository: str, package: str, version: str,
+          repository, artifacts: Dict[str, Dict]) -> Dict:
+    """
+    stores the file content-addressed in the repository unless it is already
+    there, records it in `artifacts` and returns its index entry
+    """
+    name = os.path.basename(local_path)
+    sha256 = file_sha256(local_path)
+    path = cas_path(binary_repository, sha256, name)
+    uploaded = not repository.exists(path)
+    if uploaded:
+        repository.upload(local_path, path)
+
+    artifact = {'path': path, 'sha256': sha256, 'size': os.path.getsize(local_path)}
+    artifacts[legacy_path(binary_repository, package, version, name)] = artifact
+    return dict(artifact, uploaded=uploaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('binary_repository')
+    parser.add_argument('package')
+    parser.add_argument('version')
+    parser.add_argument('files', nargs='+', help='the egg, libs.zip, ...')
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.binary_repository.startswith('s3://'):
+        import boto3
+        repository = S3Repository(boto3.client('s3'))
+    else:
+        repository = LocalRepository()
+
+    artifacts = dict(read_index(args.index))
+    for local_path in args.files:
+        artifact = stage(local_path, args.binary_repository, args.package, args.version,
+                         repository, artifacts)
+        print('{action} {path} ({size} bytes)'.format(
+            action='uploaded' if artifact['uploaded'] else 'unchanged', **artifact))
+    write_index(artifacts, args.index)
+
+
+if __name__ == '__main__':
+    main()
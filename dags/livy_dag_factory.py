@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from artifacts import index_fingerprint
+from utils import (PY_MAJOR, get_application_args, get_entrypoint_path,
+                   get_python_files, get_python_interpreter_spark_configuration)
+
+log = logging.getLogger(__name__)
+
+CONFIG_EXTENSIONS = ('.yaml', '.yml', '.json')
+
+# bump when the derived spec changes, to invalidate the existing caches
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    'LIVY_DAG_FACTORY_CACHE',
+    os.path.join(tempfile.gettempdir(), 'livy_dag_factory_cache.json'))
+
+
+def _load_config(path: str, content: bytes) -> Dict[str, Any]:
+    if path.endswith('.json'):
+        return json.loads(content.decode('utf-8'))
+    # only paid when a config changed
+    import yaml
+    return yaml.safe_load(content)
+
+
+def derive_spec(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    returns the DAG arguments and the LivyOperator arguments described by a
+    job config, eg.
+
+        dag_id: team_x_sales_daily
+        schedule_interval: '0 3 * * *'
+        start_date: '2020-03-23'
+        default_args: {owner: team_x, retries: 1}
+        livy: {host: livy, port: 8998}
+        job_conf: {binary_repository: ..., package: sales, version: 1.2.0,
+                   app: daily, spark_python_interpreter: ...}
+        job_args: ['--date', '{{ ds }}']
+        spark_conf: {spark.executor.memory: 4g}
+        operator_args: {poll_interval: 5}
+    """
+    # yaml reads versions such as 1.2 as numbers
+    job_conf = {key: str(value) if value is not None else None
+                for key, value in config['job_conf'].items()}
+    job_conf.setdefault('spark_python_interpreter', None)
+
+    spark_conf = get_python_interpreter_spark_configuration(job_conf)
+    spark_conf.update(config.get('spark_conf') or {})
+
+    operator_args = {
+        'task_id': config.get('task_id', 'spark_job'),
+        'host': config['livy']['host'],
+        'port': config['livy'].get('port', 8998),
+        'entry_point': get_entrypoint_path(job_conf),
+        'python_files': get_python_files(job_conf),
+        'application_args': get_application_args(job_conf, config.get('job_args') or []),
+        'app_name': config.get('app_name', config['dag_id']),
+        'spark_conf': spark_conf,
+    }
+    operator_args.update(config.get('operator_args') or {})
+
+    return {
+        'dag_id': config['dag_id'],
+        'description': config.get('description'),
+        'schedule_interval': config.get('schedule_interval'),
+        'start_date': str(config['start_date']),
+        'catchup': config.get('catchup', False),
+        'default_args': config.get('default_args') or {},
+        'operator_args': operator_args,
+    }
+
+
+class SpecCache:
+    """
+    Derived specs of the job configs, persisted between scheduler parses.
+
+    A config whose mtime and size did not change is not even read, one
+    that was touched but has the same content hash is not parsed again.
+    The whole cache is dropped when the artifact index changed, since the
+    specs hold the resolved python files.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.changed = False
+        self.entries = {}  # type: Dict[str, Dict[str, Any]]
+        fingerprint = index_fingerprint()
+        self.artifact_index = list(fingerprint) if fingerprint else None
+        try:
+            with open(path) as cache_file:
+                cached = json.load(cache_file)
+            if (cached.get('version') == CACHE_VERSION and cached.get('python') == PY_MAJOR
+                    and cached.get('artifact_index') == self.artifact_index):
+                self.entries = cached['entries']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def get(self, path: str) -> Dict[str, Any]:
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry['spec']
+
+        with open(path, 'rb') as config_file:
+            content = config_file.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if not entry or entry['sha256'] != digest:
+            entry = {'sha256': digest, 'spec': derive_spec(_load_config(path, content))}
+        entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        self.entries[path] = entry
+        self.changed = True
+        return entry['spec']
+
+    def prune(self, paths: List[str]):
+        for path in set(self.entries) - set(paths):
+            del self.entries[path]
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.path) or '.'
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as cache_file:
+            json.dump({'version': CACHE_VERSION, 'python': PY_MAJOR,
+                       'artifact_index': self.artifact_index,
+                       'entries': self.entries}, cache_file)
+        os.replace(temporary_path, self.path)
+        self.changed = False
+
+
+def load_specs(config_dir: str, cache_path: Optional[str] = DEFAULT_CACHE_PATH):
+    """returns the specs of every job config of `config_dir`, skipping (and
+    logging) the invalid ones"""
+    paths = sorted(
+        os.path.join(config_dir, name) for name in os.listdir(config_dir)
+        if name.endswith(CONFIG_EXTENSIONS)
+    )
+    cache = SpecCache(cache_path) if cache_path else SpecCache(os.devnull)
+
+    specs = []
+    for path in paths:
+        try:
+            specs.append(cache.get(path))
+        except Exception:
+            log.exception('invalid livy job config %s', path)
+
+    if cache_path:
+        cache.prune(paths)
+        try:
+            cache.save()
+        except OSError:
+            log.warning('could not write the livy dag factory cache %s', cache_path)
+    return specs
+
+
+def build_livy_dags(config_dir: str, cache_path: Optional[str] = DEFAULT_CACHE_PATH):
+    """returns the DAGs built from the job configs of `config_dir`, by dag id"""
+    from airflow import DAG
+    from airflow.operators.ddi_plugin import LivyOperator
+
+    dags = {}
+    for spec in load_specs(config_dir, cache_path):
+        dag_kwargs = {
+            key: spec[key] for key in ('description', 'schedule_interval', 'catchup')
+            if spec[key] is not None
+        }
+        dag = DAG(
+            spec['dag_id'],
+            start_date=datetime.fromisoformat(spec['start_date']),
+            default_args=dict(spec['default_args']),
+            **dag_kwargs
+        )
+        LivyOperator(dag=dag, **spec['operator_args'])
+        dags[spec['dag_id']] = dag
+    return dags
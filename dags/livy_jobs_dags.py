@@ -0,0 +1,7 @@
+import os
+
+# the scheduler only parses files mentioning both airflow and DAG
+from airflow import DAG  # noqa: F401
+from livy_dag_factory import build_livy_dags
+
+globals().update(build_livy_dags(os.path.join(os.path.dirname(__file__), 'livy_jobs')))
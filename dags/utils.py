@@ -1,16 +1,91 @@
 import os
+import re
+import sys
+from functools import lru_cache
 from typing import Dict, List
 
-import pkg_resources
+from artifacts import resolve
 
+# python version tag of the eggs, as used by setuptools
+PY_MAJOR = '{}.{}'.format(*sys.version_info)
 
+# PEP 440 version pattern, as used by setuptools to normalise egg versions
+VERSION_PATTERN = re.compile(r'''
+    ^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?P<pre>
+        [-_\.]?
+        (?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)
+        [-_\.]?
+        (?P<pre_n>[0-9]+)?
+    )?
+    (?P<post>
+        (?:-(?P<post_n1>[0-9]+))
+        |
+        (?:
+            [-_\.]?
+            (?P<post_l>post|rev|r)
+            [-_\.]?
+            (?P<post_n2>[0-9]+)?
+        )
+    )?
+    (?P<dev>
+        [-_\.]?
+        (?P<dev_l>dev)
+        [-_\.]?
+        (?P<dev_n>[0-9]+)?
+    )?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?
+    \s*$
+''', re.VERBOSE | re.IGNORECASE)
+
+PRE_RELEASE_PHASES = {'a': 'a', 'alpha': 'a', 'b': 'b', 'beta': 'b',
+                      'c': 'rc', 'rc': 'rc', 'pre': 'rc', 'preview': 'rc'}
+
+
+def _safe_name(name: str) -> str:
+    return re.sub('[^A-Za-z0-9.]+', '-', name)
+
+
+def _safe_version(version: str) -> str:
+    """normalises a version the way setuptools does"""
+    match = VERSION_PATTERN.match(version)
+    if not match:
+        return re.sub('[^A-Za-z0-9.]+', '-', version.replace(' ', '.'))
+
+    parts = []
+    if match.group('epoch') and int(match.group('epoch')):
+        parts.append('{}!'.format(int(match.group('epoch'))))
+    parts.append('.'.join(str(int(n)) for n in match.group('release').split('.')))
+    if match.group('pre'):
+        parts.append('{}{}'.format(PRE_RELEASE_PHASES[match.group('pre_l').lower()],
+                                   int(match.group('pre_n') or 0)))
+    if match.group('post'):
+        parts.append('.post{}'.format(int(match.group('post_n1') or
+                                          match.group('post_n2') or 0)))
+    if match.group('dev'):
+        parts.append('.dev{}'.format(int(match.group('dev_n') or 0)))
+    if match.group('local'):
+        local = re.split(r'[-_\.]', match.group('local').lower())
+        parts.append('+' + '.'.join(str(int(part)) if part.isdigit() else part
+                                    for part in local))
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=None)
 def get_egg_name(package: str, version: str):
-    dist = pkg_resources.Distribution(project_name=package, version=version)
-    egg_name = dist.egg_name() + '.egg'
-    return egg_name
+    return '{name}-{version}-py{python}.egg'.format(
+        name=_safe_name(package).replace('-', '_'),
+        version=_safe_version(version).replace('-', '_'),
+        python=PY_MAJOR)
 
 
 def get_python_files(job_conf: Dict[str, str]):
+    """
+    returns the egg and libs.zip of the job, at their content-addressed path
+    when they were staged with `artifacts.py`
+    """
     binary_path = os.path.join(
         job_conf['binary_repository'],
         job_conf['package'],
@@ -19,8 +94,8 @@ def get_python_files(job_conf: Dict[str, str]):
     egg_name = get_egg_name(job_conf['package'], job_conf['version'])
 
     return [
-        os.path.join(binary_path, egg_name),
-        os.path.join(binary_path, 'libs.zip')
+        resolve(os.path.join(binary_path, egg_name)),
+        resolve(os.path.join(binary_path, 'libs.zip'))
     ]
 
 
@@ -1,22 +1,80 @@
+import importlib
+
 from airflow.plugins_manager import AirflowPlugin
 
-from https_to_s3_operator import HTTPSToS3Operator
-from livy_operator import LivyOperator
-from oauth_http_hook import OAuthHttpHook
-from s3_to_sftp_operator import S3ToSFTPOperator
-from sftp_to_s3_operator import SFTPToS3Operator
+
+class LazyPluginClass:
+    """
+    Stands in for an operator or hook class until it is used.
+
+    The plugin manager imports this file in the scheduler, the webserver and
+    every task process, so registering the real classes would import boto3,
+    paramiko and requests_oauthlib everywhere. The module of the class is
+    only imported when the class is instantiated, subclassed, used in an
+    isinstance check or when one of its attributes is read. The plugin
+    modules themselves import their heavy dependencies where they use them,
+    as Airflow 1.10 imports every file of the plugins folder.
+
+    :param module_name: the module defining the class
+    :type module_name: str
+    :param class_name: the name of the class
+    :type class_name: str
+    """
+
+    def __init__(self, module_name: str, class_name: str):
+        self.__name__ = class_name
+        self.__qualname__ = class_name
+        self._module_name = module_name
+        self._resolved = None
+
+    def resolve(self) -> type:
+        """imports and returns the real class"""
+        if self._resolved is None:
+            module = importlib.import_module(self._module_name)
+            self._resolved = getattr(module, self.__name__)
+        return self._resolved
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name in ('_module_name', '_resolved'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __mro_entries__(self, bases):
+        return (self.resolve(),)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self.resolve())
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self.resolve())
+
+    def __repr__(self):
+        return '<lazy {module}.{name}>'.format(module=self._module_name,
+                                               name=self.__name__)
 
 
 class AirflowDDIPlugin(AirflowPlugin):
     name = 'ddi_plugin'
 
     operators = [
-        LivyOperator,
-        S3ToSFTPOperator,
-        SFTPToS3Operator,
-        HTTPSToS3Operator
+        LazyPluginClass('livy_operator.livy_operator', 'LivyOperator'),
+        LazyPluginClass('livy_operator.livy_batch_monitor_operator',
+                        'LivyBatchMonitorOperator'),
+        LazyPluginClass('livy_operator.livy_fan_out_operator', 'LivyFanOutOperator'),
+        LazyPluginClass('livy_operator.livy_session_operator', 'LivySessionOperator'),
+        LazyPluginClass('s3_to_sftp_operator.s3_to_sftp_operator', 'S3ToSFTPOperator'),
+        LazyPluginClass('sftp_to_s3_operator.sftp_to_s3_operator', 'SFTPToS3Operator'),
+        LazyPluginClass('https_to_s3_operator.https_to_s3_operator', 'HTTPSToS3Operator')
     ]
 
     hooks = [
-        OAuthHttpHook,
+        LazyPluginClass('oauth_http_hook.oauth_http_hook', 'OAuthHttpHook'),
+    ]
+
+    sensors = [
+        LazyPluginClass('s3_success_marker_sensor.s3_success_marker_sensor',
+                        'S3SuccessMarkerSensor'),
     ]
@@ -0,0 +1,10 @@
+from ddi_utils.metrics import Metrics, get_metrics
+from ddi_utils.rate_limit import TokenBucket
+from ddi_utils.s3_multipart_upload import S3MultipartUpload
+
+__all__ = [
+    'Metrics',
+    'S3MultipartUpload',
+    'TokenBucket',
+    'get_metrics'
+]
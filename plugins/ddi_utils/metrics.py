@@ -0,0 +1,182 @@
+import atexit
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+Tags = Optional[Dict[str, str]]
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# keeps the packets below the usual MTU, so they are never fragmented
+MAX_PACKET_SIZE = 1432
+
+
+def _key(name: str, tags: Tags) -> MetricKey:
+    return name, tuple(sorted((tags or {}).items()))
+
+
+class Metrics:
+    """
+    Buffered StatsD client, sending DogStatsD tags (`|#key:value`) which the
+    statsd-exporter turns into Prometheus labels.
+
+    Nothing is sent when a metric is recorded: counters are summed and
+    gauges keep their last value per (name, tags) until the next flush,
+    timings are kept as they are. A flush sends everything in as few UDP
+    packets as possible. It happens at most every `flush_interval` seconds
+    while metrics are recorded, when an operator finishes and at exit.
+
+    :param host: the StatsD host, no metric is recorded without one
+    :type host: str
+    :param port: the StatsD port
+    :type port: int
+    :param prefix: prefix of every metric name
+    :type prefix: str
+    :param flush_interval: seconds between two automatic flushes
+    :type flush_interval: float
+    """
+
+    def __init__(self, host: Optional[str] = None, port: int = 8125, prefix: str = 'ddi',
+                 flush_interval: float = 10.0):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.packet_count = 0
+        self._counters = {}  # type: Dict[MetricKey, float]
+        self._gauges = {}  # type: Dict[MetricKey, float]
+        self._timings = []  # type: List[Tuple[MetricKey, float]]
+        self._flushed_at = monotonic()
+        self._lock = threading.Lock()
+        self._socket = None  # type: Optional[socket.socket]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.host)
+
+    def incr(self, name: str, count: float = 1, tags: Tags = None):
+        if not self.enabled:
+            return
+        key = _key(name, tags)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + count
+        self._maybe_flush()
+
+    def gauge(self, name: str, value: float, tags: Tags = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[_key(name, tags)] = value
+        self._maybe_flush()
+
+    def timing(self, name: str, milliseconds: float, tags: Tags = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._timings.append((_key(name, tags), milliseconds))
+        self._maybe_flush()
+
+    @contextmanager
+    def timer(self, name: str, tags: Tags = None):
+        """records the duration of the block as a timing"""
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            self.timing(name, (monotonic() - started_at) * 1000, tags)
+
+    def _line(self, key: MetricKey, value: float, metric_type: str) -> str:
+        name, tags = key
+        line = '{prefix}.{name}:{value:g}|{type}'.format(prefix=self.prefix, name=name,
+                                                         value=value, type=metric_type)
+        if tags:
+            line += '|#' + ','.join('{}:{}'.format(tag, tag_value) for tag, tag_value in tags)
+        return line
+
+    def _packets(self, lines: List[str]):
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > MAX_PACKET_SIZE:
+                yield '\n'.join(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            yield '\n'.join(packet)
+
+    def _maybe_flush(self):
+        if monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """sends the buffered metrics"""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            gauges, self._gauges = self._gauges, {}
+            timings, self._timings = self._timings, []
+            self._flushed_at = monotonic()
+        if not (counters or gauges or timings):
+            return
+
+        lines = [self._line(key, value, 'c') for key, value in counters.items()]
+        lines += [self._line(key, value, 'g') for key, value in gauges.items()]
+        lines += [self._line(key, value, 'ms') for key, value in timings]
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for packet in self._packets(lines):
+                self._socket.sendto(packet.encode('utf-8'), (self.host, self.port))
+                self.packet_count += 1
+        except (OSError, UnicodeError):
+            # metrics must never fail a task
+            pass
+
+
+_metrics = None  # type: Optional[Metrics]
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """returns the process-wide metrics client, configured like the Airflow
+    StatsD client from the `[scheduler] statsd_*` settings. It records
+    nothing when `statsd_on` is off."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            from airflow.configuration import conf
+
+            host = None
+            if conf.getboolean('scheduler', 'statsd_on'):
+                host = conf.get('scheduler', 'statsd_host')
+            _metrics = Metrics(host=host,
+                               port=conf.getint('scheduler', 'statsd_port'),
+                               prefix=conf.get('scheduler', 'statsd_prefix') + '.ddi')
+            atexit.register(_metrics.flush)
+        return _metrics
+
+
+def operator_tags(operator, conn_id: Optional[str] = None) -> Dict[str, str]:
+    """returns the tags identifying the metrics of an operator"""
+    tags = {
+        'operator': type(operator).__name__,
+        'dag_id': operator.dag_id,
+        'task_id': operator.task_id
+    }
+    if conn_id:
+        tags['conn_id'] = conn_id
+    return tags
+
+
+def hook_tags(hook, conn_id: Optional[str] = None) -> Dict[str, str]:
+    """returns the tags identifying the metrics of a hook, with the DAG and
+    task Airflow exports to the environment of the running task"""
+    tags = {'hook': type(hook).__name__}
+    for tag, variable in (('dag_id', 'AIRFLOW_CTX_DAG_ID'), ('task_id', 'AIRFLOW_CTX_TASK_ID')):
+        if os.environ.get(variable):
+            tags[tag] = os.environ[variable]
+    if conn_id:
+        tags['conn_id'] = conn_id
+    return tags
@@ -0,0 +1,44 @@
+import threading
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `acquire` blocks until a token is available.
+    Tokens are added at `rate` per second, up to `capacity`.
+
+    :param rate: tokens added per second
+    :type rate: float
+    :param capacity: maximum number of tokens, ie. the allowed burst
+    :type capacity: float
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """takes the tokens if available and returns 0, otherwise returns
+        the number of seconds until they will be"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            sleep(wait)
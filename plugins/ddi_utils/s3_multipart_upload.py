@@ -0,0 +1,137 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# S3 rejects multipart parts smaller than this, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3MultipartUpload:
+    """
+    File-like writer that uploads what is written to it as an S3 multipart
+    upload, with up to `max_concurrency` parts in flight at once.
+
+    Memory is bounded by `(max_concurrency + 1) * part_size`: `write` blocks
+    while all the upload slots are busy. Objects smaller than one part are
+    uploaded with a single `put_object`. Use it as a context manager, the
+    upload is completed on a clean exit and aborted on an exception.
+
+    :param s3_client: boto3 S3 client, shared by the upload threads
+    :param bucket: the target bucket
+    :type bucket: str
+    :param key: the target key
+    :type key: str
+    :param part_size: bytes per part, at least 5 MiB
+    :type part_size: int
+    :param max_concurrency: number of parts uploaded at once
+    :type max_concurrency: int
+    :param extra_args: extra arguments of the create/put call, eg. Metadata
+    :type extra_args: dict
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str,
+                 part_size: int = 64 * 1024 * 1024, max_concurrency: int = 4,
+                 extra_args: Optional[Dict] = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency
+        self.extra_args = extra_args or {}
+
+        self.upload_id = None  # type: Optional[str]
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._parts = []  # type: List
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.complete()
+        else:
+            self.abort()
+
+    def _upload_part(self, part_number, data):
+        try:
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key,
+                                                  UploadId=self.upload_id,
+                                                  PartNumber=part_number, Body=data)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self._slots.release()
+
+    def _flush_part(self, data):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket,
+                                                              Key=self.key,
+                                                              **self.extra_args)
+            self.upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix='s3-multipart')
+
+        # fail early instead of buffering more parts behind a failed one
+        for part in self._parts:
+            if part.done() and part.exception() is not None:
+                raise part.exception()
+
+        self._slots.acquire()
+        self._parts.append(self._executor.submit(self._upload_part,
+                                                 len(self._parts) + 1, data))
+
+    def write(self, data) -> int:
+        if self._closed:
+            raise ValueError('write to a closed multipart upload')
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._flush_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def complete(self):
+        """uploads the buffered rest and completes the upload"""
+        if self._closed:
+            return
+        self._closed = True
+
+        if self.upload_id is None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key,
+                                      Body=bytes(self._buffer), **self.extra_args)
+            self._buffer = bytearray()
+            return
+
+        try:
+            if self._buffer:
+                self._flush_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = [part.result() for part in self._parts]
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                     UploadId=self.upload_id,
+                                                     MultipartUpload={'Parts': parts})
+        except Exception:
+            self._abort()
+            raise
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _abort(self):
+        for part in self._parts:
+            part.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                  UploadId=self.upload_id)
+
+    def abort(self):
+        """drops the upload, nothing is written to the key"""
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer = bytearray()
+        self._abort()
@@ -1,5 +1,10 @@
 from https_to_s3_operator.https_to_s3_operator import HTTPSToS3Operator
+from https_to_s3_operator.pagination import (CursorPagination, OffsetPagination,
+                                             PagePagination)
 
 __all__ = [
-    'HTTPSToS3Operator'
+    'CursorPagination',
+    'HTTPSToS3Operator',
+    'OffsetPagination',
+    'PagePagination'
 ]
@@ -1,8 +1,15 @@
+import hashlib
+import json
+from time import monotonic
+
+from airflow.exceptions import AirflowException
 from airflow.models import BaseOperator
-from airflow.hooks.S3_hook import S3Hook
 from airflow.hooks.http_hook import HttpHook
 from urllib.parse import urlparse
 from airflow.utils.decorators import apply_defaults
+from ddi_utils import S3MultipartUpload, TokenBucket
+from ddi_utils.metrics import get_metrics, operator_tags
+from https_to_s3_operator.pagination import PageFetcher
 
 
 class HTTPSToS3Operator(BaseOperator):
@@ -26,6 +33,42 @@ class HTTPSToS3Operator(BaseOperator):
     :type s3_prefix: str
     :param timeout: set the timeout for the request
     :type timeout: int
+    :param streaming: read the response in chunks and pipe it into a S3
+        multipart upload instead of loading the whole body in memory. The
+        memory used is bounded by `(max_concurrency + 1) * part_size`.
+        Not supported with `pagination`, pages are parsed whole.
+    :type streaming: bool
+    :param chunk_size: bytes read from the response at once when streaming
+    :type chunk_size: int
+    :param part_size: bytes per multipart part when streaming, at least 5 MiB
+    :type part_size: int
+    :param max_concurrency: number of parts uploaded at once when streaming
+    :type max_concurrency: int
+    :param pagination: pagination strategy of a paginated endpoint, eg.
+        PagePagination, OffsetPagination or CursorPagination. Every page is
+        written under `s3_prefix` as a numbered part file as soon as it
+        arrives, instead of a single `data.json`. Part files left by an
+        earlier run that fetched more pages are deleted before the
+        `_SUCCESS` marker is written.
+    :type pagination: https_to_s3_operator.pagination.Pagination
+    :param page_workers: number of pages fetched at once, for the strategies
+        whose pages can be addressed independently
+    :type page_workers: int
+    :param requests_per_second: maximum request rate against the API
+    :type requests_per_second: float
+    :param max_pages: stop after this many pages
+    :type max_pages: int
+    :param page_format: `json` writes every page body as is to
+        `part-NNNNN.json`, `ndjson` writes the items of every page as
+        newline-delimited JSON to `part-NNNNN.ndjson`
+    :type page_format: str
+    :param skip_unchanged: do not rewrite `data.json` and `_SUCCESS` when the
+        data did not change since the last run. The ETag, Last-Modified and
+        SHA-256 of the last written data are kept in the metadata of the
+        `_SUCCESS` marker: the request is sent with If-None-Match and
+        If-Modified-Since, a 304 ends the task, and a body whose hash did not
+        change is not uploaded. Not supported with `pagination`.
+    :type skip_unchanged: bool
     """
 
     template_fields = ('s3_bucket', 's3_prefix', 'api_endpoint')
@@ -38,15 +81,42 @@ class HTTPSToS3Operator(BaseOperator):
                  s3_conn_id='aws_default',
                  http_conn_id='rest_default',
                  timeout=5,
+                 streaming=False,
+                 chunk_size=1024 * 1024,
+                 part_size=64 * 1024 * 1024,
+                 max_concurrency=4,
+                 pagination=None,
+                 page_workers=1,
+                 requests_per_second=None,
+                 max_pages=None,
+                 page_format='json',
+                 skip_unchanged=False,
                  *args,
                  **kwargs):
         super().__init__(*args, **kwargs)
+        if skip_unchanged and pagination is not None:
+            raise AirflowException('skip_unchanged is not supported with pagination, '
+                                   'every page is rewritten on each run')
+        if streaming and pagination is not None:
+            raise AirflowException('streaming is not supported with pagination, '
+                                   'every page is parsed whole to find the next one')
         self.http_conn_id = http_conn_id
         self.api_endpoint = api_endpoint
         self.s3_bucket = s3_bucket
         self.s3_prefix = s3_prefix
         self.s3_conn_id = s3_conn_id
         self.timeout = timeout
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.pagination = pagination
+        self.page_workers = page_workers
+        self.requests_per_second = requests_per_second
+        self.max_pages = max_pages
+        self.page_format = page_format
+        self.skip_unchanged = skip_unchanged
+        self._metric_tags = None
 
     @staticmethod
     def get_s3_key(s3_key):
@@ -56,26 +126,231 @@ class HTTPSToS3Operator(BaseOperator):
         parsed_s3_key = urlparse(s3_key)
         return parsed_s3_key.path.lstrip('/')
 
+    def _run(self, http_hook, **kwargs):
+        """runs the request, recording its latency and status code"""
+        started_at = monotonic()
+        status = 'error'
+        try:
+            response = http_hook.run(**kwargs)
+            status = str(response.status_code)
+            return response
+        except Exception as ex:
+            # HttpHook.check_response raises "<status code>:<reason>"
+            code = str(ex).split(':', 1)[0]
+            if code.isdigit():
+                status = code
+            raise
+        finally:
+            tags = dict(self._metric_tags, status=status)
+            metrics = get_metrics()
+            metrics.timing('http.request_duration', (monotonic() - started_at) * 1000, tags)
+            metrics.incr('http.requests', 1, tags)
+
+    def _record_upload(self, size):
+        metrics = get_metrics()
+        metrics.incr('transfer.files', 1, self._metric_tags)
+        metrics.incr('transfer.bytes', size, self._metric_tags)
+
+    def _stream(self, result, s3_hook, s3_key, previous_hash=None):
+        """pipes the raw response body into a S3 multipart upload, returns the
+        SHA-256 of the body. The upload is dropped when that hash is
+        `previous_hash`."""
+        body_hash = hashlib.sha256()
+        with S3MultipartUpload(s3_hook.get_conn(), self.s3_bucket, s3_key,
+                               part_size=self.part_size,
+                               max_concurrency=self.max_concurrency) as upload:
+            for chunk in result.iter_content(chunk_size=self.chunk_size):
+                body_hash.update(chunk)
+                upload.write(chunk)
+
+            if body_hash.hexdigest() == previous_hash:
+                upload.abort()
+                self.log.info('%s did not change, upload dropped', s3_key)
+                return previous_hash
+        self.log.info('uploaded %s bytes to %s', upload.bytes_written, s3_key)
+        self._record_upload(upload.bytes_written)
+        return body_hash.hexdigest()
+
+    def _previous_validators(self, s3_hook):
+        """returns the validators of the last written data"""
+        from botocore.exceptions import ClientError
+
+        s3_key = self.get_s3_key(f'{self.s3_prefix}/_SUCCESS')
+        try:
+            response = s3_hook.get_conn().head_object(Bucket=self.s3_bucket, Key=s3_key)
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return {}
+            raise
+        return response.get('Metadata', {})
+
+    @staticmethod
+    def _conditional_headers(validators):
+        headers = {}
+        if validators.get('source-etag'):
+            headers['If-None-Match'] = validators['source-etag']
+        if validators.get('source-last-modified'):
+            headers['If-Modified-Since'] = validators['source-last-modified']
+        return headers
+
+    def _execute_unless_unchanged(self, http_hook, s3_hook):
+        validators = self._previous_validators(s3_hook)
+        previous_hash = validators.get('content-sha256')
+
+        result = self._run(
+            http_hook,
+            endpoint=self.api_endpoint,
+            headers=self._conditional_headers(validators),
+            extra_options={
+                'timeout': self.timeout,
+                'stream': self.streaming
+            }
+        )
+        if result.status_code == 304:
+            self.log.info('%s not modified since the last run', self.api_endpoint)
+            return
+
+        s3_key = self.get_s3_key(f'{self.s3_prefix}/data.json')
+        if self.streaming:
+            try:
+                body_hash = self._stream(result, s3_hook, s3_key, previous_hash)
+            finally:
+                result.close()
+        else:
+            body_hash = hashlib.sha256(result.content).hexdigest()
+            if body_hash != previous_hash:
+                s3_hook.load_bytes(
+                    result.content,
+                    key=s3_key,
+                    bucket_name=self.s3_bucket,
+                    replace=True
+                )
+                self._record_upload(len(result.content))
+
+        if body_hash == previous_hash:
+            self.log.info('%s unchanged since the last run', s3_key)
+            return
+
+        self._write_success_marker(s3_hook, metadata={
+            'content-sha256': body_hash,
+            'source-etag': result.headers.get('ETag', ''),
+            'source-last-modified': result.headers.get('Last-Modified', '')
+        })
+
+    def _write_pages(self, http_hook, s3_hook):
+        """fetches every page of the endpoint and writes it as a part file"""
+        def fetch(params):
+            return self._run(
+                http_hook,
+                endpoint=self.api_endpoint,
+                data=params,
+                extra_options={
+                    'timeout': self.timeout
+                }
+            )
+
+        rate_limiter = None
+        if self.requests_per_second:
+            rate_limiter = TokenBucket(self.requests_per_second)
+        fetcher = PageFetcher(fetch, self.pagination,
+                              max_workers=self.page_workers,
+                              rate_limiter=rate_limiter,
+                              max_pages=self.max_pages)
+
+        written_keys = set()
+        for index, response, payload in fetcher.pages():
+            if self.page_format == 'ndjson':
+                body = ''.join(json.dumps(item) + '\n'
+                               for item in self.pagination.items(payload)).encode('utf-8')
+            else:
+                body = response.content
+            s3_key = self.get_s3_key(
+                f'{self.s3_prefix}/part-{index:05d}.{self.page_format}')
+            s3_hook.load_bytes(
+                body,
+                key=s3_key,
+                bucket_name=self.s3_bucket,
+                replace=True
+            )
+            self._record_upload(len(body))
+            written_keys.add(s3_key)
+        self.log.info('wrote %s pages with %s requests', len(written_keys),
+                      fetcher.request_count)
+        self._delete_stale_parts(s3_hook, written_keys)
+
+    def _delete_stale_parts(self, s3_hook, written_keys):
+        """deletes the part files of earlier runs this run did not rewrite,
+        so the readers of the `_SUCCESS` marker do not mix old and new pages"""
+        s3_client = s3_hook.get_conn()
+        prefix = self.get_s3_key(f'{self.s3_prefix}/part-')
+        paginator = s3_client.get_paginator('list_objects_v2')
+        stale_keys = [s3_object['Key']
+                      for page in paginator.paginate(Bucket=self.s3_bucket, Prefix=prefix)
+                      for s3_object in page.get('Contents', [])
+                      if s3_object['Key'] not in written_keys]
+        # delete_objects takes at most 1000 keys
+        for start in range(0, len(stale_keys), 1000):
+            s3_client.delete_objects(Bucket=self.s3_bucket, Delete={
+                'Objects': [{'Key': key} for key in stale_keys[start:start + 1000]],
+                'Quiet': True
+            })
+        if stale_keys:
+            self.log.info('deleted %s part files of an earlier run', len(stale_keys))
+
     def execute(self, context):
+        from airflow.hooks.S3_hook import S3Hook
+
         http_hook = HttpHook(http_conn_id=self.http_conn_id, method='GET')
-        result = http_hook.run(
+        s3_hook = S3Hook(self.s3_conn_id)
+        self._metric_tags = operator_tags(self, self.http_conn_id)
+        try:
+            self._execute(http_hook, s3_hook)
+        finally:
+            get_metrics().flush()
+
+    def _execute(self, http_hook, s3_hook):
+        if self.pagination is not None:
+            self._write_pages(http_hook, s3_hook)
+            self._write_success_marker(s3_hook)
+            return
+
+        if self.skip_unchanged:
+            self._execute_unless_unchanged(http_hook, s3_hook)
+            return
+
+        result = self._run(
+            http_hook,
             endpoint=self.api_endpoint,
             extra_options={
-                'timeout': self.timeout
+                'timeout': self.timeout,
+                'stream': self.streaming
             }
         )
 
-        s3_hook = S3Hook(self.s3_conn_id)
         s3_key = self.get_s3_key(f'{self.s3_prefix}/data.json')
-        s3_hook.load_string(
-            result.text,
-            key=s3_key,
-            bucket_name=self.s3_bucket,
-            replace=True
-        )
+        if self.streaming:
+            try:
+                self._stream(result, s3_hook, s3_key)
+            finally:
+                result.close()
+        else:
+            s3_hook.load_string(
+                result.text,
+                key=s3_key,
+                bucket_name=self.s3_bucket,
+                replace=True
+            )
+            self._record_upload(len(result.content))
+
+        self._write_success_marker(s3_hook)
 
+    def _write_success_marker(self, s3_hook, metadata=None):
         # Add the empty _SUCCESS file to indicate the task is done successfully
         s3_key = self.get_s3_key(f'{self.s3_prefix}/_SUCCESS')
+        if metadata:
+            s3_hook.get_conn().put_object(Bucket=self.s3_bucket, Key=s3_key,
+                                          Body=b'', Metadata=metadata)
+            return
         s3_hook.load_string(
             '',
             key=s3_key,
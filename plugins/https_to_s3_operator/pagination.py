@@ -0,0 +1,244 @@
+import json
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import requests
+
+
+def get_field(payload, field: Optional[str]):
+    """returns a (dotted) field of a JSON payload, the payload itself
+    when no field is given"""
+    if not field:
+        return payload
+    for name in field.split('.'):
+        if not isinstance(payload, dict):
+            return None
+        payload = payload.get(name)
+    return payload
+
+
+class Pagination:
+    """
+    Base class of the pagination strategies.
+
+    Strategies whose pages are `independent` can compute the request
+    parameters of any page from its index, those pages are fetched
+    concurrently. The others compute the parameters of the next page from
+    the payload of the current one.
+
+    :param items_field: (dotted) field holding the items of a page, a page
+        without items ends the pagination. By default the payload itself.
+    :type items_field: str
+    """
+
+    independent = True
+
+    def __init__(self, items_field: Optional[str] = None):
+        self.items_field = items_field
+
+    def items(self, payload):
+        return get_field(payload, self.items_field)
+
+    def is_empty(self, payload) -> bool:
+        return not self.items(payload)
+
+    def params_for(self, index: int) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def page_count(self, payload) -> Optional[int]:
+        """returns the number of pages if the first page tells it"""
+        return None
+
+    def next_params(self, payload, params) -> Optional[Dict[str, Any]]:
+        """returns the parameters of the page after the one fetched with
+        `params`, None when it was the last one"""
+        raise NotImplementedError
+
+
+class PagePagination(Pagination):
+    """
+    Pages addressed by their number, eg. `?page=3&per_page=100`.
+
+    :param total_pages_field: field of the first page holding the number of pages
+    :type total_pages_field: str
+    """
+
+    def __init__(self, page_param: str = 'page', first_page: int = 1,
+                 size_param: Optional[str] = None, page_size: Optional[int] = None,
+                 total_pages_field: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.page_param = page_param
+        self.first_page = first_page
+        self.size_param = size_param
+        self.page_size = page_size
+        self.total_pages_field = total_pages_field
+
+    def params_for(self, index):
+        params = {self.page_param: self.first_page + index}
+        if self.size_param and self.page_size:
+            params[self.size_param] = self.page_size
+        return params
+
+    def page_count(self, payload):
+        total_pages = get_field(payload, self.total_pages_field) \
+            if self.total_pages_field else None
+        return int(total_pages) if total_pages is not None else None
+
+
+class OffsetPagination(Pagination):
+    """
+    Pages addressed by an item offset, eg. `?offset=200&limit=100`.
+
+    :param total_field: field of the first page holding the number of items
+    :type total_field: str
+    """
+
+    def __init__(self, offset_param: str = 'offset', limit_param: str = 'limit',
+                 limit: int = 100, total_field: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.offset_param = offset_param
+        self.limit_param = limit_param
+        self.limit = limit
+        self.total_field = total_field
+
+    def params_for(self, index):
+        return {self.offset_param: index * self.limit, self.limit_param: self.limit}
+
+    def page_count(self, payload):
+        total = get_field(payload, self.total_field) if self.total_field else None
+        return int(math.ceil(int(total) / self.limit)) if total is not None else None
+
+
+class CursorPagination(Pagination):
+    """
+    Pages chained by an opaque cursor returned with every page,
+    eg. `?cursor=<next_cursor of the previous page>`.
+    """
+
+    independent = False
+
+    def __init__(self, cursor_param: str = 'cursor', cursor_field: str = 'next_cursor',
+                 first_params: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cursor_param = cursor_param
+        self.cursor_field = cursor_field
+        self.first_params = first_params or {}
+
+    def params_for(self, index):
+        if index:
+            raise ValueError('cursor pages cannot be addressed by index')
+        return dict(self.first_params)
+
+    def next_params(self, payload, params):
+        cursor = get_field(payload, self.cursor_field)
+        if not cursor:
+            return None
+        return dict(params, **{self.cursor_param: cursor})
+
+
+# (page index, response, parsed payload)
+Page = Tuple[int, requests.Response, Any]
+
+
+class PageFetcher:
+    """
+    Fetches all the pages of a paginated API.
+
+    Pages are yielded as soon as they arrive, so not necessarily in order.
+    When the number of pages is known from the first page the others are
+    fetched `max_workers` at a time, otherwise they are fetched in waves of
+    `max_workers` pages until a wave contains an empty page.
+
+    :param fetch: sends the request for the given query parameters
+    :type fetch: Callable[[Dict], requests.Response]
+    :param rate_limiter: token bucket acquired before every request
+    :type rate_limiter: ddi_utils.TokenBucket
+    :param max_pages: stop after this many pages
+    :type max_pages: int
+    """
+
+    def __init__(self, fetch: Callable[[Dict[str, Any]], requests.Response],
+                 pagination: Pagination, max_workers: int = 1,
+                 rate_limiter=None, max_pages: Optional[int] = None):
+        self.fetch = fetch
+        self.pagination = pagination
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.max_pages = max_pages
+        self.request_count = 0
+
+    def _fetch_page(self, index, params) -> Page:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        self.request_count += 1
+        response = self.fetch(params)
+        return index, response, json.loads(response.content)
+
+    def _below_max_pages(self, index) -> bool:
+        return self.max_pages is None or index < self.max_pages
+
+    def _sequential_pages(self, first_page: Page) -> Iterator[Page]:
+        index, _, payload = first_page
+        params = self.pagination.params_for(0)
+        while True:
+            params = self.pagination.next_params(payload, params)
+            index += 1
+            if params is None or not self._below_max_pages(index):
+                return
+            page = self._fetch_page(index, params)
+            payload = page[2]
+            if self.pagination.is_empty(payload):
+                return
+            yield page
+
+    def _counted_pages(self, executor, page_count) -> Iterator[Page]:
+        indexes = iter(range(1, page_count))
+        in_flight = set()
+        while True:
+            for index in indexes:
+                if not self._below_max_pages(index):
+                    break
+                in_flight.add(executor.submit(self._fetch_page, index,
+                                              self.pagination.params_for(index)))
+                if len(in_flight) >= 2 * self.max_workers:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def _probed_pages(self, executor) -> Iterator[Page]:
+        index = 1
+        while self._below_max_pages(index):
+            wave = [executor.submit(self._fetch_page, page_index,
+                                    self.pagination.params_for(page_index))
+                    for page_index in range(index, index + self.max_workers)
+                    if self._below_max_pages(page_index)]
+            for future in wave:
+                page = future.result()
+                if self.pagination.is_empty(page[2]):
+                    for remaining in wave:
+                        remaining.cancel()
+                    return
+                yield page
+            index += len(wave)
+
+    def pages(self) -> Iterator[Page]:
+        first_page = self._fetch_page(0, self.pagination.params_for(0))
+        if self.pagination.is_empty(first_page[2]):
+            return
+        yield first_page
+
+        if not self.pagination.independent:
+            yield from self._sequential_pages(first_page)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix='pages') as executor:
+            page_count = self.pagination.page_count(first_page[2])
+            if page_count is not None:
+                yield from self._counted_pages(executor, page_count)
+            else:
+                yield from self._probed_pages(executor)
@@ -1,5 +1,11 @@
+from livy_operator.livy_batch_monitor_operator import LivyBatchMonitorOperator
+from livy_operator.livy_fan_out_operator import LivyFanOutOperator
 from livy_operator.livy_operator import LivyOperator
+from livy_operator.livy_session_operator import LivySessionOperator
 
 __all__ = [
-    'LivyOperator'
+    'LivyBatchMonitorOperator',
+    'LivyFanOutOperator',
+    'LivyOperator',
+    'LivySessionOperator'
 ]
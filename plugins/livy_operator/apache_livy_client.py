@@ -1,42 +1,240 @@
-from time import sleep
-from typing import Dict, List
+import random
+import threading
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 from airflow.exceptions import AirflowException
+from livy_operator.livy_batch_poller import LivyBatchPoller
+from livy_operator.livy_resilience import (POST_RETRY_STATUSES, RETRY_STATUSES,
+                                           RetryPolicy, get_circuit_breaker,
+                                           get_rate_limiter)
+
+# sessions shared by every LivyClient of this worker process that talks to
+# the same livy server, keyed by (host, port, pool_maxsize, keep_alive)
+_SHARED_SESSIONS = {}  # type: Dict[Tuple, requests.Session]
+_SHARED_SESSIONS_LOCK = threading.Lock()
+
+# livy batch states after which the batch can still change its state
+BATCH_ACTIVE_STATES = ('not_started', 'starting', 'recovering', 'running',
+                       'busy', 'shutting_down')
+
+
+def _create_session(pool_connections: int, pool_maxsize: int,
+                    keep_alive: bool) -> requests.Session:
+    """returns a requests session backed by a connection pool of
+    `pool_maxsize` connections per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=False)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def _get_shared_session(host: str, port: int, pool_connections: int,
+                        pool_maxsize: int, keep_alive: bool) -> requests.Session:
+    key = (host, port, pool_maxsize, keep_alive)
+    with _SHARED_SESSIONS_LOCK:
+        session = _SHARED_SESSIONS.get(key)
+        if session is None:
+            session = _create_session(pool_connections, pool_maxsize, keep_alive)
+            _SHARED_SESSIONS[key] = session
+        return session
 
 
 class LivyClient:
+    """
+    Client for the Livy REST batch API.
+
+    All requests of a client go through one pooled `requests.Session`, so
+    state polls and log pages reuse the same keep-alive connections.
+
+    Every request has a timeout and failed requests are retried with
+    jittered exponential backoff (see `RetryPolicy`): connection errors,
+    timeouts and 429/5xx answers, and for POSTs only the failures that
+    cannot have created anything. The clients of a worker process share a
+    circuit breaker and a rate limiter per Livy server, so a restarting
+    Livy is probed by one request instead of being hit by every task.
+
+    :param pool_connections: number of per-host connection pools to cache
+    :type pool_connections: int
+    :param pool_maxsize: maximum number of connections kept alive per host
+    :type pool_maxsize: int
+    :param keep_alive: when False every request closes its connection
+    :type keep_alive: bool
+    :param share_session: share the session with every other client of this
+        worker process that uses the same host, port and pool settings
+    :type share_session: bool
+    :param retry_policy: how failed requests are retried
+    :type retry_policy: RetryPolicy
+    :param timeout: seconds to connect and to wait for an answer, or a
+        (connect, read) tuple
+    :type timeout: float or tuple
+    :param requests_per_second: request rate to this Livy server allowed to
+        all the clients of this worker process, set by the first client
+    :type requests_per_second: float
+    :param failure_threshold: consecutive failures opening the circuit of this
+        Livy server
+    :type failure_threshold: int
+    :param reset_timeout: seconds before an open circuit is probed
+    :type reset_timeout: float
+    """
 
     def __init__(self, host: str, port: int = 8998, deploy_mode: str = 'cluster',
-                 master: str = 'yarn'):
+                 master: str = 'yarn', pool_connections: int = 1,
+                 pool_maxsize: int = 10, keep_alive: bool = True,
+                 share_session: bool = False,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 timeout: Union[float, Tuple[float, float]] = (5.0, 30.0),
+                 requests_per_second: float = 20.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 5.0):
         self.host = host
         self.port = port
         self.deploy_mode = deploy_mode
         self.master = master
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.timeout = timeout
+        self.circuit_breaker = get_circuit_breaker(host, port, failure_threshold,
+                                                   reset_timeout)
+        self.rate_limiter = get_rate_limiter(host, port, requests_per_second)
+
+        if share_session:
+            self.session = _get_shared_session(host, port, pool_connections,
+                                               pool_maxsize, keep_alive)
+        else:
+            self.session = _create_session(pool_connections, pool_maxsize,
+                                           keep_alive)
+
+        self.request_count = 0
+        self.retry_count = 0
+        # last known batch info of the batches that reached a terminal state
+        self._finished_batches = {}  # type: Dict[int, Dict]
+        self.last_poll_stats = {}  # type: Dict[str, float]
+        self.last_submitted_conf = {}  # type: Dict[str, str]
+
+    def _post_method(self, url, json_data, retries=None):
+        return self._request('POST', url, retries=retries, json=json_data)
+
+    def _get_method(self, url, retries=None):
+        return self._request('GET', url, retries=retries)
+
+    def _wait_for_circuit(self, deadline: float):
+        """waits until the circuit of this livy server lets a request through"""
+        while True:
+            wait = self.circuit_breaker.wait_time()
+            if not wait:
+                return
+            if monotonic() + wait > deadline:
+                raise AirflowException(
+                    'livy at {host}:{port} is unavailable, its circuit is open'
+                    .format(host=self.host, port=self.port))
+            # jittered, so the waiting clients do not all come back at once
+            sleep(wait + random.uniform(0, min(wait, 1.0)))
+
+    @staticmethod
+    def _is_retryable_error(method: str, ex: requests.RequestException) -> bool:
+        if method != 'POST':
+            return True
+        # a POST that timed out or lost its connection may have been
+        # processed, only retry it when it could not even connect
+        if isinstance(ex, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(ex.args[0], 'reason', None) if ex.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _request(self, method, url, retries=None, **kwargs) -> requests.Response:
+        """sends the request, retrying it according to the retry policy.
+        Returns the last answer, even when not ok, or raises the last
+        connection error."""
+        policy = self.retry_policy
+        retries = policy.max_retries if retries is None else retries
+        retry_statuses = POST_RETRY_STATUSES if method == 'POST' else RETRY_STATUSES
+        deadline = monotonic() + policy.deadline
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            self._wait_for_circuit(deadline)
+            self.rate_limiter.acquire()
+            self.request_count += 1
+
+            response, error = None, None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as ex:
+                self.circuit_breaker.record_failure()
+                error = ex
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if response.status_code not in retry_statuses:
+                    return response
+
+            retryable = response is not None or self._is_retryable_error(method, error)
+            delay = policy.delay(attempt, response.headers.get('Retry-After')
+                                 if response is not None else None)
+            if not retryable or attempt >= retries or monotonic() + delay > deadline:
+                if error is not None:
+                    raise error
+                return response
+
+            print('livy request {method} {url} failed ({reason}), retry {attempt} '
+                  'in {delay:.1f}s'.format(method=method, url=url, attempt=attempt + 1,
+                                           delay=delay,
+                                           reason=error if error is not None
+                                           else response.status_code))
+            self.retry_count += 1
+            attempt += 1
+            sleep(delay)
+
+    def connection_stats(self) -> Dict[str, int]:
+        """returns the request and connection counters of this client,
+        `connections_opened` covers the whole (possibly shared) session"""
+        connections_opened = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections_opened += pool.num_connections
+
+        return {
+            'requests': self.request_count,
+            'retries': self.retry_count,
+            'circuit_opened': self.circuit_breaker.opened_count,
+            'connections_opened': connections_opened,
+            'connections_reused': max(self.request_count - connections_opened, 0)
+        }
 
-    def _post_method(self, url, json_data, retries=3, sleep_seconds=20):
-        resp = requests.post(url, json=json_data, timeout=30)
-        while not resp.ok and retries > 0:
-            sleep(sleep_seconds)
-            resp = requests.post(url, json=json_data, timeout=30)
-            retries = retries - 1
-        return resp
-
-    def _get_method(self, url, retries=3, sleep_seconds=20):
-        resp = requests.get(url)
-        while not resp.ok and retries > 0:
-            sleep(sleep_seconds)
-            resp = requests.get(url)
-            retries -= 1
-        return resp
+    def close(self):
+        """closes the pooled connections unless the session is shared"""
+        if self.session not in _SHARED_SESSIONS.values():
+            self.session.close()
 
     @classmethod
     def _create_submit_payload(cls, deploy_mode, master, entry_point,
                                app_name=None,
                                python_files: List[str] = [],
                                app_args: List[str] = [],
-                               spark_conf: Dict[str, str] = dict()):
+                               spark_conf: Dict[str, str] = dict(),
+                               recommended_conf: Optional[Dict[str, str]] = None):
+        """
+        returns the livy batch payload. The `recommended_conf` settings
+        (see `ResourceRecommender`) override the `spark_conf` ones.
+        """
 
         data = {
             'conf': {
@@ -58,6 +256,9 @@ class LivyClient:
         if spark_conf:
             data.get('conf', dict()).update(spark_conf)
 
+        if recommended_conf:
+            data['conf'].update(recommended_conf)
+
         return data
 
     def _get_batch_id(self, json_response):
@@ -71,9 +272,10 @@ class LivyClient:
 
     def submit_batch(self, entry_point, app_name=None,
                      app_args=[], python_files=[],
-                     spark_conf=dict):
+                     spark_conf=dict, recommended_conf=None):
         """
-        return the batch id for the submitted application
+        return the batch id for the submitted application, its conf is kept
+        in `last_submitted_conf`
         """
         data = self._create_submit_payload(deploy_mode=self.deploy_mode,
                                            master=self.master,
@@ -81,7 +283,9 @@ class LivyClient:
                                            app_name=app_name,
                                            app_args=app_args,
                                            python_files=python_files,
-                                           spark_conf=spark_conf)
+                                           spark_conf=spark_conf,
+                                           recommended_conf=recommended_conf)
+        self.last_submitted_conf = data['conf']
 
         url = self._create_submit_url()
 
@@ -106,14 +310,24 @@ class LivyClient:
         """returns the batch status for a given livy batch
         eg. success, running, dead"""
 
+        if batch_id in self._finished_batches:
+            return self._finished_batches[batch_id].get('state')
+
         url = self._create_batch_status_url(batch_id)
         response = self._get_method(url)
-        return response.json().get('state')
+        state = response.json().get('state')
+        if self.is_terminal_state(state):
+            self._finished_batches[batch_id] = {'id': batch_id, 'state': state}
+        return state
+
+    @staticmethod
+    def is_terminal_state(state) -> bool:
+        """return True if a batch in this state will not change anymore"""
+        return state not in BATCH_ACTIVE_STATES
 
     def is_batch_finished(self, batch_id):
         """return True if a batch is finished"""
-        CODES = ['starting', 'running']
-        return self.batch_status(batch_id) not in CODES
+        return self.is_terminal_state(self.batch_status(batch_id))
 
     def _create_log_url(self, batch_id, from_index, size) -> str:
         return 'http://{host}:{port}/batches/{id}/log?' \
@@ -123,8 +337,9 @@ class LivyClient:
                                                       from_index=from_index,
                                                       size=size)
 
-    def _get_log(self, batch_id, from_index, size) -> dict:
-        """returns a dictionary containing the log entries"""
+    def get_log_page(self, batch_id, from_index, size) -> dict:
+        """returns the livy log response, containing the log entries
+        and the total number of lines"""
 
         url = self._create_log_url(batch_id, from_index, size)
 
@@ -134,22 +349,29 @@ class LivyClient:
             message = 'could not connect to livy, status code: {code}, ' \
                       'url used: {url}'.format(code=resp.status_code, url=url)
             raise AirflowException(message)
-        response = resp.json()
-        return response.get('log')
+        return resp.json()
+
+    def _get_log(self, batch_id, from_index, size) -> dict:
+        """returns a dictionary containing the log entries"""
+        return self.get_log_page(batch_id, from_index, size).get('log')
 
-    def consume_log(self, batch_id):
+    def consume_log(self, batch_id, page_size: int = 1000,
+                    min_interval: float = 1.0,
+                    max_interval: float = 30.0,
+                    line_handler=print) -> dict:
         """converts the Livy log into Operator log,
-        this way the log can be read on the spark"""
-
-        from_index = 0
-        size = 100
-        log = True
-        while not self.is_batch_finished(batch_id) or log:
-            log = self._get_log(batch_id, from_index, size)
-            for line in log:
-                print(line)
-            from_index = from_index + len(log)
-            sleep(1)
+        this way the log can be read on the spark.
+        returns the batch info of the finished batch"""
+
+        poller = LivyBatchPoller(self, batch_id,
+                                 line_handler=line_handler,
+                                 page_size=page_size,
+                                 min_interval=min_interval,
+                                 max_interval=max_interval)
+        batch_info = poller.poll()
+        self._finished_batches[batch_id] = batch_info
+        self.last_poll_stats = poller.stats()
+        return batch_info
 
     def is_successful_finish(self, batch_id) -> bool:
         """raises an exception if the application did not finished
@@ -162,15 +384,37 @@ class LivyClient:
                                                                 port=self.port,
                                                                 batch_id=batch_id)
 
-    def print_batch_info(self, batch_id):
+    def batch_info(self, batch_id) -> dict:
+        """returns the livy batch, including its state, appId and appInfo"""
+
+        cached = self._finished_batches.get(batch_id)
+        if cached and 'appInfo' in cached:
+            return cached
 
         url = self._create_batch_info_url(batch_id)
-        request = self._get_method(url)
-        payload = request.json()
+        payload = self._get_method(url).json()
+        if self.is_terminal_state(payload.get('state')):
+            self._finished_batches[batch_id] = payload
+        return payload
 
-        batch_status = self.batch_status(batch_id)
-        application_id = payload['appId']
-        spark_ui_url = payload['appInfo']['sparkUiUrl']
+    def kill_batch(self, batch_id):
+        """kills a running livy batch"""
+
+        url = self._create_batch_info_url(batch_id)
+        response = self._request('DELETE', url)
+        if not response.ok and response.status_code != 404:
+            message = 'could not kill livy batch {id}, status code: {code}'.\
+                format(id=batch_id, code=response.status_code)
+            raise AirflowException(message)
+
+    def print_batch_info(self, batch_id) -> dict:
+        """prints and returns the state, appId and sparkUiUrl of the batch"""
+
+        payload = self.batch_info(batch_id)
+
+        batch_status = payload.get('state')
+        application_id = payload.get('appId')
+        spark_ui_url = (payload.get('appInfo') or {}).get('sparkUiUrl')
 
         print('====================================')
         print('====================================')
@@ -183,3 +427,84 @@ class LivyClient:
         print('====================================')
         print('====================================')
         print('====================================')
+
+        return {'state': batch_status, 'appId': application_id,
+                'sparkUiUrl': spark_ui_url}
+
+    def _create_sessions_url(self, session_id=None) -> str:
+        url = 'http://{host}:{port}/sessions'.format(host=self.host, port=self.port)
+        if session_id is not None:
+            url = '{url}/{id}'.format(url=url, id=session_id)
+        return url
+
+    def _check_response(self, response, url):
+        if not response.ok:
+            message = 'could not connect to livy, status code: {code}, ' \
+                      'url used: {url}'.format(code=response.status_code, url=url)
+            raise AirflowException(message)
+
+    def list_sessions(self) -> List[dict]:
+        """returns the interactive sessions known to livy"""
+
+        url = self._create_sessions_url() + '?from=0&size=1000'
+        response = self._get_method(url)
+        self._check_response(response, url)
+        return response.json().get('sessions', [])
+
+    def create_session(self, name, kind='pyspark', python_files: List[str] = [],
+                       files: List[str] = [],
+                       spark_conf: Dict[str, str] = dict()) -> dict:
+        """starts an interactive session, returns the livy session"""
+
+        data = {
+            'name': name,
+            'kind': kind,
+            'conf': {
+                'spark.submit.deployMode': self.deploy_mode,
+                'spark.submit.master': self.master
+            }
+        }
+        if python_files:
+            data['pyFiles'] = python_files
+        if files:
+            data['files'] = files
+        if spark_conf:
+            data['conf'].update(spark_conf)
+
+        url = self._create_sessions_url()
+        response = self._post_method(url, data)
+        self._check_response(response, url)
+        return response.json()
+
+    def session_info(self, session_id) -> dict:
+        url = self._create_sessions_url(session_id)
+        response = self._get_method(url, retries=0)
+        self._check_response(response, url)
+        return response.json()
+
+    def delete_session(self, session_id):
+        url = self._create_sessions_url(session_id)
+        response = self._request('DELETE', url)
+        if not response.ok and response.status_code != 404:
+            self._check_response(response, url)
+
+    def submit_statement(self, session_id, code, kind='pyspark') -> dict:
+        """runs `code` in the session, returns the livy statement"""
+
+        url = self._create_sessions_url(session_id) + '/statements'
+        response = self._post_method(url, {'code': code, 'kind': kind})
+        self._check_response(response, url)
+        return response.json()
+
+    def statement_info(self, session_id, statement_id) -> dict:
+        url = '{url}/statements/{id}'.format(url=self._create_sessions_url(session_id),
+                                             id=statement_id)
+        response = self._get_method(url)
+        self._check_response(response, url)
+        return response.json()
+
+    def list_statements(self, session_id) -> List[dict]:
+        url = self._create_sessions_url(session_id) + '/statements'
+        response = self._get_method(url)
+        self._check_response(response, url)
+        return response.json().get('statements', [])
@@ -0,0 +1,139 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, Optional
+
+from livy_operator.apache_livy_client import LivyClient
+from livy_operator.livy_batch_poller import LivyBatchPoller
+
+
+class AsyncLivyClient:
+    """
+    Asyncio front end of the LivyClient.
+
+    The HTTP requests run on a small thread pool that shares one pooled
+    session, the waiting between polls happens on the event loop, so the
+    number of threads does not grow with the number of watched batches.
+
+    :param max_workers: number of requests that can be in flight at once
+    :type max_workers: int
+    """
+
+    def __init__(self, host: str, port: int = 8998, deploy_mode: str = 'cluster',
+                 master: str = 'yarn', max_workers: int = 8, **client_kwargs):
+        client_kwargs.setdefault('pool_maxsize', max_workers)
+        self.client = LivyClient(host=host, port=port, deploy_mode=deploy_mode,
+                                 master=master, **client_kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='livy')
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor,
+                                          partial(func, *args, **kwargs))
+
+    async def submit_batch(self, entry_point, app_name=None, app_args=[],
+                           python_files=[], spark_conf=dict()):
+        """return the batch id for the submitted application"""
+        return await self._run(self.client.submit_batch,
+                               entry_point=entry_point,
+                               app_name=app_name,
+                               app_args=app_args,
+                               python_files=python_files,
+                               spark_conf=spark_conf)
+
+    async def batch_info(self, batch_id) -> dict:
+        return await self._run(self.client.batch_info, batch_id)
+
+    async def kill_batch(self, batch_id):
+        return await self._run(self.client.kill_batch, batch_id)
+
+    async def step(self, poller: LivyBatchPoller) -> float:
+        """runs one polling tick of `poller` off the event loop"""
+        return await self._run(poller.step)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.client.close()
+
+
+class LivyBatchMonitor:
+    """
+    Watches many Livy batches from a single event loop.
+
+    Every watched batch gets a LivyBatchPoller whose ticks run on the
+    AsyncLivyClient thread pool, and a future that resolves to the last batch
+    info once the batch reaches a terminal state.
+
+    :param client: the client used for all the requests
+    :type client: AsyncLivyClient
+    :param page_size: maximum number of log lines fetched per request
+    :type page_size: int
+    :param min_interval: seconds between two ticks of a batch, and to wait
+        after its first quiet tick
+    :type min_interval: float
+    :param max_interval: upper bound of the wait between quiet ticks
+    :type max_interval: float
+    """
+
+    def __init__(self, client: AsyncLivyClient, page_size: int = 1000,
+                 min_interval: float = 1.0, max_interval: float = 30.0):
+        self.client = client
+        self.page_size = page_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.pollers = {}  # type: Dict[int, LivyBatchPoller]
+        self._tasks = {}  # type: Dict[int, asyncio.Task]
+
+    @staticmethod
+    def _prefixed_printer(batch_id) -> Callable[[str], None]:
+        def print_line(line):
+            print('[batch {id}] {line}'.format(id=batch_id, line=line))
+        return print_line
+
+    def watch(self, batch_id,
+              line_handler: Optional[Callable[[str], None]] = None) -> asyncio.Future:
+        """starts following `batch_id`, returns a future resolving to the
+        batch info of the finished batch. `line_handler` is called for every
+        log line of that batch, from one of the client threads."""
+        if batch_id in self._tasks:
+            return self._tasks[batch_id]
+
+        poller = LivyBatchPoller(self.client.client, batch_id,
+                                 line_handler=line_handler or
+                                 self._prefixed_printer(batch_id),
+                                 page_size=self.page_size,
+                                 min_interval=self.min_interval,
+                                 max_interval=self.max_interval)
+        self.pollers[batch_id] = poller
+        task = asyncio.ensure_future(self._follow(poller))
+        self._tasks[batch_id] = task
+        return task
+
+    async def _follow(self, poller: LivyBatchPoller) -> dict:
+        while not poller.is_finished:
+            delay = await self.client.step(poller)
+            if delay:
+                await asyncio.sleep(delay)
+        return poller.batch_info
+
+    async def wait(self, batch_ids: Optional[Iterable[int]] = None,
+                   fail_fast: bool = False) -> Dict[int, dict]:
+        """waits for the given (by default all the watched) batches, returns
+        their batch info by batch id. Errors raised while following a batch
+        are returned in place of its batch info unless `fail_fast` is set, in
+        which case the first one is raised and the other batches are no
+        longer followed."""
+        batch_ids = list(self._tasks) if batch_ids is None else list(batch_ids)
+        tasks = [self._tasks[batch_id] for batch_id in batch_ids]
+        try:
+            results = await asyncio.gather(*tasks,
+                                           return_exceptions=not fail_fast)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+        return dict(zip(batch_ids, results))
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        return {batch_id: poller.stats() for batch_id, poller in self.pollers.items()}
@@ -0,0 +1,128 @@
+import asyncio
+from typing import List, Optional
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from ddi_utils.metrics import get_metrics, operator_tags
+from livy_operator.livy_batch_monitor import AsyncLivyClient, LivyBatchMonitor
+from livy_operator.livy_batch_poller import record_poll_metrics
+from livy_operator.livy_resilience import RetryPolicy
+
+
+class LivyBatchMonitorOperator(BaseOperator):
+    """
+    Follows the Livy batches submitted by LivyOperator tasks running with
+    `wait_for_completion=False`, all of them from one worker slot.
+
+    :param submit_task_ids: the tasks whose XCom return value is a batch id
+    :type submit_task_ids: List[str]
+    :param max_workers: number of livy requests that can be in flight at once
+    :type max_workers: int
+    :param fail_fast: stop following the other batches on the first error
+        raised while following a batch
+    :type fail_fast: bool
+    :param requests_per_second: livy requests per second allowed to the
+        task, raise it when following many batches with a short poll_interval
+    :type requests_per_second: float
+    :param failure_threshold: consecutive failed requests after which the
+        requests to the livy server are paused
+    :type failure_threshold: int
+    :param reset_timeout: seconds before the requests are tried again
+    :type reset_timeout: float
+    :param retry_policy: how failed livy requests are retried
+    :type retry_policy: livy_operator.livy_resilience.RetryPolicy
+    """
+
+    ui_color = '#e8f7e4'
+
+    template_fields = ('host', 'port')
+
+    @apply_defaults
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 submit_task_ids: List[str],
+                 max_workers: int = 8,
+                 log_page_size: int = 1000,
+                 poll_interval: float = 1.0,
+                 max_poll_interval: float = 30.0,
+                 fail_fast: bool = False,
+                 requests_per_second: float = 20.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 5.0,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 *args,
+                 **kwargs):
+        super(LivyBatchMonitorOperator, self).__init__(*args, **kwargs)
+
+        self.host = host
+        self.port = port
+        self.submit_task_ids = submit_task_ids
+        self.max_workers = max_workers
+        self.log_page_size = log_page_size
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.fail_fast = fail_fast
+        self.requests_per_second = requests_per_second
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_policy = retry_policy
+
+    def _watch_all(self, batch_ids):
+        client = AsyncLivyClient(host=self.host, port=self.port,
+                                 max_workers=self.max_workers,
+                                 requests_per_second=self.requests_per_second,
+                                 failure_threshold=self.failure_threshold,
+                                 reset_timeout=self.reset_timeout,
+                                 retry_policy=self.retry_policy)
+        monitor = LivyBatchMonitor(client,
+                                   page_size=self.log_page_size,
+                                   min_interval=self.poll_interval,
+                                   max_interval=self.max_poll_interval)
+
+        async def watch_all():
+            for batch_id in batch_ids:
+                monitor.watch(batch_id)
+            return await monitor.wait(fail_fast=self.fail_fast)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(watch_all())
+        finally:
+            loop.close()
+            self.log.info('livy poll stats: %s', monitor.stats())
+            client.close()
+            for stats in monitor.stats().values():
+                record_poll_metrics(stats, operator_tags(self))
+            get_metrics().flush()
+
+    def execute(self, context):
+        batch_ids = [
+            context['ti'].xcom_pull(task_ids=task_id)
+            for task_id in self.submit_task_ids
+        ]
+        missing = [task_id for task_id, batch_id
+                   in zip(self.submit_task_ids, batch_ids) if batch_id is None]
+        if missing:
+            raise AirflowException('no livy batch id found in XCom of tasks: {tasks}'
+                                   .format(tasks=missing))
+
+        results = self._watch_all(batch_ids)
+
+        failures = []
+        for task_id, batch_id in zip(self.submit_task_ids, batch_ids):
+            result = results[batch_id]
+            if isinstance(result, Exception):
+                failures.append('{task} (batch {batch}): {error}'.format(
+                    task=task_id, batch=batch_id, error=result))
+            elif result.get('state') != 'success':
+                failures.append('{task} (batch {batch}): {state}'.format(
+                    task=task_id, batch=batch_id, state=result.get('state')))
+            else:
+                self.log.info('%s (batch %s) finished successfully, appId: %s',
+                              task_id, batch_id, result.get('appId'))
+
+        if failures:
+            raise AirflowException('livy batches did not finish successfully: '
+                                   + '; '.join(failures))
@@ -0,0 +1,186 @@
+from time import monotonic, sleep
+from typing import Callable, Dict, Optional
+
+from ddi_utils.metrics import get_metrics
+
+
+class LivyBatchPoller:
+    """
+    Follows a Livy batch until it reaches a terminal state while relaying
+    its log.
+
+    Livy does not return the batch state from the log endpoint, so every tick
+    starts with one log request. While the log has a backlog (the last page
+    came back full) it is drained in pages of `page_size` lines without
+    sleeping. Ticks are otherwise at least `min_interval` apart, so a batch
+    logging steadily costs one log request per `min_interval`, not one per
+    round trip.
+
+    A quiet tick (no new lines) asks for the batch, as does a tick with new
+    lines when the state was last asked `max_interval` ago, so a batch that
+    keeps logging is still seen finishing. The `/batches/{id}` answer already
+    carries the state, the application id and the application info, so
+    nothing has to be fetched again afterwards. Quiet ticks back off
+    exponentially from `min_interval` to `max_interval`. Ticks with new
+    lines scale the interval by how full the log page was, aiming at one
+    full page per tick: a full page resets it to `min_interval`, a partly
+    filled one grows it (by `backoff_factor` at most), so a batch logging a
+    few lines a second is not polled every `min_interval`.
+
+    :param client: the livy client used for the requests
+    :type client: livy_operator.apache_livy_client.LivyClient
+    :param batch_id: the livy batch to follow
+    :type batch_id: int
+    :param line_handler: called for every log line, or with every page of
+        lines when it has a `handle_lines` method (eg. a log_sinks.LogPipeline)
+    :type line_handler: Callable[[str], None]
+    :param page_size: maximum number of log lines fetched per request
+    :type page_size: int
+    :param min_interval: seconds between two ticks, and to sleep after the
+        first quiet tick
+    :type min_interval: float
+    :param max_interval: upper bound of the sleep between quiet ticks, and
+        of the time between two state requests while the batch logs
+    :type max_interval: float
+    :param backoff_factor: factor applied to the interval after a quiet tick,
+        and largest growth after a tick with new lines
+    :type backoff_factor: float
+    """
+
+    def __init__(self, client, batch_id,
+                 line_handler: Callable[[str], None] = print,
+                 page_size: int = 1000,
+                 min_interval: float = 1.0,
+                 max_interval: float = 30.0,
+                 backoff_factor: float = 2.0):
+        self.client = client
+        self.batch_id = batch_id
+        self.line_handler = line_handler
+        self.page_size = page_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+
+        self.from_index = 0
+        self.interval = min_interval
+        self.batch_info = None  # type: Optional[Dict]
+        self.log_requests = 0
+        self.state_requests = 0
+        self.lines_consumed = 0
+        # lines of the last log page over page_size
+        self.last_page_fill = 0.0
+        self.started_at = None  # type: Optional[float]
+        self.finished_at = None  # type: Optional[float]
+        self._state_requested_at = monotonic()
+
+    @property
+    def state(self) -> Optional[str]:
+        return self.batch_info.get('state') if self.batch_info else None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state is not None and \
+            self.client.is_terminal_state(self.state)
+
+    def _relay(self, lines):
+        handle_lines = getattr(self.line_handler, 'handle_lines', None)
+        if handle_lines is not None:
+            handle_lines(lines)
+            return
+        for line in lines:
+            self.line_handler(line)
+
+    def _drain_log(self) -> int:
+        """fetches log pages until the log is caught up,
+        returns the number of relayed lines"""
+        relayed = 0
+        while True:
+            page = self.client.get_log_page(self.batch_id, self.from_index,
+                                            self.page_size)
+            self.log_requests += 1
+
+            lines = page.get('log') or []
+            if lines:
+                self._relay(lines)
+            self.from_index += len(lines)
+            relayed += len(lines)
+            self.last_page_fill = len(lines) / self.page_size
+
+            total = page.get('total')
+            if total is not None:
+                has_backlog = self.from_index < total
+            else:
+                has_backlog = len(lines) == self.page_size
+            if not lines or not has_backlog:
+                self.lines_consumed += relayed
+                return relayed
+
+    def tick(self) -> bool:
+        """runs a single polling tick, returns True when new log lines
+        were relayed"""
+        relayed = self._drain_log()
+        if self.is_finished:
+            return relayed > 0
+        if relayed and monotonic() - self._state_requested_at < self.max_interval:
+            return True
+
+        self.batch_info = self.client.batch_info(self.batch_id)
+        self.state_requests += 1
+        self._state_requested_at = monotonic()
+        if self.is_finished:
+            # the batch may have logged between the drain and the state request
+            relayed += self._drain_log()
+        return relayed > 0
+
+    def step(self) -> float:
+        """runs a single polling tick and returns the number of seconds
+        to wait before the next one"""
+        if self.started_at is None:
+            self.started_at = monotonic()
+
+        relayed = self.tick()
+        if self.is_finished:
+            self.finished_at = monotonic()
+            return 0.0
+
+        if relayed >= self.page_size:
+            # a full page came back, the next one is likely full as well
+            self.interval = self.min_interval
+            return self.min_interval
+
+        if relayed:
+            # wait long enough for the next page to be full
+            growth = min(1.0 / self.last_page_fill, self.backoff_factor)
+            self.interval = min(self.interval * growth, self.max_interval)
+            return self.interval
+
+        delay = self.interval
+        self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+        return delay
+
+    def poll(self) -> Dict:
+        """blocks until the batch is finished and its log consumed,
+        returns the last batch info"""
+        while not self.is_finished:
+            delay = self.step()
+            if delay:
+                sleep(delay)
+        return self.batch_info
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or monotonic()) - self.started_at
+        return {
+            'log_requests': self.log_requests,
+            'state_requests': self.state_requests,
+            'lines_consumed': self.lines_consumed,
+            'seconds': round(elapsed, 3)
+        }
+
+
+def record_poll_metrics(stats: Dict[str, float], tags: Dict[str, str]):
+    """adds the request and line counts of `LivyBatchPoller.stats` to the metrics"""
+    metrics = get_metrics()
+    metrics.incr('livy.polls', stats['log_requests'] + stats['state_requests'], tags)
+    metrics.incr('livy.log_lines', stats['lines_consumed'], tags)
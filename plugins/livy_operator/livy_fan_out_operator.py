@@ -0,0 +1,213 @@
+import asyncio
+from time import monotonic
+from typing import Dict, List, Optional
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from ddi_utils.metrics import get_metrics, operator_tags
+from livy_operator.livy_batch_monitor import AsyncLivyClient, LivyBatchMonitor
+from livy_operator.livy_batch_poller import record_poll_metrics
+from livy_operator.livy_resilience import RetryPolicy
+
+
+class LivyFanOutOperator(BaseOperator):
+    """
+    Operator to submit the same spark application once per set of
+    application arguments and to follow all the resulting Livy batches
+    concurrently.
+
+    The list of per-batch outcomes (application args, batch id, state,
+    appId, wall-clock seconds and error) is pushed to XCom under the
+    `outcomes` key, also when some batches failed.
+
+    :param application_args_list: one list of application arguments per
+        batch, eg. built with `get_application_args` from dags/utils.py
+    :type application_args_list: List[List[str]]
+    :param max_concurrency: maximum number of batches running at once
+    :type max_concurrency: int
+    :param fail_fast: on the first failed batch, stop submitting and kill the
+        batches that are still running. Otherwise every batch runs and the
+        failures are collected.
+    :type fail_fast: bool
+    :param max_workers: number of livy requests that can be in flight at once
+    :type max_workers: int
+    :param requests_per_second: livy requests per second allowed to the
+        task, raise it when following many batches with a short poll_interval
+    :type requests_per_second: float
+    :param failure_threshold: consecutive failed requests after which the
+        requests to the livy server are paused
+    :type failure_threshold: int
+    :param reset_timeout: seconds before the requests are tried again
+    :type reset_timeout: float
+    :param retry_policy: how failed livy requests are retried
+    :type retry_policy: livy_operator.livy_resilience.RetryPolicy
+    """
+
+    ui_color = '#e8f7e4'
+
+    template_fields = ('host', 'port', 'deploy_mode', 'master', 'app_name',
+                       'entry_point', 'python_files', 'application_args_list',
+                       'spark_conf')
+
+    @apply_defaults
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 entry_point: str,
+                 application_args_list: List[List[str]],
+                 deploy_mode: str = 'cluster',
+                 master: str = 'yarn',
+                 python_files: List[str] = [],
+                 app_name=None,
+                 spark_conf: Dict[str, str] = dict(),
+                 max_concurrency: int = 10,
+                 fail_fast: bool = False,
+                 max_workers: int = 8,
+                 log_page_size: int = 1000,
+                 poll_interval: float = 1.0,
+                 max_poll_interval: float = 30.0,
+                 requests_per_second: float = 20.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 5.0,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 *args,
+                 **kwargs):
+        super(LivyFanOutOperator, self).__init__(*args, **kwargs)
+
+        self.host = host
+        self.port = port
+        self.deploy_mode = deploy_mode
+        self.master = master
+        self.entry_point = entry_point
+        self.application_args_list = application_args_list
+        self.python_files = python_files
+        self.app_name = app_name
+        self.spark_conf = spark_conf
+        self.max_concurrency = max_concurrency
+        self.fail_fast = fail_fast
+        self.max_workers = max_workers
+        self.log_page_size = log_page_size
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.requests_per_second = requests_per_second
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_policy = retry_policy
+
+    def _app_name(self, index):
+        if not self.app_name:
+            return None
+        return '{name}-{index}'.format(name=self.app_name, index=index)
+
+    async def _run_batch(self, client, monitor, semaphore, failed, index, app_args):
+        outcome = {'index': index, 'args': app_args, 'batch_id': None,
+                   'state': None, 'app_id': None, 'seconds': None, 'error': None}
+
+        async with semaphore:
+            if self.fail_fast and failed.is_set():
+                outcome['state'] = 'not_submitted'
+                return outcome
+
+            started_at = monotonic()
+            try:
+                with get_metrics().timer('livy.submit_duration', operator_tags(self)):
+                    batch_id = await client.submit_batch(entry_point=self.entry_point,
+                                                         app_name=self._app_name(index),
+                                                         app_args=app_args,
+                                                         python_files=self.python_files,
+                                                         spark_conf=self.spark_conf)
+                outcome['batch_id'] = batch_id
+                self.log.info('submitted batch %s for args %s', batch_id, app_args)
+                if self.fail_fast and failed.is_set():
+                    # another batch failed while this one was submitted, the
+                    # kill sweep may have missed it
+                    self.log.info('killing batch %s', batch_id)
+                    await client.kill_batch(batch_id)
+                    outcome['state'] = 'killed'
+                    return outcome
+
+                batch_info = await monitor.watch(batch_id)
+                outcome['state'] = batch_info.get('state')
+                outcome['app_id'] = batch_info.get('appId')
+            except asyncio.CancelledError:
+                outcome['state'] = 'cancelled'
+                raise
+            except Exception as ex:
+                outcome['error'] = str(ex)
+            finally:
+                outcome['seconds'] = round(monotonic() - started_at, 3)
+
+        if outcome['state'] != 'success':
+            failed.set()
+        return outcome
+
+    async def _fan_out(self, client, monitor):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        failed = asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(self._run_batch(client, monitor, semaphore,
+                                                  failed, index, app_args))
+            for index, app_args in enumerate(self.application_args_list)
+        ]
+
+        if self.fail_fast:
+            pending = set(tasks)
+            while pending and not failed.is_set():
+                _, pending = await asyncio.wait(pending,
+                                                return_when=asyncio.FIRST_COMPLETED)
+            if failed.is_set():
+                running = [batch_id for batch_id, poller in monitor.pollers.items()
+                           if not poller.is_finished]
+                for batch_id in running:
+                    self.log.info('killing batch %s', batch_id)
+                    try:
+                        await client.kill_batch(batch_id)
+                    except AirflowException as ex:
+                        self.log.warning(str(ex))
+
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def execute(self, context):
+        client = AsyncLivyClient(host=self.host, port=self.port,
+                                 deploy_mode=self.deploy_mode, master=self.master,
+                                 max_workers=self.max_workers,
+                                 requests_per_second=self.requests_per_second,
+                                 failure_threshold=self.failure_threshold,
+                                 reset_timeout=self.reset_timeout,
+                                 retry_policy=self.retry_policy)
+        monitor = LivyBatchMonitor(client,
+                                   page_size=self.log_page_size,
+                                   min_interval=self.poll_interval,
+                                   max_interval=self.max_poll_interval)
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(self._fan_out(client, monitor))
+        finally:
+            loop.close()
+            self.log.info('livy poll stats: %s', monitor.stats())
+            client.close()
+            for stats in monitor.stats().values():
+                record_poll_metrics(stats, operator_tags(self))
+            get_metrics().flush()
+
+        outcomes = []
+        for index, (app_args, result) in enumerate(zip(self.application_args_list,
+                                                       results)):
+            if isinstance(result, BaseException):
+                result = {'index': index, 'args': app_args, 'batch_id': None,
+                          'state': 'cancelled', 'app_id': None, 'seconds': None,
+                          'error': str(result)}
+            outcomes.append(result)
+            self.log.info('batch %s %s: state=%s seconds=%s error=%s',
+                          result['batch_id'], app_args, result['state'],
+                          result['seconds'], result['error'])
+
+        context['ti'].xcom_push(key='outcomes', value=outcomes)
+
+        failures = [outcome for outcome in outcomes if outcome['state'] != 'success']
+        if failures:
+            raise AirflowException('{failed} of {total} livy batches did not finish '
+                                   'successfully'.format(failed=len(failures),
+                                                         total=len(outcomes)))
@@ -1,14 +1,70 @@
-from typing import Dict, List
+import sqlite3
+import time
+from typing import Dict, List, Optional
 
 from airflow.exceptions import AirflowException
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from ddi_utils.metrics import get_metrics, operator_tags
 from livy_operator.apache_livy_client import LivyClient
+from livy_operator.livy_batch_poller import record_poll_metrics
+from livy_operator.livy_run_history import (DEFAULT_HISTORY_PATH, MemoryErrorCounter,
+                                            ResourceRecommender, RunHistory)
+from livy_operator.log_sinks import (FileSink, LevelFilter, LogPipeline, RegexFilter,
+                                     S3ChunkSink, TaskLogSink)
 
 
 class LivyOperator(BaseOperator):
     """
     Operator to submit a spark application to a Livy Rest Endpoint.
+
+    :param pool_maxsize: maximum number of keep-alive connections to livy
+    :type pool_maxsize: int
+    :param keep_alive: reuse connections between livy requests
+    :type keep_alive: bool
+    :param share_session: share the connection pool with every other livy
+        client of the worker process talking to the same host and port
+    :type share_session: bool
+    :param log_page_size: maximum number of log lines fetched per request
+    :type log_page_size: int
+    :param poll_interval: seconds between state polls while the batch is quiet,
+        doubled on every quiet poll up to `max_poll_interval`
+    :type poll_interval: float
+    :param max_poll_interval: upper bound of the poll interval
+    :type max_poll_interval: float
+    :param wait_for_completion: when False the operator only submits the
+        batch and returns its id (pushed to XCom), so the batch can be
+        followed by a LivyBatchMonitorOperator without holding this slot
+    :type wait_for_completion: bool
+    :param log_tail_lines: only write the last lines of the driver log to the
+        task log, once the batch is finished
+    :type log_tail_lines: int
+    :param log_min_level: drop the driver log lines below this log4j level
+    :type log_min_level: str
+    :param log_include: only keep the driver log lines matching this regex
+    :type log_include: str
+    :param log_exclude: drop the driver log lines matching this regex
+    :type log_exclude: str
+    :param log_file: also append the driver log to this local file,
+        gzip compressed when it ends with .gz
+    :type log_file: str
+    :param log_s3_url: also upload the driver log as gzip compressed chunks
+        under this s3://bucket/prefix
+    :type log_s3_url: str
+    :param log_s3_conn_id: the S3 connection of `log_s3_url`
+    :type log_s3_conn_id: str
+    :param log_buffer_lines: driver log lines buffered for the sinks, the
+        oldest are dropped when the sinks fall behind
+    :type log_buffer_lines: int
+    :param record_history: record the runtime, state, application id and
+        conf of the batch in the run history of the worker
+    :type record_history: bool
+    :param apply_recommendation: submit the batch with the executor count
+        and memory recommended from the run history of the task instead of
+        the `spark_conf` ones
+    :type apply_recommendation: bool
+    :param run_history_path: the sqlite run history
+    :type run_history_path: str
     """
 
     ui_color = '#e8f7e4'
@@ -16,7 +72,7 @@ class LivyOperator(BaseOperator):
     # airflow will made the rendered template from these
     template_fields = ('host', 'port', 'deploy_mode', 'master', 'app_name',
                        'entry_point', 'python_files', 'application_args',
-                       'spark_conf')
+                       'spark_conf', 'log_file', 'log_s3_url')
 
     @apply_defaults
     def __init__(self,
@@ -29,6 +85,24 @@ class LivyOperator(BaseOperator):
                  application_args: List[str] = [],
                  app_name=None,
                  spark_conf: Dict[str, str] = dict(),
+                 pool_maxsize: int = 10,
+                 keep_alive: bool = True,
+                 share_session: bool = False,
+                 log_page_size: int = 1000,
+                 poll_interval: float = 1.0,
+                 max_poll_interval: float = 30.0,
+                 wait_for_completion: bool = True,
+                 log_tail_lines: Optional[int] = None,
+                 log_min_level: Optional[str] = None,
+                 log_include: Optional[str] = None,
+                 log_exclude: Optional[str] = None,
+                 log_file: Optional[str] = None,
+                 log_s3_url: Optional[str] = None,
+                 log_s3_conn_id: str = 'aws_default',
+                 log_buffer_lines: int = 100000,
+                 record_history: bool = True,
+                 apply_recommendation: bool = False,
+                 run_history_path: str = DEFAULT_HISTORY_PATH,
                  *args,
                  **kwargs):
 
@@ -43,6 +117,72 @@ class LivyOperator(BaseOperator):
         self.application_args = application_args
         self.app_name = app_name
         self.spark_conf = spark_conf
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.share_session = share_session
+        self.log_page_size = log_page_size
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.wait_for_completion = wait_for_completion
+        self.log_tail_lines = log_tail_lines
+        self.log_min_level = log_min_level
+        self.log_include = log_include
+        self.log_exclude = log_exclude
+        self.log_file = log_file
+        self.log_s3_url = log_s3_url
+        self.log_s3_conn_id = log_s3_conn_id
+        self.log_buffer_lines = log_buffer_lines
+        self.record_history = record_history
+        self.apply_recommendation = apply_recommendation
+        self.run_history_path = run_history_path
+
+    @property
+    def history_job(self) -> str:
+        return '{dag_id}.{task_id}'.format(dag_id=self.dag_id, task_id=self.task_id)
+
+    def _recommended_conf(self, history: RunHistory) -> Dict[str, str]:
+        """returns the resources recommended from the run history, to apply
+        when `apply_recommendation` is set, otherwise only logged"""
+        try:
+            runs = history.runs(self.history_job)
+        except (sqlite3.Error, OSError) as ex:
+            self.log.warning('could not read the livy run history: %s', ex)
+            return {}
+        recommendation = ResourceRecommender().recommend(runs, self.spark_conf)
+        if recommendation:
+            self.log.info('recommended from %d runs: %s%s', len(runs), recommendation,
+                          '' if self.apply_recommendation else ' (not applied)')
+        return recommendation if self.apply_recommendation else {}
+
+    def _record_run(self, history: RunHistory, runtime: float, batch_id, batch: Dict,
+                    conf: Dict[str, str], memory_errors: int):
+        try:
+            history.record(self.history_job, runtime, batch['state'], conf,
+                           app_id=batch['appId'], batch_id=batch_id,
+                           memory_errors=memory_errors)
+        except (sqlite3.Error, OSError) as ex:
+            # the history must never fail a task
+            self.log.warning('could not record the run in the livy run history: %s', ex)
+
+    def _log_pipeline(self, memory_errors: MemoryErrorCounter) -> LogPipeline:
+        """returns the pipeline relaying the driver log to the task log and
+        the other configured sinks, the filters apply to every sink"""
+        sinks = [TaskLogSink(tail_lines=self.log_tail_lines)]
+        if self.log_file:
+            sinks.append(FileSink(self.log_file))
+        if self.log_s3_url:
+            from airflow.hooks.S3_hook import S3Hook
+
+            bucket, prefix = S3Hook.parse_s3_url(self.log_s3_url)
+            sinks.append(S3ChunkSink(S3Hook(self.log_s3_conn_id).get_conn(),
+                                     bucket, prefix))
+
+        filters = [memory_errors]
+        if self.log_min_level:
+            filters.append(LevelFilter(self.log_min_level))
+        if self.log_include or self.log_exclude:
+            filters.append(RegexFilter(self.log_include, self.log_exclude))
+        return LogPipeline(sinks, filters, buffer_lines=self.log_buffer_lines)
 
     def execute(self, context):
         """
@@ -54,22 +194,62 @@ class LivyOperator(BaseOperator):
         client = LivyClient(host=self.host,
                             port=self.port,
                             deploy_mode=self.deploy_mode,
-                            master=self.master)
+                            master=self.master,
+                            pool_maxsize=self.pool_maxsize,
+                            keep_alive=self.keep_alive,
+                            share_session=self.share_session)
+        metrics = get_metrics()
+        tags = operator_tags(self)
+        history = None
+        recommended_conf = None
+        if self.record_history or self.apply_recommendation:
+            history = RunHistory(self.run_history_path)
+            recommended_conf = self._recommended_conf(history)
+
+        try:
+            started_at = time.monotonic()
+            with metrics.timer('livy.submit_duration', tags):
+                livy_batch_id = client.submit_batch(entry_point=self.entry_point,
+                                                    app_name=self.app_name,
+                                                    app_args=self.application_args,
+                                                    python_files=self.python_files,
+                                                    spark_conf=self.spark_conf,
+                                                    recommended_conf=recommended_conf
+                                                    )
 
-        livy_batch_id = client.submit_batch(entry_point=self.entry_point,
-                                            app_name=self.app_name,
-                                            app_args=self.application_args,
-                                            python_files=self.python_files,
-                                            spark_conf=self.spark_conf
-                                            )
+            if not self.wait_for_completion:
+                self.log.info('submitted livy batch %s, not waiting for it',
+                              livy_batch_id)
+                return livy_batch_id
 
-        client.consume_log(livy_batch_id)
+            memory_errors = MemoryErrorCounter()
+            log_pipeline = self._log_pipeline(memory_errors)
+            try:
+                client.consume_log(livy_batch_id,
+                                   page_size=self.log_page_size,
+                                   min_interval=self.poll_interval,
+                                   max_interval=self.max_poll_interval,
+                                   line_handler=log_pipeline)
+            finally:
+                log_pipeline.close()
+            self.log.info('livy poll stats: %s, log stats: %s',
+                          client.last_poll_stats, log_pipeline.stats())
+            record_poll_metrics(client.last_poll_stats, tags)
 
-        client.print_batch_info(livy_batch_id)
+            batch = client.print_batch_info(livy_batch_id)
+            if self.record_history:
+                self._record_run(history, time.monotonic() - started_at, livy_batch_id,
+                                 batch, client.last_submitted_conf, memory_errors.count)
 
-        if not client.is_successful_finish(livy_batch_id):
-            batch_status = client.batch_status(livy_batch_id)
-            message = 'batch id: {batch} failed with status: {status}, type:{type}' \
-                .format(batch=livy_batch_id, status=batch_status,
-                        type=batch_status)
-            raise AirflowException(message)
+            if not client.is_successful_finish(livy_batch_id):
+                batch_status = client.batch_status(livy_batch_id)
+                message = 'batch id: {batch} failed with status: {status}, type:{type}' \
+                    .format(batch=livy_batch_id, status=batch_status,
+                            type=batch_status)
+                raise AirflowException(message)
+        finally:
+            self.log.info('livy connection stats: %s', client.connection_stats())
+            client.close()
+            if history is not None:
+                history.close()
+            metrics.flush()
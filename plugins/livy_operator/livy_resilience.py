@@ -0,0 +1,145 @@
+import random
+import threading
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+from ddi_utils import TokenBucket
+
+# answers worth retrying: the request was throttled or livy (or the proxy in
+# front of it) could not handle it
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# a POST answered with these statuses was not processed, so it cannot have
+# created a batch, session or statement
+POST_RETRY_STATUSES = (429, 503)
+
+
+class RetryPolicy:
+    """
+    How a failed Livy request is retried.
+
+    The delays grow exponentially and are fully jittered, so clients failing
+    at the same moment (eg. when Livy restarts) spread their retries instead
+    of coming back in lockstep. A `Retry-After` header of a 429/503 answer
+    takes precedence over the computed delay.
+
+    :param max_retries: retries of one request
+    :type max_retries: int
+    :param backoff_base: upper bound of the first delay, in seconds
+    :type backoff_base: float
+    :param backoff_max: upper bound of every delay, in seconds
+    :type backoff_max: float
+    :param deadline: seconds after which a request is not retried anymore,
+        including the time spent waiting for an open circuit
+    :type deadline: float
+    """
+
+    def __init__(self, max_retries: int = 5, backoff_base: float = 0.5,
+                 backoff_max: float = 30.0, deadline: float = 300.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """returns the seconds to wait before retry number `attempt` (from 0)"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a Livy server that keeps failing.
+
+    After `failure_threshold` consecutive failures (connection errors,
+    timeouts and 5xx answers) the circuit opens: requests wait instead of
+    hitting the server. After `reset_timeout` seconds a single request is let
+    through as a probe, its success closes the circuit for everyone, its
+    failure opens it again. A probe that did not report back after
+    `probe_timeout` seconds is replaced by another one.
+
+    :param failure_threshold: consecutive failures opening the circuit
+    :type failure_threshold: int
+    :param reset_timeout: seconds before an open circuit lets a probe through
+    :type reset_timeout: float
+    :param probe_timeout: seconds after which a probe is considered lost
+    :type probe_timeout: float
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0,
+                 probe_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """returns 0 when a request may be sent now, otherwise the seconds
+        until the next probe may be. A caller getting 0 from a circuit that
+        was open is the probe and must report its outcome."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            now = monotonic()
+            if self.state == self.HALF_OPEN:
+                if now - self._probe_started_at < self.probe_timeout:
+                    # check again soon, the probe may close the circuit
+                    return min(self.reset_timeout, 1.0)
+            else:
+                remaining = self._opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    return remaining
+            self.state = self.HALF_OPEN
+            self._probe_started_at = now
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened_count += 1
+                self.state = self.OPEN
+                self._opened_at = monotonic()
+
+
+# shared by every LivyClient of this worker process, keyed by (host, port)
+_CIRCUIT_BREAKERS = {}  # type: Dict[Tuple[str, int], CircuitBreaker]
+_RATE_LIMITERS = {}  # type: Dict[Tuple[str, int], TokenBucket]
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(host: str, port: int, failure_threshold: int = 5,
+                        reset_timeout: float = 5.0) -> CircuitBreaker:
+    """returns the circuit breaker of the livy server at host:port"""
+    with _REGISTRY_LOCK:
+        return _CIRCUIT_BREAKERS.setdefault(
+            (host, port), CircuitBreaker(failure_threshold, reset_timeout))
+
+
+def get_rate_limiter(host: str, port: int, requests_per_second: float,
+                     burst: Optional[float] = None) -> TokenBucket:
+    """returns the token bucket limiting the requests of this process to
+    the livy server at host:port. The first caller sets the rate."""
+    with _REGISTRY_LOCK:
+        return _RATE_LIMITERS.setdefault(
+            (host, port), TokenBucket(requests_per_second,
+                                      burst if burst is not None else 2 * requests_per_second))
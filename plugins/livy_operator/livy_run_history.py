@@ -0,0 +1,287 @@
+import json
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_HISTORY_PATH = os.environ.get(
+    'DDI_LIVY_HISTORY_PATH',
+    os.path.join(os.environ.get('AIRFLOW_HOME', os.path.expanduser('~/airflow')),
+                 'livy_run_history.sqlite'))
+
+# spark default, used when a run did not set its executor memory
+DEFAULT_EXECUTOR_MEMORY_MB = 1024
+
+MEMORY_ERROR_PATTERN = re.compile(r'OutOfMemoryError|exceeding memory limits|'
+                                  r'Container killed .* memory|exit code 137')
+MEMORY_PATTERN = re.compile(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', re.IGNORECASE)
+MEMORY_UNITS_MB = {'k': 1 / 1024, '': 1 / (1024 * 1024), 'm': 1, 'g': 1024, 't': 1024 * 1024}
+
+
+def parse_memory_mb(value: Optional[str], default: int = DEFAULT_EXECUTOR_MEMORY_MB) -> int:
+    """returns a spark memory setting (eg. `4g`, `512m`) in MiB. A bare
+    number is in MiB, as spark reads it."""
+    if not value:
+        return default
+    match = MEMORY_PATTERN.match(str(value))
+    if not match:
+        return default
+    unit = match.group(2).lower()
+    factor = MEMORY_UNITS_MB[unit] if unit else 1
+    return max(1, int(int(match.group(1)) * factor))
+
+
+def executor_key(conf: Dict[str, str]) -> str:
+    """returns the conf key bounding the executor count of a run"""
+    if str(conf.get('spark.dynamicAllocation.enabled', '')).lower() == 'true':
+        return 'spark.dynamicAllocation.maxExecutors'
+    return 'spark.executor.instances'
+
+
+def executor_count(conf: Dict[str, str]) -> Optional[int]:
+    """returns the executor bound of a run, None when the conf does not set
+    it (eg. dynamic allocation without maxExecutors is unbounded)"""
+    try:
+        return int(conf[executor_key(conf)])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class MemoryErrorCounter:
+    """
+    Counts the driver log lines reporting an out of memory executor or
+    driver. It is a `LogPipeline` filter letting every line through, so it
+    must come first to see the lines the other filters drop.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, line: str) -> bool:
+        if MEMORY_ERROR_PATTERN.search(line):
+            self.count += 1
+        return True
+
+
+class RunHistory:
+    """
+    Outcome of the livy batches of every job, in a local sqlite database:
+    runtime, final state, application id, memory errors and the conf the
+    batch was submitted with. Only the last `max_runs_per_job` runs of a
+    job are kept.
+
+    :param path: the sqlite database
+    :type path: str
+    :param max_runs_per_job: runs kept per job
+    :type max_runs_per_job: int
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH, max_runs_per_job: int = 50):
+        self.path = path
+        self.max_runs_per_job = max_runs_per_job
+        self._connection = None  # type: Optional[sqlite3.Connection]
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # several tasks of a worker may record at once
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    job TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    runtime REAL NOT NULL,
+                    state TEXT,
+                    app_id TEXT,
+                    batch_id INTEGER,
+                    memory_errors INTEGER NOT NULL DEFAULT 0,
+                    conf TEXT NOT NULL
+                )''')
+            connection.execute('CREATE INDEX IF NOT EXISTS runs_job ON runs (job, started_at)')
+            self._connection = connection
+        return self._connection
+
+    def record(self, job: str, runtime: float, state: str, conf: Dict[str, str],
+               app_id: Optional[str] = None, batch_id: Optional[int] = None,
+               memory_errors: int = 0, started_at: Optional[float] = None):
+        """records a finished run of `job`, `runtime` in seconds"""
+        started_at = started_at if started_at is not None else time.time() - runtime
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    'INSERT INTO runs (job, started_at, runtime, state, app_id, batch_id, '
+                    'memory_errors, conf) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job, started_at, runtime, state, app_id, batch_id, memory_errors,
+                     json.dumps(conf, sort_keys=True)))
+                connection.execute(
+                    'DELETE FROM runs WHERE job = ? AND rowid NOT IN '
+                    '(SELECT rowid FROM runs WHERE job = ? ORDER BY started_at DESC LIMIT ?)',
+                    (job, job, self.max_runs_per_job))
+
+    def runs(self, job: str, limit: int = -1) -> List[Dict]:
+        """returns the last runs of `job` (all the kept ones by default),
+        the latest first"""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT started_at, runtime, state, app_id, batch_id, memory_errors, conf '
+                'FROM runs WHERE job = ? ORDER BY started_at DESC LIMIT ?',
+                (job, limit)).fetchall()
+        return [{'started_at': started_at, 'runtime': runtime, 'state': state,
+                 'app_id': app_id, 'batch_id': batch_id, 'memory_errors': memory_errors,
+                 'conf': json.loads(conf)}
+                for started_at, runtime, state, app_id, batch_id, memory_errors, conf in rows]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ResourceRecommender:
+    """
+    Suggests the executor count and memory of a job from its run history.
+    The search goes on from the settings of the last run, which are the
+    recommended ones when the recommendations are applied.
+
+    Executors: runs not setting their executor bound are ignored, and no
+    count is recommended until a run sets one. The search starts from the
+    last run's count, or from the largest count observed when the last run
+    did not set one. Among the executor counts with `min_runs` successful runs,
+    the one using the fewest executor-seconds (executors x median runtime)
+    while staying within `runtime_tolerance` of the fastest one wins. When
+    that is the smallest count tried so far, the next runs probe
+    `step_down` times fewer executors, so over-provisioned jobs shrink
+    until the runtime suffers.
+
+    Memory: a last run having an out of memory error raises it by
+    `step_up`. After `min_runs` successful runs without memory errors at
+    the last executor count and memory it is lowered by `step_down`, as
+    long as their median runtime stays within `runtime_tolerance` of the
+    best setting's, and never to within `step_up` of a setting that ran
+    out of memory. When it does not, the memory goes back to the smallest
+    larger setting that did, and is not lowered to the slow one again.
+
+    Only one of them changes per run, so the runtime of a run tells which
+    change caused it: raising the memory after a memory error comes first,
+    then the executor count, then lowering the memory.
+
+    :param min_runs: successful runs needed before changing a setting
+    :type min_runs: int
+    :param runtime_tolerance: slowdown accepted to save executors
+    :type runtime_tolerance: float
+    :param step_down: factor probing smaller settings
+    :type step_down: float
+    :param step_up: factor raising the memory after a memory error
+    :type step_up: float
+    """
+
+    def __init__(self, min_runs: int = 3, runtime_tolerance: float = 1.2,
+                 step_down: float = 0.75, step_up: float = 1.5,
+                 min_executors: int = 1, max_executors: int = 200,
+                 min_memory_mb: int = 1024, max_memory_mb: int = 64 * 1024):
+        self.min_runs = min_runs
+        self.runtime_tolerance = runtime_tolerance
+        self.step_down = step_down
+        self.step_up = step_up
+        self.min_executors = min_executors
+        self.max_executors = max_executors
+        self.min_memory_mb = min_memory_mb
+        self.max_memory_mb = max_memory_mb
+
+    def _executors(self, runs: List[Dict]) -> Optional[int]:
+        counts = [executor_count(run['conf']) for run in runs]
+        known = [count for count in counts if count is not None]
+        if not known:
+            return None
+        last = counts[0] if counts[0] is not None else max(known)
+
+        runtimes = {}  # type: Dict[int, List[float]]
+        for run, count in zip(runs, counts):
+            if run['state'] == 'success' and count is not None:
+                runtimes.setdefault(count, []).append(run['runtime'])
+        medians = {count: statistics.median(values) for count, values in runtimes.items()
+                   if len(values) >= self.min_runs}
+        if not medians or (last not in medians and runs[0]['state'] == 'success'):
+            # not enough runs with the last count yet
+            return last
+
+        fastest = min(medians.values())
+        acceptable = [count for count, median in medians.items()
+                      if median <= fastest * self.runtime_tolerance]
+        best = min(acceptable, key=lambda count: count * medians[count])
+        if best == last and best == min(runtimes):
+            best = int(best * self.step_down)
+        return max(self.min_executors, min(self.max_executors, best))
+
+    @staticmethod
+    def _memory_of(run: Dict) -> int:
+        return parse_memory_mb(run['conf'].get('spark.executor.memory'))
+
+    def _memory_mb(self, runs: List[Dict]) -> int:
+        last = self._memory_of(runs[0])
+        if runs[0]['memory_errors']:
+            memory = int(last * self.step_up)
+        else:
+            at_last = [run for run in runs if self._memory_of(run) == last]
+            if any(run['memory_errors'] for run in at_last):
+                return last
+            # the median runtime of every setting with enough successful runs
+            runtimes = {}  # type: Dict[tuple, List[float]]
+            for run in runs:
+                if run['state'] == 'success':
+                    setting = (executor_count(run['conf']), self._memory_of(run))
+                    runtimes.setdefault(setting, []).append(run['runtime'])
+            medians = {setting: statistics.median(values)
+                       for setting, values in runtimes.items() if len(values) >= self.min_runs}
+            executors = executor_count(runs[0]['conf'])
+            current = medians.get((executors, last))
+            if current is None:
+                return last
+            acceptable = min(medians.values()) * self.runtime_tolerance
+            if current > acceptable:
+                # the last step down slowed the job: back to the smallest
+                # larger setting that was fast enough
+                larger = [memory for (count, memory), median in medians.items()
+                          if count == executors and memory > last and median <= acceptable]
+                return min(larger, default=last)
+            failed = [self._memory_of(run) for run in runs if run['memory_errors']]
+            slow = [memory for (count, memory), median in medians.items()
+                    if count == executors and median > acceptable]
+            memory = int(last * self.step_down)
+            if (failed and memory < max(failed) * self.step_up) or \
+                    (slow and memory <= max(slow)):
+                return last
+        return max(self.min_memory_mb, min(self.max_memory_mb, memory))
+
+    def recommend(self, runs: List[Dict], conf: Dict[str, str]) -> Dict[str, str]:
+        """
+        returns the spark conf settings of the next run differing from
+        `conf`, nothing when the history is empty
+
+        :param runs: the history of the job, the latest first
+        :param conf: the spark conf the next run would be submitted with
+        """
+        if not runs:
+            return {}
+        last_executors = executor_count(runs[0]['conf'])
+        last_memory = self._memory_of(runs[0])
+        executors = self._executors(runs)
+        memory = self._memory_mb(runs)
+        # one dimension per run
+        if memory > last_memory:
+            executors = last_executors
+        elif executors is not None and executors != last_executors:
+            memory = last_memory
+
+        recommendation = {}
+        if executors is not None and executors != executor_count(conf):
+            recommendation[executor_key(conf)] = str(executors)
+        if memory != parse_memory_mb(conf.get('spark.executor.memory')):
+            recommendation['spark.executor.memory'] = '{}m'.format(memory)
+        return recommendation
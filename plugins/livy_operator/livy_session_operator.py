@@ -0,0 +1,101 @@
+from typing import Dict, List
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from ddi_utils.metrics import get_metrics, operator_tags
+from livy_operator.apache_livy_client import LivyClient
+from livy_operator.livy_session_pool import LivySessionPool, SessionProfile
+
+
+class LivySessionOperator(BaseOperator):
+    """
+    Operator to run a spark application as a statement in a warm Livy
+    interactive session, skipping the spark application startup.
+
+    The session is leased from a LivySessionPool keyed on the entry point,
+    python files and spark conf, and returned to the pool afterwards.
+
+    :param pool_size: number of warm sessions kept for this profile
+    :type pool_size: int
+    :param idle_timeout: seconds after which an unused session is deleted
+    :type idle_timeout: float
+    :param lease_timeout: seconds to wait for an idle session before failing
+    :type lease_timeout: float
+    """
+
+    ui_color = '#e8f7e4'
+
+    template_fields = ('host', 'port', 'deploy_mode', 'master', 'entry_point',
+                       'python_files', 'application_args', 'spark_conf')
+
+    @apply_defaults
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 entry_point: str,
+                 deploy_mode: str = 'cluster',
+                 master: str = 'yarn',
+                 python_files: List[str] = [],
+                 application_args: List[str] = [],
+                 spark_conf: Dict[str, str] = dict(),
+                 pool_size: int = 2,
+                 idle_timeout: float = 1800,
+                 lease_timeout: float = 600,
+                 poll_interval: float = 2.0,
+                 *args,
+                 **kwargs):
+        super(LivySessionOperator, self).__init__(*args, **kwargs)
+
+        self.host = host
+        self.port = port
+        self.deploy_mode = deploy_mode
+        self.master = master
+        self.entry_point = entry_point
+        self.python_files = python_files
+        self.application_args = application_args
+        self.spark_conf = spark_conf
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+
+    def execute(self, context):
+        client = LivyClient(host=self.host,
+                            port=self.port,
+                            deploy_mode=self.deploy_mode,
+                            master=self.master)
+        pool = LivySessionPool(client,
+                               size=self.pool_size,
+                               idle_timeout=self.idle_timeout,
+                               lease_timeout=self.lease_timeout,
+                               poll_interval=self.poll_interval)
+        profile = SessionProfile(entry_point=self.entry_point,
+                                 python_files=self.python_files,
+                                 spark_conf=self.spark_conf)
+
+        metrics = get_metrics()
+        tags = operator_tags(self)
+        try:
+            with pool.lease(profile) as session_id:
+                self.log.info('running in livy session %s', session_id)
+                with metrics.timer('livy.statement_duration', tags):
+                    statement = pool.run(session_id,
+                                         profile.statement_code(self.application_args))
+        finally:
+            client.close()
+            metrics.flush()
+
+        output = statement.get('output') or {}
+        text = (output.get('data') or {}).get('text/plain')
+        if text:
+            print(text)
+
+        if statement.get('state') != 'available' or output.get('status') != 'ok':
+            message = 'statement {id} in session {session} failed with state: ' \
+                      '{state}, {ename}: {evalue}\n{traceback}'.format(
+                          id=statement.get('id'), session=session_id,
+                          state=statement.get('state'), ename=output.get('ename'),
+                          evalue=output.get('evalue'),
+                          traceback=''.join(output.get('traceback') or []))
+            raise AirflowException(message)
@@ -0,0 +1,353 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from time import monotonic, sleep, time
+from typing import Dict, List, Optional, Set
+
+from airflow.exceptions import AirflowException
+from livy_operator.apache_livy_client import LivyClient
+
+SESSION_NAME_PREFIX = 'airflow-pool'
+# `<name prefix><started at, hex epoch seconds>-<random suffix>`
+SESSION_STARTED_PATTERN = re.compile(r'-([0-9a-f]{8})-[0-9a-f]{8}$')
+
+# the lease locks of the sessions, shared by the processes of a host
+LEASE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'livy-session-leases')
+
+SESSION_STARTING_STATES = ('not_started', 'starting', 'recovering')
+SESSION_READY_STATES = ('idle',)
+SESSION_BUSY_STATES = ('busy',)
+SESSION_DEAD_STATES = ('shutting_down', 'error', 'dead', 'killed', 'success')
+
+STATEMENT_FINISHED_STATES = ('available', 'error', 'cancelled')
+
+# runs the entry point as `__main__` with the application args as sys.argv,
+# the entry point is shipped to the session through its `files`. The
+# SparkContext outlives the entry point, so stopping it is a no-op.
+STATEMENT_TEMPLATE = '''
+import runpy as _runpy
+import sys as _sys
+from pyspark import SparkContext as _SparkContext
+from pyspark import SparkFiles as _SparkFiles
+
+_argv = _sys.argv
+_stop = _SparkContext.stop
+_sys.argv = {argv!r}
+_SparkContext.stop = lambda self: None
+try:
+    _runpy.run_path(_SparkFiles.get({file_name!r}), run_name='__main__')
+except SystemExit as _exit:
+    if _exit.code not in (None, 0):
+        raise RuntimeError('entry point exited with code {{}}'.format(_exit.code))
+finally:
+    _sys.argv = _argv
+    _SparkContext.stop = _stop
+'''
+
+
+class SessionProfile:
+    """
+    The configuration a warm session is started with. Sessions can only be
+    shared between jobs with the same profile.
+    """
+
+    def __init__(self, entry_point: str, python_files: List[str] = [],
+                 spark_conf: Dict[str, str] = dict()):
+        self.entry_point = entry_point
+        self.python_files = list(python_files)
+        self.spark_conf = dict(spark_conf)
+
+    @property
+    def key(self) -> str:
+        serialized = json.dumps({'entry_point': self.entry_point,
+                                 'python_files': self.python_files,
+                                 'spark_conf': self.spark_conf}, sort_keys=True)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()[:12]
+
+    @property
+    def name_prefix(self) -> str:
+        return '{prefix}-{key}-'.format(prefix=SESSION_NAME_PREFIX, key=self.key)
+
+    def statement_code(self, application_args: List[str]) -> str:
+        file_name = os.path.basename(self.entry_point)
+        return STATEMENT_TEMPLATE.format(argv=[file_name] + list(application_args),
+                                         file_name=file_name)
+
+
+class LivySessionPool:
+    """
+    Pool of warm PySpark interactive sessions, grouped by SessionProfile.
+
+    Sessions are recognised on the Livy server by their name, so every
+    worker process shares the same warm sessions. A session is leased by
+    taking an exclusive lock on a file named after it in `LEASE_DIRECTORY`,
+    which every process of the host sees (eg. the task processes of the
+    LocalExecutor) and which is released if the process dies. Workers on
+    other hosts do not see these locks: with several worker hosts, limit the
+    tasks of a profile to `size` with an Airflow pool.
+
+    A session is healthy while Livy reports it as idle, dead sessions are
+    deleted, as are the sessions a statement failed in. Idle sessions are
+    leased least recently used first, and deleted once neither leased, nor
+    running a statement, for `idle_timeout` seconds since they were started.
+    The processes of a host list and start the sessions of a profile one at
+    a time, and delete the idle sessions above `size`.
+
+    :param client: the livy client used for the requests
+    :type client: LivyClient
+    :param size: number of sessions kept per profile
+    :type size: int
+    :param idle_timeout: seconds after which an unused session is deleted
+    :type idle_timeout: float
+    :param lease_timeout: seconds to wait for an idle session before failing
+    :type lease_timeout: float
+    :param poll_interval: seconds between session and statement state polls
+    :type poll_interval: float
+    """
+
+    _leases_lock = threading.Lock()
+    # descriptors of the lease locks held by this process, by session id
+    _leases = {}  # type: Dict[int, int]
+    # sessions of this process whose last statement failed
+    _failed_sessions = set()  # type: Set[int]
+
+    def __init__(self, client: LivyClient, size: int = 2,
+                 idle_timeout: float = 1800, lease_timeout: float = 600,
+                 poll_interval: float = 2.0):
+        self.client = client
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+
+    def _profile_sessions(self, profile: SessionProfile) -> List[dict]:
+        return [session for session in self.client.list_sessions()
+                if (session.get('name') or '').startswith(profile.name_prefix)]
+
+    def _lease_path(self, session_id) -> str:
+        return os.path.join(LEASE_DIRECTORY, '{host}-{port}-{id}.lock'.format(
+            host=self.client.host, port=self.client.port, id=session_id))
+
+    def _claim(self, session_id) -> bool:
+        """takes the lease lock of the session, returns False when another
+        lease of this host holds it"""
+        os.makedirs(LEASE_DIRECTORY, exist_ok=True)
+        descriptor = os.open(self._lease_path(session_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(descriptor)
+            return False
+        with self._leases_lock:
+            self._leases[session_id] = descriptor
+        return True
+
+    def _unclaim(self, session_id, used: bool = True, deleted: bool = False):
+        """releases the lease lock, its mtime records when the session was
+        last used"""
+        with self._leases_lock:
+            descriptor = self._leases.pop(session_id, None)
+        if descriptor is None:
+            return
+        if deleted:
+            os.unlink(self._lease_path(session_id))
+        elif used:
+            os.utime(self._lease_path(session_id))
+        os.close(descriptor)
+
+    def _last_used(self, session) -> float:
+        """returns the epoch seconds the session was started or last
+        released, whichever is later, 0 when neither is known"""
+        last_used = 0.0
+        match = SESSION_STARTED_PATTERN.search(session.get('name') or '')
+        if match:
+            last_used = float(int(match.group(1), 16))
+        try:
+            last_used = max(last_used, os.path.getmtime(self._lease_path(session['id'])))
+        except OSError:
+            pass
+        return last_used
+
+    def _last_statement(self, session) -> float:
+        """returns the epoch seconds of the last finished statement, 0
+        without any"""
+        completed = [statement.get('completed') or 0
+                     for statement in self.client.list_statements(session['id'])]
+        return max(completed, default=0) / 1000.0
+
+    def _delete(self, session):
+        print('evicting livy session {id} ({state})'.format(id=session['id'],
+                                                            state=session.get('state')))
+        self.client.delete_session(session['id'])
+
+    def _evict_if_expired(self, session) -> bool:
+        """deletes the idle session unless it was used within `idle_timeout`,
+        returns True when it was deleted. The statements are only listed for
+        the sessions neither started nor leased within `idle_timeout`."""
+        if time() - self._last_used(session) <= self.idle_timeout:
+            return False
+        if not self._claim(session['id']):
+            return False  # leased right now
+        expired = False
+        try:
+            expired = time() - self._last_statement(session) > self.idle_timeout
+            if expired:
+                self._delete(session)
+        finally:
+            self._unclaim(session['id'], used=False, deleted=expired)
+        return expired
+
+    def _evict(self, sessions: List[dict]) -> List[dict]:
+        """deletes dead and expired sessions, returns the remaining ones"""
+        alive = []
+        for session in sessions:
+            state = session.get('state')
+            if state in SESSION_DEAD_STATES:
+                self._delete(session)
+            elif not (state in SESSION_READY_STATES and self._evict_if_expired(session)):
+                alive.append(session)
+        return alive
+
+    def _start_session(self, profile: SessionProfile) -> dict:
+        # the start time in the name lets the pool expire sessions that
+        # never ran a statement
+        name = '{prefix}{started:x}-{suffix}'.format(prefix=profile.name_prefix,
+                                                     started=int(time()),
+                                                     suffix=uuid.uuid4().hex[:8])
+        print('starting livy session {name}'.format(name=name))
+        return self.client.create_session(name=name,
+                                          python_files=profile.python_files,
+                                          files=[profile.entry_point],
+                                          spark_conf=profile.spark_conf)
+
+    def _try_lease(self, sessions: List[dict]) -> Optional[int]:
+        """leases the least recently used idle session"""
+        idle = [session for session in sessions
+                if session.get('state') in SESSION_READY_STATES]
+        for session in sorted(idle, key=self._last_used):
+            if not self._claim(session['id']):
+                continue
+            # the session may have been used or deleted since it was listed
+            if self.is_healthy(session['id'], ready=True):
+                return session['id']
+            self._unclaim(session['id'], used=False)
+        return None
+
+    @contextmanager
+    def _profile_lock(self, profile: SessionProfile):
+        """serialises the list-then-start of the profile sessions between
+        the processes of the host"""
+        os.makedirs(LEASE_DIRECTORY, exist_ok=True)
+        path = os.path.join(LEASE_DIRECTORY, '{host}-{port}-profile-{key}.lock'.format(
+            host=self.client.host, port=self.client.port, key=profile.key))
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(descriptor)
+
+    def _trim(self, sessions: List[dict]) -> List[dict]:
+        """deletes the idle sessions above `size` that are not leased,
+        returns the remaining ones"""
+        surplus = len(sessions) - self.size
+        kept = []
+        for session in sorted(sessions, key=self._last_used):
+            if surplus > 0 and session.get('state') in SESSION_READY_STATES and \
+                    self._claim(session['id']):
+                deleted = False
+                try:
+                    self._delete(session)
+                    deleted = True
+                    surplus -= 1
+                finally:
+                    self._unclaim(session['id'], used=False, deleted=deleted)
+            else:
+                kept.append(session)
+        return kept
+
+    def warm_up(self, profile: SessionProfile) -> List[dict]:
+        """evicts dead sessions, then starts new ones or deletes idle ones
+        until the profile has `size` sessions, returns the sessions of the
+        profile"""
+        with self._profile_lock(profile):
+            sessions = self._trim(self._evict(self._profile_sessions(profile)))
+            for _ in range(self.size - len(sessions)):
+                sessions.append(self._start_session(profile))
+        return sessions
+
+    def acquire(self, profile: SessionProfile) -> int:
+        """returns the id of an idle session of the profile, starting the
+        pool sessions if needed and waiting for one to become idle"""
+        deadline = monotonic() + self.lease_timeout
+        sessions = self.warm_up(profile)
+        while True:
+            session_id = self._try_lease(sessions)
+            if session_id is not None:
+                return session_id
+            if monotonic() > deadline:
+                raise AirflowException('no idle livy session for profile {key} '
+                                       'after {timeout}s'.format(key=profile.key,
+                                                                 timeout=self.lease_timeout))
+            sleep(self.poll_interval)
+            sessions = self._evict(self._profile_sessions(profile))
+            if not sessions:
+                sessions = self.warm_up(profile)
+
+    def release(self, session_id, healthy: bool = True):
+        """returns the session to the pool, unhealthy sessions are deleted.
+        A failed delete is only logged, the session is evicted later."""
+        try:
+            if not healthy:
+                self.client.delete_session(session_id)
+        except Exception as ex:
+            print('could not delete livy session {id}: {error}'.format(id=session_id,
+                                                                       error=ex))
+        finally:
+            self._unclaim(session_id, deleted=not healthy)
+
+    @contextmanager
+    def lease(self, profile: SessionProfile):
+        """leases an idle session of the profile. The session is deleted
+        when a statement failed in it or when it died, since the failed code
+        may have left it unusable."""
+        session_id = self.acquire(profile)
+        healthy = True
+        try:
+            yield session_id
+        except Exception:
+            healthy = self.is_healthy(session_id)
+            raise
+        finally:
+            if session_id in self._failed_sessions:
+                self._failed_sessions.discard(session_id)
+                healthy = False
+            self.release(session_id, healthy=healthy)
+
+    def is_healthy(self, session_id, ready: bool = False) -> bool:
+        """returns whether the session is alive, or idle with `ready`"""
+        try:
+            state = self.client.session_info(session_id).get('state')
+        except AirflowException:
+            return False
+        if ready:
+            return state in SESSION_READY_STATES
+        return state not in SESSION_DEAD_STATES
+
+    def run(self, session_id, code) -> dict:
+        """runs `code` in the session and waits for the statement to finish,
+        returns the finished statement"""
+        statement = self.client.submit_statement(session_id, code)
+        while statement.get('state') not in STATEMENT_FINISHED_STATES:
+            sleep(self.poll_interval)
+            statement = self.client.statement_info(session_id, statement['id'])
+        if statement.get('state') != 'available' or \
+                (statement.get('output') or {}).get('status') != 'ok':
+            self._failed_sessions.add(session_id)
+        return statement
@@ -0,0 +1,274 @@
+import gzip
+import io
+import re
+import threading
+import zlib
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+LEVELS = ('TRACE', 'DEBUG', 'INFO', 'WARN', 'ERROR', 'FATAL')
+LEVEL_PATTERN = re.compile(r'\b(TRACE|DEBUG|INFO|WARN(?:ING)?|ERROR|FATAL|CRITICAL)\b')
+
+LineFilter = Callable[[str], bool]
+
+
+class LevelFilter:
+    """
+    Keeps the log4j lines at or above `min_level`. Lines without a level,
+    eg. tracebacks or what the job prints itself, are kept unless
+    `keep_unleveled` is False.
+    """
+
+    def __init__(self, min_level: str = 'INFO', keep_unleveled: bool = True):
+        self.min_rank = LEVELS.index(min_level.upper())
+        self.keep_unleveled = keep_unleveled
+
+    def __call__(self, line: str) -> bool:
+        match = LEVEL_PATTERN.search(line)
+        if match is None:
+            return self.keep_unleveled
+        level = {'WARNING': 'WARN', 'CRITICAL': 'FATAL'}.get(match.group(1), match.group(1))
+        return LEVELS.index(level) >= self.min_rank
+
+
+class RegexFilter:
+    """Keeps the lines matching `include` (when given) and not matching
+    `exclude` (when given)"""
+
+    def __init__(self, include: Optional[str] = None, exclude: Optional[str] = None):
+        self.include = re.compile(include) if include else None
+        self.exclude = re.compile(exclude) if exclude else None
+
+    def __call__(self, line: str) -> bool:
+        if self.include is not None and not self.include.search(line):
+            return False
+        return self.exclude is None or not self.exclude.search(line)
+
+
+class LogSink:
+    """Receives the log lines in batches"""
+
+    def write_lines(self, lines: List[str]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TaskLogSink(LogSink):
+    """
+    Writes the lines to the task log, one write per batch. With `tail_lines`
+    only the last lines are written, when the pipeline is closed.
+    """
+
+    def __init__(self, tail_lines: Optional[int] = None):
+        self.tail_lines = tail_lines
+        self.line_count = 0
+        self._tail = deque(maxlen=tail_lines) if tail_lines else None  # type: Optional[Deque[str]]
+
+    def write_lines(self, lines):
+        self.line_count += len(lines)
+        if self._tail is not None:
+            self._tail.extend(lines)
+        else:
+            print('\n'.join(lines))
+
+    def close(self):
+        if self._tail:
+            print('last {tail} of {count} livy log lines:'.format(tail=len(self._tail),
+                                                                   count=self.line_count))
+            print('\n'.join(self._tail))
+
+
+class FileSink(LogSink):
+    """Appends the lines to a local file, gzip compressed when its name ends
+    with `.gz`"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def write_lines(self, lines):
+        if self._file is None:
+            if self.path.endswith('.gz'):
+                self._file = gzip.open(self.path, 'at', encoding='utf-8')
+            else:
+                self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class S3ChunkSink(LogSink):
+    """
+    Uploads the lines as gzip compressed chunks `part-00000.log.gz`,
+    `part-00001.log.gz`, ... under an S3 prefix. A chunk is uploaded once
+    `chunk_size` bytes of log were compressed into it, so only one
+    compressed chunk is held in memory.
+
+    :param s3_client: boto3 S3 client
+    :param bucket: the target bucket
+    :type bucket: str
+    :param prefix: the key prefix of the chunks
+    :type prefix: str
+    :param chunk_size: uncompressed bytes per chunk
+    :type chunk_size: int
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str,
+                 chunk_size: int = 64 * 1024 * 1024):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.chunk_size = chunk_size
+        self.chunk_count = 0
+        self._compressor = None
+        self._compressed = io.BytesIO()
+        self._uncompressed_size = 0
+
+    def _upload_chunk(self):
+        self._compressed.write(self._compressor.flush())
+        key = '{prefix}/part-{index:05d}.log.gz'.format(prefix=self.prefix,
+                                                        index=self.chunk_count)
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=key,
+                                      Body=self._compressed.getvalue(),
+                                      ContentType='text/plain', ContentEncoding='gzip')
+        finally:
+            # a flushed compressor cannot take more data: start a new chunk
+            # even when the upload failed, the lines of the failed one are lost
+            self.chunk_count += 1
+            self._compressor = None
+            self._compressed = io.BytesIO()
+            self._uncompressed_size = 0
+
+    def write_lines(self, lines):
+        if self._compressor is None:
+            # wbits 31: a gzip stream
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        self._compressed.write(self._compressor.compress(data))
+        self._uncompressed_size += len(data)
+        if self._uncompressed_size >= self.chunk_size:
+            self._upload_chunk()
+
+    def close(self):
+        if self._compressor is not None:
+            self._upload_chunk()
+
+
+class LogPipeline:
+    """
+    Relays log lines to sinks in batches, from a background thread.
+
+    The filters run as the lines come in, so counting filters (eg. the
+    MemoryErrorCounter) see every line even when the sinks lag. The lines
+    they let through are queued in a ring buffer of `buffer_lines` lines:
+    when the sinks do not keep up the oldest lines are dropped (and
+    counted), so the memory used does not depend on how much the job logs.
+    Only the sink calls run on the writer thread, every sink gets one call
+    per batch of up to `batch_lines` lines, written at least every
+    `flush_interval` seconds.
+
+    Use it as the line handler of `LivyBatchPoller`, and close it to flush
+    the buffer and close the sinks.
+
+    :param sinks: where the lines are written
+    :type sinks: List[LogSink]
+    :param filters: predicates a line must all pass to be written
+    :type filters: List[Callable[[str], bool]]
+    :param buffer_lines: capacity of the ring buffer
+    :type buffer_lines: int
+    :param batch_lines: lines written per sink call
+    :type batch_lines: int
+    :param flush_interval: seconds a line may wait in the buffer
+    :type flush_interval: float
+    """
+
+    def __init__(self, sinks: List[LogSink], filters: Iterable[LineFilter] = (),
+                 buffer_lines: int = 100000, batch_lines: int = 5000,
+                 flush_interval: float = 2.0):
+        self.sinks = list(sinks)
+        self.filters = list(filters)
+        self.batch_lines = batch_lines
+        self.flush_interval = flush_interval
+
+        self.received = 0
+        self.filtered = 0
+        self.dropped = 0
+        self.written = 0
+        self._buffer = deque(maxlen=buffer_lines)  # type: Deque[str]
+        self._condition = threading.Condition()
+        self._closed = False
+        self._writer = None  # type: Optional[threading.Thread]
+
+    def __call__(self, line: str):
+        self.handle_lines([line])
+
+    def handle_lines(self, lines: List[str]):
+        """filters and queues the lines, without waiting for the sinks"""
+        kept = lines
+        for line_filter in self.filters:
+            kept = [line for line in kept if line_filter(line)]
+        with self._condition:
+            self.received += len(lines)
+            self.filtered += len(lines) - len(kept)
+            overflow = len(self._buffer) + len(kept) - self._buffer.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._buffer.extend(kept)
+            if len(self._buffer) >= self.batch_lines:
+                self._condition.notify()
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_batches,
+                                                name='livy-log-sinks', daemon=True)
+                self._writer.start()
+
+    def _next_batch(self) -> Optional[List[str]]:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._closed or len(self._buffer) >= self.batch_lines,
+                timeout=self.flush_interval)
+            if self._closed and not self._buffer:
+                return None
+            count = min(len(self._buffer), self.batch_lines)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    @staticmethod
+    def _call_sink(method, *args):
+        try:
+            method(*args)
+        except Exception as ex:
+            # a failing sink must not stop the others nor the job
+            print('livy log sink {sink} failed: {error}'.format(
+                sink=type(method.__self__).__name__, error=ex))
+
+    def _write_batches(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            self.written += len(batch)
+            for sink in self.sinks:
+                self._call_sink(sink.write_lines, batch)
+
+    def close(self):
+        """writes the buffered lines and closes the sinks"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._writer is not None:
+            self._writer.join()
+        for sink in self.sinks:
+            self._call_sink(sink.close)
+        if self.dropped:
+            print('dropped {dropped} of {received} livy log lines, the log sinks '
+                  'did not keep up'.format(dropped=self.dropped, received=self.received))
+
+    def stats(self) -> Dict[str, int]:
+        return {'received': self.received, 'filtered': self.filtered,
+                'dropped': self.dropped, 'written': self.written}
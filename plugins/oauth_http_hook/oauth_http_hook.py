@@ -1,9 +1,17 @@
-from typing import Any, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
-import oauthlib.oauth2 as oauth2
 import requests
-import requests_oauthlib
 from airflow.hooks.http_hook import HttpHook
+from ddi_utils.metrics import get_metrics, hook_tags
+from oauth_http_hook.token_cache import TokenCache, get_token_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import requests_oauthlib
 
 OptionalDictAny = Optional[Dict[str, Any]]
 
@@ -11,16 +19,59 @@ OptionalDictAny = Optional[Dict[str, Any]]
 class OAuthHttpHook(HttpHook):
     """
     Add OAuth support to the basic HttpHook
+
+    The hook keeps one pooled session for all its requests, so connections
+    and TLS sessions are reused, and renews its token only when it expires.
+
+    :param token_cache: share the tokens with the other hooks of this process
+        (and of this worker with `token_cache_dir`)
+    :type token_cache: bool
+    :param token_refresh_margin: seconds before expiry at which a token is renewed
+    :type token_refresh_margin: float
+    :param token_cache_dir: directory in which the tokens are shared with the
+        other task processes of the worker
+    :type token_cache_dir: str
+    :param pool_maxsize: maximum number of connections kept alive, also the
+        default number of threads of `run_many`
+    :type pool_maxsize: int
+    :param max_retries: retries of failed connections and of 429/5xx answers
+        to idempotent requests
+    :type max_retries: int
+    :param retry_backoff: backoff factor between those retries, in seconds
+    :type retry_backoff: float
     """
 
-    def __init__(self, token_url='', *args, **kwargs) -> None:
+    def __init__(self, token_url='', *args, token_cache=True, token_refresh_margin=60,
+                 token_cache_dir=None, pool_maxsize=10, max_retries=3,
+                 retry_backoff=0.5, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.token_url = token_url
+        self.token_cache = token_cache
+        self.token_refresh_margin = token_refresh_margin
+        self.token_cache_dir = token_cache_dir
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._token_key = None
+        self._conn = None
+        self._session = None  # type: Optional[requests_oauthlib.OAuth2Session]
+        self._session_lock = threading.Lock()
+        self._local_tokens = None  # type: Optional[TokenCache]
 
     # headers may be passed through directly or in the "extra" field in the connection
     # definition
 
-    def get_conn(self, headers: OptionalDictAny = None) -> requests_oauthlib.OAuth2Session:
+    def _tokens(self) -> TokenCache:
+        if self.token_cache:
+            return get_token_cache(self.token_refresh_margin, self.token_cache_dir)
+        if self._local_tokens is None:
+            self._local_tokens = TokenCache(self.token_refresh_margin)
+        return self._local_tokens
+
+    def _create_session(self) -> 'requests_oauthlib.OAuth2Session':
+        import oauthlib.oauth2 as oauth2
+        import requests_oauthlib
+
         conn = self.get_connection(self.http_conn_id)
 
         # login and password are required
@@ -29,14 +80,15 @@ class OAuthHttpHook(HttpHook):
         client = oauth2.BackendApplicationClient(client_id=conn.login)
         session = requests_oauthlib.OAuth2Session(client=client)
 
-        # inject token to the session
-        assert self.token_url
-        session.fetch_token(
-            token_url=self.token_url,
-            client_id=conn.login,
-            client_secret=conn.password,
-            include_client_id=True
-        )
+        retry = Retry(total=self.max_retries,
+                      backoff_factor=self.retry_backoff,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
 
         if conn.host and "://" in conn.host:
             self.base_url = conn.host
@@ -54,18 +106,52 @@ class OAuthHttpHook(HttpHook):
                 session.headers.update(conn.extra_dejson)
             except TypeError:
                 self.log.warn('Connection to %s has invalid extra field.', conn.host)
-        if headers:
-            session.headers.update(headers)
 
+        self._conn = conn
+        self._token_key = (self.http_conn_id, self.token_url, conn.login)
         return session
 
+    def _inject_token(self, session: 'requests_oauthlib.OAuth2Session'):
+        # inject token to the session
+        assert self.token_url
+        conn = self._conn
+
+        def fetch_token():
+            metrics = get_metrics()
+            tags = hook_tags(self, self.http_conn_id)
+            metrics.incr('oauth.token_fetches', 1, tags)
+            with metrics.timer('oauth.token_fetch_duration', tags):
+                return session.fetch_token(
+                    token_url=self.token_url,
+                    client_id=conn.login,
+                    client_secret=conn.password,
+                    include_client_id=True
+                )
+
+        token = self._tokens().get(self._token_key, fetch_token)
+        if session.token != token:
+            session.token = token
+
+    def get_conn(self, headers: OptionalDictAny = None) -> 'requests_oauthlib.OAuth2Session':
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._create_session()
+            self._inject_token(self._session)
+
+        if headers:
+            self._session.headers.update(headers)
+
+        return self._session
+
     def run(self,
             endpoint: str,
             data: OptionalDictAny = None,
             headers: OptionalDictAny = None,
             extra_options: OptionalDictAny = None) -> requests.Response:
 
-        session = self.get_conn(headers)
+        extra_options = extra_options or {}
+        # the headers are sent with this request only, the session is shared
+        session = self.get_conn()
 
         if self.base_url and not self.base_url.endswith('/') and \
            endpoint and not endpoint.startswith('/'):
@@ -82,6 +168,8 @@ class OAuthHttpHook(HttpHook):
             allow_redirects=extra_options.get("allow_redirects", True)
         )
 
+        started_at = monotonic()
+        status = 'error'
         try:
             self.log.info("Sending '%s' to url: %s", self.method, url)
             if self.method == 'GET':
@@ -104,16 +192,52 @@ class OAuthHttpHook(HttpHook):
                                            data=data,
                                            headers=headers,
                                            **req_settings)
+            status = str(response.status_code)
 
         except requests.exceptions.ConnectionError as ex:
             self.log.warning(str(ex) + ' Tenacity will retry to execute the operation')
             raise ex
+        finally:
+            tags = dict(hook_tags(self, self.http_conn_id), status=status)
+            metrics = get_metrics()
+            metrics.timing('http.request_duration', (monotonic() - started_at) * 1000, tags)
+            metrics.incr('http.requests', 1, tags)
+
+        if response.status_code == 401 and not extra_options.get('_token_retried'):
+            # the cached token was revoked before its expiry
+            self._tokens().invalidate(self._token_key)
+            return self.run(endpoint, data, headers,
+                            dict(extra_options, _token_retried=True))
 
         if extra_options.get('check_response', True):
             self.check_response(response)
 
         return response
 
+    def run_many(self,
+                 calls: List[Union[str, Dict[str, Any]]],
+                 max_workers: Optional[int] = None,
+                 extra_options: OptionalDictAny = None) -> List[requests.Response]:
+        """
+        Runs many requests concurrently over the shared session and returns
+        the responses in the order of `calls`.
+
+        :param calls: endpoints, or dicts of `run` keyword arguments
+        :param max_workers: number of requests in flight, `pool_maxsize` by default
+        :param extra_options: `extra_options` of the calls that have none
+        """
+        # create the session and fetch the token once, before the threads
+        self.get_conn()
+
+        def run_call(call):
+            kwargs = {'endpoint': call} if isinstance(call, str) else dict(call)
+            kwargs.setdefault('extra_options', extra_options)
+            return self.run(**kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.pool_maxsize,
+                                thread_name_prefix='oauth-http') as executor:
+            return list(executor.map(run_call, calls))
+
     def run_and_check(self, *args, **kwargs) -> None:
         """Use the `run` method instead
         """
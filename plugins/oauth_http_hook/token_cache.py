@@ -0,0 +1,125 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from time import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+Token = Dict[str, Any]
+TokenKey = Tuple[str, str, str]
+
+
+class TokenCache:
+    """
+    Thread-safe cache of OAuth tokens, keyed by (conn_id, token_url, client_id).
+
+    A token is reused until `refresh_margin` seconds before its `expires_at`,
+    after which the next caller fetches a new one while the others wait for
+    it instead of fetching their own. Tokens without an expiry are not
+    cached.
+
+    With a `cache_dir` the tokens are also kept in files readable only by the
+    current user, so the task processes of a worker share them. Fetching is
+    then serialised across processes with a lock file.
+
+    :param refresh_margin: seconds before expiry at which a token is renewed
+    :type refresh_margin: float
+    :param cache_dir: directory of the file-backed tier
+    :type cache_dir: str
+    """
+
+    def __init__(self, refresh_margin: float = 60, cache_dir: Optional[str] = None):
+        self.refresh_margin = refresh_margin
+        self.cache_dir = cache_dir
+        self.fetch_count = 0
+        self._tokens = {}  # type: Dict[TokenKey, Token]
+        self._locks = {}  # type: Dict[TokenKey, threading.Lock]
+        self._locks_lock = threading.Lock()
+
+    def _key_lock(self, key: TokenKey) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _is_fresh(self, token: Optional[Token]) -> bool:
+        if not token or 'expires_at' not in token:
+            return False
+        return float(token['expires_at']) - self.refresh_margin > time()
+
+    def _path(self, key: TokenKey) -> str:
+        digest = hashlib.sha256('\0'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.json')
+
+    def _read_file(self, key: TokenKey) -> Optional[Token]:
+        try:
+            with open(self._path(key)) as token_file:
+                return json.load(token_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write_file(self, key: TokenKey, token: Token):
+        path = self._path(key)
+        temporary_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+        descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w') as token_file:
+            json.dump(token, token_file)
+        os.replace(temporary_path, path)
+
+    def _fetch_shared(self, key: TokenKey, fetch: Callable[[], Token]) -> Token:
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        with open(self._path(key) + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                token = self._read_file(key)
+                if not self._is_fresh(token):
+                    token = self._fetch(fetch)
+                    if 'expires_at' in token:
+                        self._write_file(key, token)
+                return token
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fetch(self, fetch: Callable[[], Token]) -> Token:
+        self.fetch_count += 1
+        return dict(fetch())
+
+    def get(self, key: TokenKey, fetch: Callable[[], Token]) -> Token:
+        """returns a fresh token for `key`, calling `fetch` only when
+        there is none"""
+        token = self._tokens.get(key)
+        if self._is_fresh(token):
+            return token
+
+        with self._key_lock(key):
+            token = self._tokens.get(key)
+            if self._is_fresh(token):
+                return token
+
+            if self.cache_dir:
+                token = self._fetch_shared(key, fetch)
+            else:
+                token = self._fetch(fetch)
+            if 'expires_at' in token:
+                self._tokens[key] = token
+            return token
+
+    def invalidate(self, key: TokenKey):
+        """drops the token of `key`, eg. after the API rejected it"""
+        self._tokens.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+_token_caches = {}  # type: Dict[Tuple[float, Optional[str]], TokenCache]
+_token_caches_lock = threading.Lock()
+
+
+def get_token_cache(refresh_margin: float = 60,
+                    cache_dir: Optional[str] = None) -> TokenCache:
+    """returns the process-wide token cache for these settings"""
+    with _token_caches_lock:
+        return _token_caches.setdefault((refresh_margin, cache_dir),
+                                        TokenCache(refresh_margin, cache_dir))
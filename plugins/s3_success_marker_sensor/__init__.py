@@ -0,0 +1,5 @@
+from s3_success_marker_sensor.s3_success_marker_sensor import S3SuccessMarkerSensor
+
+__all__ = [
+    'S3SuccessMarkerSensor'
+]
@@ -0,0 +1,152 @@
+from typing import Dict, Iterable, List, Set, Tuple, Union
+from urllib.parse import urlparse
+
+from airflow.sensors.base_sensor_operator import BaseSensorOperator
+from airflow.utils.decorators import apply_defaults
+from ddi_utils.metrics import get_metrics, operator_tags
+
+# markers listed in the log when some are missing, the rest is counted
+MAX_REPORTED_MARKERS = 20
+
+
+class S3SuccessMarkerSensor(BaseSensorOperator):
+    """
+    Waits for the `_SUCCESS` markers written by the HTTPSToS3Operator and the
+    SFTPToS3Operator under many prefixes of a bucket.
+
+    The markers are resolved with as few ListObjectsV2 requests as possible:
+    prefixes sharing a parent are listed together, starting right before the
+    first of them and stopping after the last one. The listing of a parent
+    goes on while its pages reach at least one marker each on average, the
+    markers left when it stops are checked with one single-key listing each,
+    as are prefixes without sibling. So a parent never takes more than one
+    request above checking its markers one by one. Every poke logs the
+    markers still missing.
+
+    The sensor runs in `reschedule` mode by default, so it holds no worker
+    slot between pokes.
+
+    :param s3_bucket: the bucket of the markers
+    :type s3_bucket: str
+    :param s3_prefixes: the prefixes (or s3 urls) the markers are written
+        under, as the `s3_prefix` of the operators writing them
+    :type s3_prefixes: List[str]
+    :param s3_conn_id: the S3 connection
+    :type s3_conn_id: str
+    """
+
+    template_fields = ('s3_bucket', 's3_prefixes')
+    ui_color = '#f0eee4'
+
+    @apply_defaults
+    def __init__(self,
+                 s3_bucket: str,
+                 s3_prefixes: Union[str, List[str]],
+                 s3_conn_id: str = 'aws_default',
+                 *args,
+                 **kwargs):
+        kwargs.setdefault('mode', 'reschedule')
+        super(S3SuccessMarkerSensor, self).__init__(*args, **kwargs)
+        self.s3_bucket = s3_bucket
+        self.s3_prefixes = s3_prefixes
+        self.s3_conn_id = s3_conn_id
+        self.request_count = 0
+
+    @staticmethod
+    def get_s3_key(s3_key):
+        """This parses the correct format for S3 keys
+            regardless of how the S3 url is passed."""
+
+        parsed_s3_key = urlparse(s3_key)
+        return parsed_s3_key.path.lstrip('/')
+
+    def _marker_keys(self) -> List[str]:
+        prefixes = [self.s3_prefixes] if isinstance(self.s3_prefixes, str) else self.s3_prefixes
+        return sorted({self.get_s3_key(f'{prefix}/_SUCCESS') for prefix in prefixes})
+
+    @staticmethod
+    def _group_by_parent(marker_keys: Iterable[str]) -> Dict[str, List[str]]:
+        """returns the sorted marker keys by the parent of their prefix"""
+        groups = {}  # type: Dict[str, List[str]]
+        for key in marker_keys:
+            prefix = key[:-len('/_SUCCESS')]
+            parent = prefix.rsplit('/', 1)[0] + '/' if '/' in prefix else ''
+            groups.setdefault(parent, []).append(key)
+        return groups
+
+    def _list(self, s3_client, **kwargs) -> dict:
+        self.request_count += 1
+        return s3_client.list_objects_v2(Bucket=self.s3_bucket, **kwargs)
+
+    def _list_parent(self, s3_client, parent: str,
+                     marker_keys: List[str]) -> Tuple[Set[str], List[str]]:
+        """
+        lists the parent from the first prefix to the last marker, returns
+        the markers found and those the listing did not reach
+        """
+        wanted = set(marker_keys)
+        found = set()
+        # the first prefix sorts before every key under it
+        kwargs = {'Prefix': parent, 'StartAfter': marker_keys[0][:-len('/_SUCCESS')]}
+        last_listed = ''
+        pages = 0
+        while True:
+            response = self._list(s3_client, **kwargs)
+            pages += 1
+            contents = response.get('Contents', [])
+            found.update(s3_object['Key'] for s3_object in contents
+                         if s3_object['Key'] in wanted)
+            if contents:
+                last_listed = contents[-1]['Key']
+            if not response.get('IsTruncated') or last_listed >= marker_keys[-1]:
+                return found, []
+            remaining = [key for key in marker_keys if key > last_listed]
+            if len(marker_keys) - len(remaining) < pages:
+                # too many objects per prefix, checking the rest one by one
+                # is cheaper
+                return found, remaining
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def _marker_exists(self, s3_client, marker_key: str) -> bool:
+        response = self._list(s3_client, Prefix=marker_key, MaxKeys=1)
+        return any(s3_object['Key'] == marker_key
+                   for s3_object in response.get('Contents', []))
+
+    def missing_markers(self, s3_client) -> List[str]:
+        """returns the marker keys not in the bucket yet"""
+        marker_keys = self._marker_keys()
+        found = set()
+        unresolved = []
+        for parent, keys in self._group_by_parent(marker_keys).items():
+            if len(keys) == 1:
+                unresolved.extend(keys)
+                continue
+            parent_found, parent_unresolved = self._list_parent(s3_client, parent, keys)
+            found.update(parent_found)
+            unresolved.extend(parent_unresolved)
+
+        found.update(key for key in unresolved if self._marker_exists(s3_client, key))
+        return [key for key in marker_keys if key not in found]
+
+    def poke(self, context):
+        from airflow.hooks.S3_hook import S3Hook
+
+        s3_client = S3Hook(self.s3_conn_id).get_conn()
+        self.request_count = 0
+        missing = self.missing_markers(s3_client)
+
+        metrics = get_metrics()
+        tags = operator_tags(self, self.s3_conn_id)
+        metrics.incr('sensor.list_requests', self.request_count, tags)
+        metrics.gauge('sensor.missing_markers', len(missing), tags)
+        metrics.flush()
+
+        if missing:
+            self.log.info('%d of %d _SUCCESS markers missing in s3://%s (%d listings): %s%s',
+                          len(missing), len(self._marker_keys()), self.s3_bucket,
+                          self.request_count, ', '.join(missing[:MAX_REPORTED_MARKERS]),
+                          ', ...' if len(missing) > MAX_REPORTED_MARKERS else '')
+            return False
+        self.log.info('all %d _SUCCESS markers found in s3://%s (%d listings)',
+                      len(self._marker_keys()), self.s3_bucket, self.request_count)
+        return True
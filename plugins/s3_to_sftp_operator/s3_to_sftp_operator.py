@@ -1,15 +1,39 @@
+import json
 import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tempfile import NamedTemporaryFile
+from time import monotonic
 
-from airflow.contrib.hooks.sftp_hook import SFTPHook
-from airflow.hooks.S3_hook import S3Hook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from ddi_utils.metrics import get_metrics, operator_tags
+
+# marks the end of an object body in the streaming buffer
+_END_OF_BODY = object()
 
 
 class S3ToSFTPOperator(BaseOperator):
     """
     This operator enables the transferring of files from S3 to a SFTP server.
+
+    :param streaming: pipe the S3 object body straight into the remote SFTP
+        file instead of going through a local temporary file. Download and
+        upload overlap and the memory used is bounded by `buffer_size`.
+    :type streaming: bool
+    :param chunk_size: bytes read from S3 at once when streaming
+    :type chunk_size: int
+    :param buffer_size: maximum bytes buffered between S3 and SFTP when streaming
+    :type buffer_size: int
+    :param max_concurrency: number of files transferred at once. Every
+        transfer thread opens its own SFTP channel on the single SSH
+        transport of the connection and all of them share one S3 client.
+    :type max_concurrency: int
+    :param etag_manifest: keep a manifest of the delivered objects and their
+        ETags in `sftp_path` and skip the objects that were already delivered
+        under the same remote file name by a previous run
+    :type etag_manifest: bool
     """
 
     ui_color = '#e8f7e4'
@@ -25,6 +49,11 @@ class S3ToSFTPOperator(BaseOperator):
                  sftp_conn_id,
                  s3_conn_id,
                  file_extensions=('.csv', '.json'),
+                 streaming=False,
+                 chunk_size=8 * 1024 * 1024,
+                 buffer_size=64 * 1024 * 1024,
+                 max_concurrency=1,
+                 etag_manifest=False,
                  * args,
                  **kwargs):
         super(S3ToSFTPOperator, self).__init__(*args, **kwargs)
@@ -39,29 +68,197 @@ class S3ToSFTPOperator(BaseOperator):
         self.sftp_conn_id = sftp_conn_id
         self.s3_conn_id = s3_conn_id
 
-    def execute(self, context):
-        sftp_hook = SFTPHook(ftp_conn_id=self.sftp_conn_id)
-        s3_hook = S3Hook(self.s3_conn_id)
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.max_concurrency = max_concurrency
+        self.etag_manifest = etag_manifest
+        self._metric_tags = None
 
-        s3_client = s3_hook.get_conn()
-        sftp_client = sftp_hook.get_conn()
+    def _stream(self, s3_client, sftp_client, s3_key, remote_path):
+        """copies the S3 object into the remote file through a bounded
+        queue of chunks, returns the number of bytes transferred"""
+        body = s3_client.get_object(Bucket=self.s3_bucket, Key=s3_key)['Body']
+        chunks = queue.Queue(maxsize=max(1, self.buffer_size // self.chunk_size))
+        stop = threading.Event()
+
+        def download():
+            try:
+                while not stop.is_set():
+                    chunk = body.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    chunks.put(chunk)
+                chunks.put(_END_OF_BODY)
+            except Exception as ex:
+                chunks.put(ex)
+            finally:
+                body.close()
 
-        s3_keys = s3_hook.list_keys(self.s3_bucket, prefix=self.s3_prefix)
+        downloader = threading.Thread(target=download, daemon=True)
+        downloader.start()
 
-        s3_keys_filtered_by_extensions = [
-            s3_key for s3_key in s3_keys if s3_key.lower().endswith(self.file_extensions)
-        ]
+        transferred = 0
+        try:
+            with sftp_client.open(remote_path, 'wb') as remote_file:
+                remote_file.set_pipelined(True)
+                while True:
+                    chunk = chunks.get()
+                    if chunk is _END_OF_BODY:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    remote_file.write(chunk)
+                    transferred += len(chunk)
+        finally:
+            stop.set()
+            # unblock the downloader if it waits on a full queue
+            while downloader.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        return transferred
 
-        part_count = 0
+    def _transfer(self, s3_client, sftp_client, s3_key, remote_path):
+        """transfers one object, returns the number of bytes transferred"""
+        with get_metrics().timer('transfer.file_duration', self._metric_tags):
+            if self.streaming:
+                return self._stream(s3_client, sftp_client, s3_key, remote_path)
 
-        for s3_key in s3_keys_filtered_by_extensions:
             with NamedTemporaryFile("w") as f:
                 s3_client.download_file(self.s3_bucket, s3_key, f.name)
+                sftp_client.put(f.name, remote_path)
+                return os.path.getsize(f.name)
 
-                _, file_extension = os.path.splitext(s3_key)
-                remote_filename = f'{self.sftp_filename_prefix}-part-{part_count}{file_extension}'
-                remote_path = os.path.join(self.sftp_path, remote_filename)
+    def _transfer_concurrently(self, s3_client, sftp_client, transfers):
+        """transfers the (s3 key, remote path, etag) tuples on
+        `max_concurrency` SFTP channels, yields every finished transfer
+        with the number of bytes transferred"""
+        import paramiko
 
-                sftp_client.put(f.name, remote_path)
+        transport = sftp_client.sftp_client.get_channel().get_transport()
+        channels = threading.local()
+        opened_channels = []
+        opened_channels_lock = threading.Lock()
+
+        def transfer(s3_key, remote_path):
+            channel = getattr(channels, 'sftp', None)
+            if channel is None:
+                channel = paramiko.SFTPClient.from_transport(transport)
+                channels.sftp = channel
+                with opened_channels_lock:
+                    opened_channels.append(channel)
+            return self._transfer(s3_client, channel, s3_key, remote_path)
+
+        in_flight = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                    thread_name_prefix='s3-to-sftp') as executor:
+                for item in transfers:
+                    if len(in_flight) >= 2 * self.max_concurrency:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield in_flight.pop(future), future.result()
+                    s3_key, remote_path, _ = item
+                    in_flight[executor.submit(transfer, s3_key, remote_path)] = item
+
+                for future in list(in_flight):
+                    yield in_flight.pop(future), future.result()
+        finally:
+            for channel in opened_channels:
+                channel.close()
+
+    def _transfer_sequentially(self, s3_client, sftp_client, transfers):
+        for item in transfers:
+            s3_key, remote_path, _ = item
+            yield item, self._transfer(s3_client, sftp_client, s3_key, remote_path)
+
+    def _list_objects(self, s3_client):
+        """yields the (key, etag) of the objects with one of the file
+        extensions, page by page while the listing goes on"""
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = iter(paginator.paginate(Bucket=self.s3_bucket, Prefix=self.s3_prefix))
+        listing_seconds = 0.0
+        while True:
+            started_at = monotonic()
+            page = next(pages, None)
+            listing_seconds += monotonic() - started_at
+            if page is None:
+                break
+            for s3_object in page.get('Contents', []):
+                if s3_object['Key'].lower().endswith(self.file_extensions):
+                    yield s3_object['Key'], s3_object['ETag']
+        get_metrics().timing('transfer.list_duration', listing_seconds * 1000,
+                             self._metric_tags)
+
+    def _transfers(self, s3_objects, manifest):
+        """yields the (s3 key, remote path, etag) tuples, the remote files are
+        named after the position of the key in the listing. Objects found in
+        the manifest under the same remote file name and ETag are skipped."""
+        for part_count, (s3_key, etag) in enumerate(s3_objects):
+            _, file_extension = os.path.splitext(s3_key)
+            remote_filename = f'{self.sftp_filename_prefix}-part-{part_count}{file_extension}'
+            if manifest.get(remote_filename) == {'key': s3_key, 'etag': etag}:
+                continue
+            yield s3_key, os.path.join(self.sftp_path, remote_filename), etag
+
+    def _manifest_path(self):
+        return os.path.join(self.sftp_path, f'.{self.sftp_filename_prefix}-manifest.json')
+
+    def _read_manifest(self, sftp_client):
+        """returns the objects delivered by the previous runs by remote file name"""
+        try:
+            with sftp_client.open(self._manifest_path(), 'r') as manifest_file:
+                return json.loads(manifest_file.read())
+        except IOError:
+            return {}
+
+    def _write_manifest(self, sftp_client, manifest):
+        """replaces the manifest through a rename, so readers never see a
+        partially written one"""
+        temporary_path = self._manifest_path() + '.tmp'
+        with sftp_client.open(temporary_path, 'w') as manifest_file:
+            manifest_file.write(json.dumps(manifest, sort_keys=True))
+        sftp_client.sftp_client.posix_rename(temporary_path, self._manifest_path())
+
+    def execute(self, context):
+        from airflow.contrib.hooks.sftp_hook import SFTPHook
+        from airflow.hooks.S3_hook import S3Hook
+        from botocore.config import Config
+
+        sftp_hook = SFTPHook(ftp_conn_id=self.sftp_conn_id)
+        s3_hook = S3Hook(self.s3_conn_id)
+        self._metric_tags = operator_tags(self, self.sftp_conn_id)
+
+        s3_client = s3_hook.get_client_type(
+            's3', config=Config(max_pool_connections=max(10, self.max_concurrency)))
+        sftp_client = sftp_hook.get_conn()
+
+        manifest = self._read_manifest(sftp_client) if self.etag_manifest else {}
+        transfers = self._transfers(self._list_objects(s3_client), manifest)
+
+        if self.max_concurrency > 1:
+            finished = self._transfer_concurrently(s3_client, sftp_client, transfers)
+        else:
+            finished = self._transfer_sequentially(s3_client, sftp_client, transfers)
+
+        started_at = monotonic()
+        files, transferred = 0, 0
+        try:
+            for (s3_key, remote_path, etag), transferred_bytes in finished:
+                manifest[os.path.basename(remote_path)] = {'key': s3_key, 'etag': etag}
+                transferred += transferred_bytes
+                files += 1
+        finally:
+            # keep what was delivered, so a retry skips it
+            if self.etag_manifest and files:
+                self._write_manifest(sftp_client, manifest)
+            metrics = get_metrics()
+            metrics.incr('transfer.files', files, self._metric_tags)
+            metrics.incr('transfer.bytes', transferred, self._metric_tags)
+            metrics.flush()
 
-                part_count += 1
+        elapsed = max(monotonic() - started_at, 1e-6)
+        self.log.info('transferred %s files, %s bytes in %.1fs (%.2f MB/s)',
+                      files, transferred, elapsed, transferred / elapsed / 1024 / 1024)
@@ -1,9 +1,12 @@
+import json
+import os
+
 from airflow.models import BaseOperator
-from airflow.hooks.S3_hook import S3Hook
-from airflow.contrib.hooks.sftp_hook import SFTPHook
 from tempfile import NamedTemporaryFile
 from urllib.parse import urlparse
 from airflow.utils.decorators import apply_defaults
+from ddi_utils import S3MultipartUpload
+from ddi_utils.metrics import get_metrics, operator_tags
 
 
 class SFTPToS3Operator(BaseOperator):
@@ -26,6 +29,20 @@ class SFTPToS3Operator(BaseOperator):
     :param s3_prefix: The targeted s3 prefix(folder). This is the specified path for
         uploading the files to S3.
     :type s3_prefix: str
+    :param streaming: read the remote file one part at a time, with
+        pipelined SFTP requests, and feed it into a S3 multipart upload
+        instead of going through a local temporary file. The memory used is
+        bounded by `(max_concurrency + 2) * part_size`.
+    :type streaming: bool
+    :param part_size: bytes per multipart part when streaming, at least 5 MiB
+    :type part_size: int
+    :param max_concurrency: number of parts uploaded at once when streaming
+    :type max_concurrency: int
+    :param incremental: only transfer the files whose size or modification
+        time changed since the last run. The attributes of the transferred
+        files are kept in a `_MANIFEST.json` next to the `_SUCCESS` marker,
+        which is replaced once all the files are transferred.
+    :type incremental: bool
     """
 
     template_fields = ('s3_bucket', 's3_prefix', 'sftp_path')
@@ -38,6 +55,10 @@ class SFTPToS3Operator(BaseOperator):
                  sftp_conn_id='ssh_default',
                  s3_conn_id='aws_default',
                  file_extensions=('.csv', '.json', '.xlsx'),
+                 streaming=False,
+                 part_size=64 * 1024 * 1024,
+                 max_concurrency=4,
+                 incremental=False,
                  *args,
                  **kwargs):
         super(SFTPToS3Operator, self).__init__(*args, **kwargs)
@@ -47,6 +68,10 @@ class SFTPToS3Operator(BaseOperator):
         self.s3_prefix = s3_prefix
         self.s3_conn_id = s3_conn_id
         self.file_extensions = file_extensions
+        self.streaming = streaming
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.incremental = incremental
 
     @staticmethod
     def get_s3_key(s3_key):
@@ -56,26 +81,109 @@ class SFTPToS3Operator(BaseOperator):
         parsed_s3_key = urlparse(s3_key)
         return parsed_s3_key.path.lstrip('/')
 
+    def _stream(self, sftp_client, s3_client, remote_path, s3_key):
+        """copies the remote file into a S3 multipart upload, returns the
+        number of bytes copied"""
+        with sftp_client.open(remote_path, 'rb') as remote_file:
+            file_size = remote_file.stat().st_size
+            with S3MultipartUpload(s3_client, self.s3_bucket, s3_key,
+                                   part_size=self.part_size,
+                                   max_concurrency=self.max_concurrency) as upload:
+                # paramiko buffers every prefetched response, so prefetching
+                # the whole file would hold it in memory whenever S3 is
+                # slower than SFTP. Only the part being read is requested,
+                # `write` blocks while max_concurrency parts are uploading.
+                for offset in range(0, file_size, upload.part_size):
+                    length = min(upload.part_size, file_size - offset)
+                    for chunk in remote_file.readv([(offset, length)]):
+                        upload.write(chunk)
+        return upload.bytes_written
+
+    def _read_manifest(self, s3_hook):
+        """returns the file attributes recorded by the previous run"""
+        s3_key = self.get_s3_key(f'{self.s3_prefix}/_MANIFEST.json')
+        if not s3_hook.check_for_key(s3_key, bucket_name=self.s3_bucket):
+            return {}
+        return json.loads(s3_hook.read_key(s3_key, bucket_name=self.s3_bucket))['files']
+
+    def _write_manifest(self, s3_hook, files):
+        s3_key = self.get_s3_key(f'{self.s3_prefix}/_MANIFEST.json')
+        s3_hook.load_string(
+            json.dumps({'files': files}, sort_keys=True),
+            key=s3_key,
+            bucket_name=self.s3_bucket,
+            replace=True
+        )
+
     def execute(self, context):
+        from airflow.contrib.hooks.sftp_hook import SFTPHook
+        from airflow.hooks.S3_hook import S3Hook
+        from botocore.config import Config
+
         sftp_hook = SFTPHook(ftp_conn_id=self.sftp_conn_id)
         s3_hook = S3Hook(self.s3_conn_id)
+        metrics = get_metrics()
+        tags = operator_tags(self, self.sftp_conn_id)
+
+        with metrics.timer('transfer.list_duration', tags):
+            if self.incremental:
+                sftp_files = {
+                    name: {'size': attributes['size'], 'modify': attributes['modify']}
+                    for name, attributes in sftp_hook.describe_directory(self.sftp_path).items()
+                    if attributes['type'] == 'file'
+                }
+                manifest = self._read_manifest(s3_hook)
+            else:
+                sftp_files = sftp_hook.list_directory(self.sftp_path)
 
-        sftp_files = sftp_hook.list_directory(self.sftp_path)
         filtered_files_by_extensions = [
             key for key in sftp_files if key.lower().endswith(self.file_extensions)
         ]
 
+        if self.incremental:
+            unchanged = {
+                key for key in filtered_files_by_extensions
+                if manifest.get(key) == sftp_files[key]
+            }
+            self.log.info('skipping %s of %s files unchanged since the last run',
+                          len(unchanged), len(filtered_files_by_extensions))
+            filtered_files_by_extensions = [
+                key for key in filtered_files_by_extensions if key not in unchanged
+            ]
+
+        if self.streaming:
+            sftp_client = sftp_hook.get_conn()
+            s3_client = s3_hook.get_client_type(
+                's3', config=Config(max_pool_connections=max(10, self.max_concurrency)))
+
+        transferred = 0
         for sftp_file in filtered_files_by_extensions:
-            with NamedTemporaryFile("w") as f:
-                sftp_hook.retrieve_file(f'{self.sftp_path}/{sftp_file}', f.name)
+            s3_key = self.get_s3_key(f'{self.s3_prefix}/{sftp_file}')
+
+            with metrics.timer('transfer.file_duration', tags):
+                if self.streaming:
+                    transferred += self._stream(sftp_client, s3_client,
+                                                f'{self.sftp_path}/{sftp_file}', s3_key)
+                    continue
+
+                with NamedTemporaryFile("w") as f:
+                    sftp_hook.retrieve_file(f'{self.sftp_path}/{sftp_file}', f.name)
+                    transferred += os.path.getsize(f.name)
+
+                    s3_hook.load_file(
+                        filename=f.name,
+                        key=s3_key,
+                        bucket_name=self.s3_bucket,
+                        replace=True
+                    )
+        metrics.incr('transfer.files', len(filtered_files_by_extensions), tags)
+        metrics.incr('transfer.bytes', transferred, tags)
 
-                s3_key = self.get_s3_key(f'{self.s3_prefix}/{sftp_file}')
-                s3_hook.load_file(
-                    filename=f.name,
-                    key=s3_key,
-                    bucket_name=self.s3_bucket,
-                    replace=True
-                )
+        if self.incremental:
+            self._write_manifest(s3_hook, {
+                key: attributes for key, attributes in sftp_files.items()
+                if key.lower().endswith(self.file_extensions)
+            })
 
         # Add the empty _SUCCESS file to indicate the task is done successfully
         s3_key = self.get_s3_key(f'{self.s3_prefix}/_SUCCESS')
@@ -85,3 +193,4 @@ class SFTPToS3Operator(BaseOperator):
             bucket_name=self.s3_bucket,
             replace=True
         )
+        metrics.flush()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the plugin packages are imported from the plugins folder, as Airflow does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'plugins'))
@@ -0,0 +1,101 @@
+import pytest
+
+from ddi_utils import rate_limit
+from ddi_utils.rate_limit import TokenBucket
+from livy_operator import livy_resilience
+from livy_operator.livy_resilience import (CircuitBreaker, RetryPolicy,
+                                           get_circuit_breaker, get_rate_limiter)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(livy_resilience, 'monotonic', clock)
+    monkeypatch.setattr(rate_limit, 'monotonic', clock)
+    return clock
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=5.0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.wait_time() == 0.0
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.wait_time() == pytest.approx(5.0)
+    clock.now += 2
+    assert breaker.wait_time() == pytest.approx(3.0)
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_single_probe_closes_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5.0)
+    breaker.record_failure()
+    clock.now += 5
+    assert breaker.wait_time() == 0.0  # the probe
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.wait_time() > 0  # the others wait for it
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.wait_time() == 0.0
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5.0)
+    breaker.record_failure()
+    clock.now += 5
+    breaker.wait_time()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 2
+    assert breaker.wait_time() == pytest.approx(5.0)
+
+
+def test_lost_probe_is_replaced(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5.0, probe_timeout=60.0)
+    breaker.record_failure()
+    clock.now += 5
+    breaker.wait_time()
+    clock.now += 60
+    assert breaker.wait_time() == 0.0
+
+
+def test_retry_delays_are_bounded():
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=4.0)
+    for attempt in range(10):
+        assert 0 <= policy.delay(attempt) <= min(4.0, 0.5 * 2 ** attempt)
+    assert policy.delay(0, retry_after='3') == 3.0
+    assert policy.delay(0, retry_after='120') == 4.0
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(rate=10.0, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.1)
+    clock.now += 0.1
+    assert bucket.try_acquire() == 0.0
+    clock.now += 10
+    assert [bucket.try_acquire() for _ in range(4)][-1] > 0
+
+
+def test_registries_are_shared_per_server():
+    assert get_circuit_breaker('livy-a', 8998) is get_circuit_breaker('livy-a', 8998)
+    assert get_circuit_breaker('livy-a', 8998) is not get_circuit_breaker('livy-b', 8998)
+    limiter = get_rate_limiter('livy-a', 8998, 5.0)
+    assert get_rate_limiter('livy-a', 8998, 50.0) is limiter
+    assert limiter.rate == 5.0 and limiter.capacity == 10.0
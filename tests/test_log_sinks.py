@@ -0,0 +1,102 @@
+import threading
+from time import sleep
+
+from livy_operator.log_sinks import LevelFilter, LogPipeline, LogSink, RegexFilter
+
+
+class BlockedSink(LogSink):
+    """holds every write until `release` is set"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lines = []
+        self.closed = False
+
+    def write_lines(self, lines):
+        self.release.wait()
+        self.lines.extend(lines)
+
+    def close(self):
+        self.closed = True
+
+
+class FailingSink(LogSink):
+    def write_lines(self, lines):
+        raise IOError('sink down')
+
+
+def test_level_filter():
+    line_filter = LevelFilter('WARN', keep_unleveled=False)
+    assert line_filter('20/01/01 12:00:00 ERROR Executor: lost')
+    assert line_filter('WARNING something')
+    assert not line_filter('20/01/01 12:00:00 INFO Executor: started')
+    assert not line_filter('Traceback (most recent call last):')
+
+
+def test_regex_filter():
+    line_filter = RegexFilter(include='Executor', exclude='heartbeat')
+    assert line_filter('Executor lost')
+    assert not line_filter('Executor heartbeat')
+    assert not line_filter('Driver started')
+
+
+def test_lines_are_written_in_order():
+    sink = BlockedSink()
+    sink.release.set()
+    pipeline = LogPipeline([sink], batch_lines=7)
+    for index in range(100):
+        pipeline('line {}'.format(index))
+    pipeline.close()
+    assert sink.lines == ['line {}'.format(index) for index in range(100)]
+    assert sink.closed
+    assert pipeline.stats() == {'received': 100, 'filtered': 0, 'dropped': 0,
+                                'written': 100}
+
+
+def test_overflow_drops_the_oldest_lines_and_counts_them():
+    sink = BlockedSink()
+    pipeline = LogPipeline([sink], buffer_lines=10, batch_lines=10, flush_interval=0.01)
+    pipeline.handle_lines(['first {}'.format(index) for index in range(10)])
+    # wait for the writer to hold the first batch in the blocked sink
+    while pipeline.written < 10:
+        sleep(0.001)
+    pipeline.handle_lines(['line {}'.format(index) for index in range(25)])
+    sink.release.set()
+    pipeline.close()
+
+    stats = pipeline.stats()
+    assert stats['received'] == 35
+    assert stats['dropped'] == 15
+    assert stats['written'] == stats['received'] - stats['dropped'] == 20
+    assert sink.lines[10:] == ['line {}'.format(index) for index in range(15, 25)]
+
+
+def test_filters_see_every_line_even_when_lines_are_dropped():
+    sink = BlockedSink()
+    seen = []
+
+    def counter(line):
+        seen.append(line)
+        return True
+
+    pipeline = LogPipeline([sink], filters=[counter, RegexFilter(exclude='DEBUG')],
+                           buffer_lines=5, batch_lines=5)
+    pipeline.handle_lines(['DEBUG {}'.format(index) for index in range(20)] +
+                          ['INFO {}'.format(index) for index in range(20)])
+    sink.release.set()
+    pipeline.close()
+
+    assert len(seen) == 40
+    stats = pipeline.stats()
+    assert stats['filtered'] == 20
+    assert stats['dropped'] == 15
+    assert sink.lines == ['INFO {}'.format(index) for index in range(15, 20)]
+
+
+def test_a_failing_sink_does_not_stop_the_others():
+    sink = BlockedSink()
+    sink.release.set()
+    pipeline = LogPipeline([FailingSink(), sink])
+    pipeline.handle_lines(['a', 'b'])
+    pipeline.close()
+    assert sink.lines == ['a', 'b']
@@ -0,0 +1,98 @@
+import json
+import threading
+
+from https_to_s3_operator.pagination import (CursorPagination, OffsetPagination,
+                                             PageFetcher, PagePagination, get_field)
+
+
+class Response:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode('utf-8')
+
+
+class PagedAPI:
+    """serves `item_count` items, `page_size` per page"""
+
+    def __init__(self, item_count, page_size=10):
+        self.items = list(range(item_count))
+        self.page_size = page_size
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __call__(self, params):
+        with self._lock:
+            self.requests.append(dict(params))
+        if 'page' in params:
+            start = (params['page'] - 1) * self.page_size
+        elif 'offset' in params:
+            start = params['offset']
+        else:
+            start = int(params.get('cursor', 0))
+        items = self.items[start:start + self.page_size]
+        end = start + len(items)
+        return Response({'data': {'items': items},
+                         'total': len(self.items),
+                         'pages': -(-len(self.items) // self.page_size),
+                         'next': str(end) if end < len(self.items) else None})
+
+
+def fetched_items(fetcher):
+    pages = sorted(fetcher.pages(), key=lambda page: page[0])
+    return [item for _, _, payload in pages for item in payload['data']['items']]
+
+
+def test_get_field():
+    assert get_field({'a': {'b': 1}}, 'a.b') == 1
+    assert get_field({'a': [1]}, 'a.b') is None
+    assert get_field([1], None) == [1]
+
+
+def test_page_params():
+    pagination = PagePagination(size_param='per_page', page_size=50)
+    assert pagination.params_for(2) == {'page': 3, 'per_page': 50}
+
+
+def test_offset_page_count():
+    pagination = OffsetPagination(limit=10, total_field='total')
+    assert pagination.params_for(3) == {'offset': 30, 'limit': 10}
+    assert pagination.page_count({'total': 41}) == 5
+
+
+def test_counted_pages_are_fetched_once():
+    api = PagedAPI(95)
+    fetcher = PageFetcher(api, PagePagination(items_field='data.items',
+                                              total_pages_field='pages'),
+                          max_workers=4)
+    assert fetched_items(fetcher) == api.items
+    assert fetcher.request_count == len(api.requests) == 10
+
+
+def test_probed_pages_stop_at_the_first_empty_page():
+    api = PagedAPI(95)
+    fetcher = PageFetcher(api, OffsetPagination(limit=10, items_field='data.items'),
+                          max_workers=3)
+    assert fetched_items(fetcher) == api.items
+    # the first page, then waves of 3 pages up to the one holding the empty page
+    assert 11 <= fetcher.request_count <= 1 + 4 * 3
+
+
+def test_cursor_pages_are_chained():
+    api = PagedAPI(25)
+    fetcher = PageFetcher(api, CursorPagination(cursor_field='next',
+                                                items_field='data.items'),
+                          max_workers=4)
+    assert fetched_items(fetcher) == api.items
+    assert [request.get('cursor') for request in api.requests] == [None, '10', '20']
+
+
+def test_max_pages():
+    api = PagedAPI(95)
+    fetcher = PageFetcher(api, PagePagination(items_field='data.items',
+                                              total_pages_field='pages'),
+                          max_workers=2, max_pages=3)
+    assert fetched_items(fetcher) == api.items[:30]
+
+
+def test_empty_first_page():
+    fetcher = PageFetcher(PagedAPI(0), PagePagination(items_field='data.items'))
+    assert list(fetcher.pages()) == []
@@ -0,0 +1,56 @@
+from livy_operator.livy_run_history import ResourceRecommender
+
+
+def run(executors, memory, runtime, state='success', memory_errors=0):
+    return {'state': state, 'runtime': runtime, 'memory_errors': memory_errors,
+            'conf': {'spark.executor.instances': str(executors),
+                     'spark.executor.memory': memory}}
+
+
+CONF = {'spark.executor.instances': '40', 'spark.executor.memory': '8g'}
+
+
+def test_empty_history_recommends_nothing():
+    assert ResourceRecommender().recommend([], CONF) == {}
+
+
+def test_keeps_the_settings_until_enough_runs():
+    runs = [run(40, '8g', 100), run(40, '8g', 100)]
+    assert ResourceRecommender().recommend(runs, CONF) == {}
+
+
+def test_probes_fewer_executors_first():
+    runs = [run(40, '8g', 100)] * 3
+    assert ResourceRecommender().recommend(runs, CONF) == {'spark.executor.instances': '30'}
+
+
+def test_lowers_memory_once_the_executor_count_settled():
+    # 30 executors were too slow, 40 stays
+    runs = [run(40, '8g', 100)] * 3 + [run(30, '8g', 200)] * 3 + [run(40, '8g', 100)] * 3
+    assert ResourceRecommender().recommend(runs, CONF) == {'spark.executor.memory': '6144m'}
+
+
+def test_raises_memory_after_a_memory_error_without_changing_executors():
+    runs = [run(30, '4g', 50, state='dead', memory_errors=2)] + [run(40, '8g', 100)] * 3
+    conf = {'spark.executor.instances': '30', 'spark.executor.memory': '4g'}
+    assert ResourceRecommender().recommend(runs, conf) == {'spark.executor.memory': '6144m'}
+
+
+def test_does_not_lower_memory_close_to_a_failed_setting():
+    runs = [run(40, '6g', 100)] * 3 + [run(40, '4g', 50, state='dead', memory_errors=1)] + \
+        [run(30, '6g', 200)] * 3
+    conf = {'spark.executor.instances': '40', 'spark.executor.memory': '6g'}
+    assert ResourceRecommender().recommend(runs, conf) == {}
+
+
+def test_goes_back_up_when_lowering_memory_slowed_the_job():
+    runs = [run(40, '6g', 150)] * 3 + [run(40, '8g', 100)] * 3 + [run(30, '8g', 200)] * 3
+    conf = {'spark.executor.instances': '40', 'spark.executor.memory': '6g'}
+    assert ResourceRecommender().recommend(runs, conf) == {'spark.executor.memory': '8192m'}
+
+
+def test_ignores_runs_without_executor_bound():
+    conf = {'spark.dynamicAllocation.enabled': 'true'}
+    runs = [{'state': 'success', 'runtime': 100, 'memory_errors': 0, 'conf': conf}] * 3
+    assert 'spark.dynamicAllocation.maxExecutors' not in \
+        ResourceRecommender().recommend(runs, conf)
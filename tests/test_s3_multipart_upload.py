@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from ddi_utils.s3_multipart_upload import MIN_PART_SIZE, S3MultipartUpload
+
+
+class S3Client:
+    """records the multipart calls, `fail_part` makes that part fail"""
+
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.objects = {}
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError('part {} failed'.format(PartNumber))
+        with self._lock:
+            self.parts[PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = MultipartUpload['Parts']
+        self.objects[Key] = b''.join(self.parts[part['PartNumber']]
+                                     for part in self.completed)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+
+def test_small_object_is_put_at_once():
+    client = S3Client()
+    with S3MultipartUpload(client, 'bucket', 'key') as upload:
+        upload.write(b'data')
+    assert client.objects == {'key': b'data'}
+    assert upload.upload_id is None
+
+
+def test_parts_are_completed_in_order():
+    client = S3Client()
+    data = bytes(range(256)) * (MIN_PART_SIZE * 5 // 2 // 256)
+    with S3MultipartUpload(client, 'bucket', 'key', part_size=MIN_PART_SIZE,
+                           max_concurrency=2) as upload:
+        for start in range(0, len(data), 1024 * 1024):
+            upload.write(data[start:start + 1024 * 1024])
+    assert client.objects['key'] == data
+    assert [part['PartNumber'] for part in client.completed] == [1, 2, 3]
+    assert [part['ETag'] for part in client.completed] == ['etag-1', 'etag-2', 'etag-3']
+    assert not client.aborted
+
+
+def test_failed_part_aborts_the_upload():
+    client = S3Client(fail_part=2)
+    with pytest.raises(IOError):
+        with S3MultipartUpload(client, 'bucket', 'key', part_size=MIN_PART_SIZE,
+                               max_concurrency=1) as upload:
+            upload.write(b'x' * (3 * MIN_PART_SIZE))
+    assert client.aborted
+    assert client.completed is None
+    assert 'key' not in client.objects
+
+
+def test_exception_in_the_block_aborts_the_upload():
+    client = S3Client()
+    with pytest.raises(RuntimeError):
+        with S3MultipartUpload(client, 'bucket', 'key', part_size=MIN_PART_SIZE) as upload:
+            upload.write(b'x' * MIN_PART_SIZE)
+            raise RuntimeError('source failed')
+    assert client.aborted
+    assert client.completed is None
+
+
+def test_write_after_close_fails():
+    upload = S3MultipartUpload(S3Client(), 'bucket', 'key')
+    upload.complete()
+    with pytest.raises(ValueError):
+        upload.write(b'data')
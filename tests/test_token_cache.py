@@ -0,0 +1,86 @@
+import os
+import stat
+from time import time
+
+from oauth_http_hook import token_cache
+from oauth_http_hook.token_cache import TokenCache
+
+KEY = ('conn', 'https://auth/token', 'client')
+
+
+class Fetch:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        token = {'access_token': 'token-{}'.format(self.count)}
+        if self.expires_in is not None:
+            token['expires_at'] = time() + self.expires_in
+        return token
+
+
+def test_reuses_a_fresh_token():
+    cache = TokenCache()
+    fetch = Fetch()
+    assert cache.get(KEY, fetch) == cache.get(KEY, fetch)
+    assert fetch.count == 1
+
+
+def test_renews_a_token_within_the_refresh_margin(monkeypatch):
+    cache = TokenCache(refresh_margin=60)
+    fetch = Fetch(expires_in=120)
+    now = time()
+    monkeypatch.setattr(token_cache, 'time', lambda: now)
+    cache.get(KEY, fetch)
+    monkeypatch.setattr(token_cache, 'time', lambda: now + 61)
+    assert cache.get(KEY, fetch)['access_token'] == 'token-2'
+
+
+def test_does_not_cache_tokens_without_expiry():
+    cache = TokenCache()
+    fetch = Fetch(expires_in=None)
+    cache.get(KEY, fetch)
+    cache.get(KEY, fetch)
+    assert fetch.count == 2
+
+
+def test_invalidate():
+    cache = TokenCache()
+    fetch = Fetch()
+    cache.get(KEY, fetch)
+    cache.invalidate(KEY)
+    assert cache.get(KEY, fetch)['access_token'] == 'token-2'
+
+
+def test_file_tier_is_shared_and_private(tmp_path):
+    cache_dir = str(tmp_path / 'tokens')
+    fetch = Fetch()
+    token = TokenCache(cache_dir=cache_dir).get(KEY, fetch)
+    # another process starts with an empty memory tier
+    assert TokenCache(cache_dir=cache_dir).get(KEY, fetch) == token
+    assert fetch.count == 1
+
+    token_files = [name for name in os.listdir(cache_dir) if name.endswith('.json')]
+    assert len(token_files) == 1
+    mode = os.stat(os.path.join(cache_dir, token_files[0])).st_mode
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_file_tier_renews_an_expired_token(tmp_path):
+    cache_dir = str(tmp_path)
+    TokenCache(cache_dir=cache_dir).get(KEY, Fetch(expires_in=30))
+    fetch = Fetch()
+    TokenCache(refresh_margin=60, cache_dir=cache_dir).get(KEY, fetch)
+    assert fetch.count == 1
+
+
+def test_file_tier_invalidate(tmp_path):
+    cache_dir = str(tmp_path)
+    cache = TokenCache(cache_dir=cache_dir)
+    cache.get(KEY, Fetch())
+    cache.invalidate(KEY)
+    fetch = Fetch()
+    TokenCache(cache_dir=cache_dir).get(KEY, fetch)
+    assert fetch.count == 1